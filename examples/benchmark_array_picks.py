@@ -0,0 +1,63 @@
+"""
+Compare filtering picks in SQLite and numpy pick databases
+
+Usage: python benchmark_array_picks.py [npicks]
+"""
+from __future__ import division, print_function
+import sys
+import time
+import numpy as np
+from pyvm.picks.pickdb import PickDatabase
+from pyvm.picks.arraystore import ArrayPickDatabase
+
+npicks = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+nrec = 100
+nsrc = int(np.ceil(npicks / nrec))
+
+# survey geometry and picks
+sources = np.column_stack((np.arange(nsrc), np.random.rand(nsrc, 3)))
+receivers = np.column_stack((np.arange(nrec), np.random.rand(nrec, 3)))
+srcid, recid = [v.ravel()[:npicks] for v in
+                np.meshgrid(np.arange(nsrc), np.arange(nrec), indexing='ij')]
+picks = {'event': np.where(srcid % 2, 'Pg', 'Pn').astype(object),
+         'srcid': srcid, 'recid': recid, 'time': np.random.rand(npicks)}
+
+queries = [('event', {'event': 'Pn'}),
+           ('offset range', {'offset__between': (0.2, 0.4)}),
+           ('receivers and branch', {'recid': list(range(0, nrec, 2)),
+                                     'branchid': 1})]
+
+
+def report(label, n, seconds):
+    print('{:<40s} {:>9d} rows {:>10.4f} s'.format(label, n, seconds))
+
+
+db = PickDatabase()
+db.add_event('Pg', branchid=1)
+db.add_event('Pn', branchid=2)
+db.add_sources(sources)
+db.add_receivers(receivers)
+db.add_picks(picks)
+
+start = time.time()
+adb = ArrayPickDatabase.from_pickdb(db)
+report('ArrayPickDatabase.from_pickdb', npicks, time.time() - start)
+
+for label, query in queries:
+    start = time.time()
+    n = db.count('master_picks', **query)
+    report('SQLite count: ' + label, n, time.time() - start)
+
+    start = time.time()
+    data = db.select('master_picks', fields=['srcid', 'recid', 'offset',
+                                             'time'], **query).fetchall()
+    report('SQLite select: ' + label, len(data), time.time() - start)
+
+    start = time.time()
+    n = adb.count('master_picks', **query)
+    report('numpy count: ' + label, n, time.time() - start)
+
+    start = time.time()
+    data = adb.select('master_picks', fields=['srcid', 'recid', 'offset',
+                                              'time'], **query)
+    report('numpy select: ' + label, len(data), time.time() - start)
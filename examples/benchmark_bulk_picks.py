@@ -0,0 +1,69 @@
+"""
+Compare loading picks one at a time and in bulk
+
+Usage: python benchmark_bulk_picks.py [npicks]
+"""
+from __future__ import division, print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+from pyvm.picks.pickdb import PickDatabase
+
+npicks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+nrec = 100
+nsrc = int(np.ceil(npicks / nrec))
+
+# survey geometry and picks
+sources = np.column_stack((np.arange(nsrc), np.random.rand(nsrc, 3)))
+receivers = np.column_stack((np.arange(nrec), np.random.rand(nrec, 3)))
+srcid, recid = [v.ravel()[:npicks] for v in
+                np.meshgrid(np.arange(nsrc), np.arange(nrec), indexing='ij')]
+picks = list(zip(['Pg'] * npicks, srcid.tolist(), recid.tolist(),
+                 np.random.rand(npicks).tolist(), [0.05] * npicks))
+
+
+def new_database(path):
+    if os.path.isfile(path):
+        os.remove(path)
+    db = PickDatabase(path)
+    db.add_event('Pg', branchid=1)
+    db.add_sources(sources)
+    db.add_receivers(receivers)
+    return db
+
+
+def report(label, n, seconds):
+    print('{:<32s} {:>9d} rows {:>8.2f} s {:>12.0f} rows/s'.format(label,
+          n, seconds, n / seconds))
+
+
+workdir = tempfile.mkdtemp()
+try:
+    path = os.path.join(workdir, 'picks.sqlite')
+
+    # one INSERT and commit per pick (limited to keep the run short)
+    n = min(npicks, 2000)
+    db = new_database(path)
+    start = time.time()
+    for pick in picks[:n]:
+        db.add_pick(*pick)
+        db.commit()
+    report('add_pick, commit each', n, time.time() - start)
+    db.close()
+
+    db = new_database(path)
+    start = time.time()
+    db.add_picks(picks)
+    report('add_picks', npicks, time.time() - start)
+    db.close()
+
+    db = new_database(path)
+    start = time.time()
+    db.add_picks(picks, fast=True)
+    report('add_picks, fast=True', npicks, time.time() - start)
+    db.close()
+finally:
+    shutil.rmtree(workdir)
@@ -1 +1 @@
-from backends.sqlite3.connection import Connection
+from pyvm.db.backends.sqlite3.connection import Connection
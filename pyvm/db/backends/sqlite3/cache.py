@@ -0,0 +1,146 @@
+"""
+Least-recently-used cache for query results.
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def result_nbytes(value):
+    """
+    Estimate the memory used by a query result.
+
+    :param value: :class:`pandas.DataFrame` or :class:`numpy.ndarray`.
+    :returns: Size in bytes.
+    """
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return int(value.nbytes)
+
+
+def read_only_result(value):
+    """
+    Mark the numpy buffers of a query result as read-only.
+
+    :param value: :class:`pandas.DataFrame` or :class:`numpy.ndarray`.
+    :returns: ``value``, which can no longer be modified in place.
+    """
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+        return value
+    manager = getattr(value, '_mgr', None)
+    if manager is None:
+        manager = value._data
+    for block in manager.blocks:
+        # extension arrays (e.g., pandas strings) have no writeable flag
+        if isinstance(block.values, np.ndarray):
+            block.values.setflags(write=False)
+    return value
+
+
+class ResultCache(object):
+    """
+    Least-recently-used cache for query results with a memory budget.
+
+    Safe to share between threads.
+    """
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        """
+        Least-recently-used cache for query results with a memory budget.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            Memory budget for all cached results. Results larger than the
+            budget are not cached, and nothing is cached if the budget is
+            zero. Default is 256 MiB.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, version):
+        """
+        Return a cached result.
+
+        Parameters
+        ----------
+        key : hashable
+            Key for the query (e.g., the SQL text and parameters).
+        version : hashable
+            Version of the data the result must have been read from.
+            Results read from other versions are removed.
+
+        Returns
+        -------
+        value : object
+            Cached result, or ``None`` if there is no result for ``key`` and
+            ``version``.
+        """
+        with self._lock:
+            return self._get(key, version)
+
+    def _get(self, key, version):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] != version:
+            if entry is not None:
+                self.nbytes -= entry[2]
+            self.misses += 1
+            return None
+        # re-insert as the most recently used entry
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, version, value, nbytes=None):
+        """
+        Add a result to the cache.
+
+        Least recently used results are removed until the cache fits its
+        memory budget.
+
+        Parameters
+        ----------
+        key, version : hashable
+            See :meth:`get`.
+        value : object
+            Result to cache.
+        nbytes : int, optional
+            Size of the result. Default is to estimate it with
+            :func:`result_nbytes`.
+        """
+        if nbytes is None:
+            nbytes = result_nbytes(value)
+        with self._lock:
+            self._put(key, version, value, nbytes)
+
+    def _put(self, key, version, value, nbytes):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+        if self.max_bytes <= 0 or nbytes > self.max_bytes:
+            return
+        self._entries[key] = (version, value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+
+    def clear(self):
+        """
+        Remove all results from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
@@ -5,12 +5,20 @@ from __future__ import (absolute_import, division, print_function,
         unicode_literals)
 import os
 import logging
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 from pandas.io import sql as psql
 from pyvm.utils.loaders import get_resource_file
 from pyvm.db.backends.sqlite3.base import dbapi2, load_spatialite,\
         SPATIALITE_ENABLED, OperationalError, IntegrityError,\
         ConfigurationError
+from pyvm.db.backends.sqlite3.utils import CONFLICT_MODES, iter_rows,\
+        build_where, check_identifier, infer_dtype, promote_dtype
+from pyvm.db.backends.sqlite3.profiling import QueryProfile, ProfilingCursor
+
+# Number of prepared statements to keep for reuse on each connection
+CACHED_STATEMENTS = 256
 
 
 def _process_exception(exception, message, warn=False):
@@ -49,18 +57,23 @@ class Connection(dbapi2.Connection):
 
     ConfigurationError = ConfigurationError
 
-    def __init__(self, database=':memory:', spatial=False):
+    def __init__(self, database=':memory:', spatial=False,
+            cached_statements=CACHED_STATEMENTS, check_same_thread=True):
 
         if os.path.isfile(database):
-            logging.info('Connecting to existing database: {:}',
-                    database)
+            logging.info('Connecting to existing database: %s', database)
         else:
-            logging.info('Creating new database: {:}', database)
+            logging.info('Creating new database: %s', database)
 
-        dbapi2.Connection.__init__(self, database)
+        dbapi2.Connection.__init__(self, database,
+                cached_statements=cached_statements,
+                check_same_thread=check_same_thread)
         self.row_factory = dbapi2.Row
 
-	self.spatialite_enabled = SPATIALITE_ENABLED
+        # Statistics for SQL statements, recorded after start_profiling()
+        self.profile = QueryProfile()
+
+        self.spatialite_enabled = SPATIALITE_ENABLED
 
         if spatial:
             self.init_spatialite()
@@ -144,6 +157,95 @@ class Connection(dbapi2.Connection):
 
     views = property(_get_views)
 
+    def _get_triggers(self):
+        """
+        Returns a list of triggers in the database.
+        """
+        sql = "SELECT name FROM sqlite_master WHERE type='trigger'"
+        return [d[0] for d in self.execute(sql)]
+
+    triggers = property(_get_triggers)
+
+    def _get_indexes(self):
+        """
+        Returns a list of indexes in the database.
+
+        Indexes created automatically for primary keys and unique
+        constraints are not included.
+        """
+        sql = "SELECT name FROM sqlite_master WHERE type='index'"
+        sql += " AND sql IS NOT NULL"
+        return [d[0] for d in self.execute(sql)]
+
+    indexes = property(_get_indexes)
+
+    def create_index(self, name, table, fields, unique=False):
+        """
+        Creates an index on a table.
+
+        Parameters
+        ----------
+        name: str
+            Name of the index.
+        table: str
+            Name of the table to index.
+        fields: list
+            Names of the fields to index, in order.
+        unique: bool, optional
+            Determines whether or not to require unique values for the
+            fields.
+        """
+        sql = 'CREATE'
+        if unique:
+            sql += ' UNIQUE'
+        sql += " INDEX IF NOT EXISTS '{:}' ON '{:}' ({:})".format(name,
+                table, ', '.join(fields))
+        self.execute(sql)
+
+    def drop_index(self, name):
+        """
+        Removes an index.
+
+        Parameters
+        ----------
+        name: str
+            Name of the index.
+        """
+        self.execute("DROP INDEX IF EXISTS '{:}'".format(name))
+
+    def analyze(self):
+        """
+        Gathers statistics about tables and indexes for the query planner.
+
+        Should be run after adding or removing large amounts of data.
+        """
+        self.commit()
+        self.execute('ANALYZE')
+        self.commit()
+
+    def explain(self, sql, params=()):
+        """
+        Returns the query plan for a SQL statement.
+
+        Parameters
+        ----------
+        sql: str
+            SQL statement to explain.
+        params: tuple, optional
+            Parameters for the SQL statement.
+
+        Returns
+        -------
+        plan: :class:`pandas.DataFrame`
+            Query plan with one row per step. The ``detail`` column
+            describes each step (e.g., ``'SCAN picks'`` or ``'SEARCH picks
+            USING INDEX picks_recid (recid=?)'``).
+        """
+        cursor = self.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        columns = [d[0] for d in cursor.description]
+        return pd.DataFrame([tuple(r) for r in cursor.fetchall()],
+                            columns=columns)
+
     def count(self, table, **kwargs):
         """
         Get the number of rows in a table.
@@ -153,13 +255,62 @@ class Connection(dbapi2.Connection):
         table: str
             Name of table to get count from.
         **kwargs
-            Keyword arguments for WHERE statements in the query
+            Keyword arguments for WHERE statements in the query. See
+            :func:`pyvm.db.backends.sqlite3.utils.build_where`.
         """
-        sql = 'SELECT COUNT(*) FROM {:}'.format(table)
-        if len(kwargs) > 0:
-            values = ['{:}="{:}"'.format(k, kwargs[k]) for k in kwargs]
-            sql += ' WHERE ' + ' and '.join(values)
-        return self.execute(sql).fetchall()[0][0]
+        sql = 'SELECT COUNT(*) FROM {:}'.format(check_identifier(table))
+        where, params = build_where(kwargs)
+        if where:
+            sql += ' WHERE ' + where
+        return self.execute(sql, params).fetchall()[0][0]
+
+    def select(self, table, fields=None, order_by=None, limit=None,
+            distinct=False, **kwargs):
+        """
+        Selects rows from a table or view.
+
+        Parameters
+        ----------
+        table: str
+            Name of table or view to select from.
+        fields: list, optional
+            Names of fields to select. Default is to select all fields.
+        order_by: {str, list}, optional
+            Name or names of fields to sort rows by.
+        limit: int, optional
+            Maximum number of rows to select.
+        distinct: bool, optional
+            Determines whether or not to only select unique rows.
+        **kwargs
+            Keyword arguments for WHERE statements in the query. See
+            :func:`pyvm.db.backends.sqlite3.utils.build_where`.
+
+        Returns
+        -------
+        cursor: :class:`sqlite3.Cursor`
+            Cursor for iterating over the selected rows.
+        """
+        if fields is None:
+            fields = ['*']
+        else:
+            fields = [check_identifier(f) for f in fields]
+        sql = 'SELECT '
+        if distinct:
+            sql += 'DISTINCT '
+        sql += '{:} FROM {:}'.format(', '.join(fields),
+                                     check_identifier(table))
+        where, params = build_where(kwargs)
+        if where:
+            sql += ' WHERE ' + where
+        if order_by is not None:
+            if not isinstance(order_by, (list, tuple)):
+                order_by = [order_by]
+            sql += ' ORDER BY ' + ', '.join([check_identifier(f)
+                                             for f in order_by])
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return self.execute(sql, params)
 
     def execute(self, *args, **kwargs):
         """
@@ -167,12 +318,14 @@ class Connection(dbapi2.Connection):
         """
         warn = kwargs.pop('warn_only', False)
 
-        logging.debug('Executing SQL:\n{:}', *args)
+        logging.debug('Executing SQL:\n%s', args[0])
         try:
+            if self.profile.enabled:
+                return self.cursor().execute(*args)
             return dbapi2.Connection.execute(self, *args)
         except Exception as e:
             msg = "execute() failed with '{:}: {:}'"\
-                    .format(e.__class__.__name__, e.message)
+                    .format(e.__class__.__name__, e)
             msg += ' while executing: {:}'.format(*args)
 
             _process_exception(e, msg, warn=warn)
@@ -183,16 +336,98 @@ class Connection(dbapi2.Connection):
         """
         warn = kwargs.pop('warn_only', False)
 
-        logging.debug('Executing SQL:\n{:}', args[0])
+        logging.debug('Executing SQL:\n%s', args[0])
         try:
+            if self.profile.enabled:
+                return self.cursor().executemany(*args)
             return dbapi2.Connection.executemany(self, *args)
         except Exception as e:
             msg = "executemany() failed with '{:}: {:}'"\
-                    .format(e.__class__.__name__, e.message)
+                    .format(e.__class__.__name__, e)
             msg += ' while executing: {:}'.format(args[0])
             
             _process_exception(e, msg, warn=warn)
 
+    def cursor(self, factory=None):
+        """
+        Returns a new cursor.
+
+        Parameters
+        ----------
+        factory: type, optional
+            Subclass of :class:`sqlite3.Cursor` to create. Default is a
+            :class:`pyvm.db.backends.sqlite3.profiling.ProfilingCursor`
+            while profiling, and a plain cursor otherwise.
+        """
+        if factory is None:
+            if self.profile.enabled:
+                factory = ProfilingCursor
+            else:
+                factory = dbapi2.Cursor
+        return dbapi2.Connection.cursor(self, factory)
+
+    def start_profiling(self, slow_query_time=None):
+        """
+        Starts recording statistics for each SQL statement.
+
+        Records the number of calls, rows returned, and time taken to
+        execute statements and fetch their rows in :attr:`profile`.
+        Profiling adds some overhead to each statement and fetched row.
+
+        Parameters
+        ----------
+        slow_query_time: float, optional
+            Log a warning for statements that take longer than this many
+            seconds to execute. Default is to not log slow statements.
+
+        Returns
+        -------
+        profile: :class:`pyvm.db.backends.sqlite3.profiling.QueryProfile`
+            Statistics for the connection.
+        """
+        self.profile.slow_query_time = slow_query_time
+        self.profile.enabled = True
+        return self.profile
+
+    def stop_profiling(self):
+        """
+        Stops recording statistics for SQL statements.
+
+        Statistics recorded so far are kept until :meth:`reset_profile`
+        is called.
+        """
+        self.profile.enabled = False
+
+    def reset_profile(self):
+        """
+        Removes all recorded statistics for SQL statements.
+        """
+        self.profile.reset()
+
+    @contextmanager
+    def profiling(self, slow_query_time=None):
+        """
+        Context manager for recording statistics for SQL statements.
+
+        See :meth:`start_profiling`.
+        """
+        profile = self.start_profiling(slow_query_time=slow_query_time)
+        try:
+            yield profile
+        finally:
+            self.stop_profiling()
+
+    def profile_summary(self):
+        """
+        Returns the recorded statistics for each SQL statement.
+
+        Returns
+        -------
+        summary: :class:`pandas.DataFrame`
+            See :meth:`pyvm.db.backends.sqlite3.profiling.QueryProfile.summary`.
+        """
+        return self.profile.summary()
+
     def read_sql(self, sql, **kwargs):
         """
         Executes a SQL statement and returns a :class:`pandas.DataFrame`
@@ -227,11 +462,78 @@ class Connection(dbapi2.Connection):
             Data from the table
         """
         sql = 'SELECT * FROM {:}'.format(table)
-        dat = self.execute(sql).fetchall()
-        if len(dat) > 0:
-            return pd.DataFrame(dat, columns=self._get_fields(table))
-        else:
-            return psql.read_sql(sql, self)
+        cursor = self._tuple_cursor()
+        cursor.execute(sql)
+        columns = [str(d[0]) for d in cursor.description]
+        return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+    def _tuple_cursor(self):
+        """
+        Returns a cursor that fetches rows as tuples.
+        """
+        cursor = self.cursor()
+        cursor.row_factory = None
+        return cursor
+
+    def read_arrays(self, sql, params=(), chunksize=10000, dtypes=None):
+        """
+        Executes a SQL statement and returns the rows as a numpy array.
+
+        Rows are fetched in chunks and copied into an array that grows
+        geometrically, without building a :class:`sqlite3.Row` for each row
+        or executing the statement twice to count rows.
+
+        Parameters
+        ----------
+        sql: str
+            SELECT statement to execute.
+        params: {tuple, list, dict}, optional
+            Parameters for the SQL statement.
+        chunksize: int, optional
+            Number of rows to fetch at a time.
+        dtypes: dict, optional
+            Numpy types to use for some or all fields, by field name.
+            Default is to infer types from the first chunk of rows, and to
+            promote fields to floats or objects if later rows have ``NULL``
+            or text values. See
+            :func:`pyvm.db.backends.sqlite3.utils.infer_dtype`.
+
+        Returns
+        -------
+        data: numpy.ndarray
+            Structured array with one field per column of the result (e.g.,
+            ``data['time']``).
+        """
+        cursor = self._tuple_cursor()
+        cursor.execute(sql, params)
+        names = [str(d[0]) for d in cursor.description]
+        rows = cursor.fetchmany(chunksize)
+        data = np.empty(len(rows), dtype=infer_dtype(names, rows,
+                                                     dtypes=dtypes))
+        n = 0
+        while len(rows) > 0:
+            try:
+                chunk = np.array(rows, dtype=data.dtype)
+            except (TypeError, ValueError):
+                # NULL values in integer fields or text in numeric fields
+                dtype = promote_dtype(data.dtype, rows, dtypes=dtypes)
+                # keep NULL values as None in fields changed to objects
+                nulls = dict([(name, np.isnan(data[name])) for name in names
+                              if data.dtype[name].kind == 'f'
+                              and dtype[name].kind == 'O'])
+                data = data.astype(dtype)
+                for name in nulls:
+                    data[name][nulls[name]] = None
+                chunk = np.array(rows, dtype=data.dtype)
+            if n + len(chunk) > len(data):
+                _data = np.empty(max(2 * len(data), n + len(chunk)),
+                                 dtype=data.dtype)
+                _data[:n] = data[:n]
+                data = _data
+            data[n:n + len(chunk)] = chunk
+            n += len(chunk)
+            rows = cursor.fetchmany(chunksize)
+        return data[:n]
 
     def init_spatialite(self):
         """
@@ -265,3 +567,93 @@ class Connection(dbapi2.Connection):
         sql += ' VALUES (%s)' % ', '.join(['?' for k in kwargs])
         data = tuple([kwargs[k] for k in kwargs])
         self.execute(sql, data)
+
+    def insertmany(self, table, fields, data, conflict='error',
+            defaults=None):
+        """
+        Adds many entries to a table in a single transaction.
+
+        Parameters
+        ----------
+        table: str
+            Name of table to add data to.
+        fields: list
+            Names of the fields to add data to.
+        data: {:class:`pandas.DataFrame`, dict, numpy.ndarray, list}
+            Rows of data to add. See
+            :func:`pyvm.db.backends.sqlite3.utils.iter_rows`.
+        conflict: str, optional
+            What to do with rows that conflict with existing entries:
+            ``'error'`` (default) raises an error and adds none of the
+            rows, ``'replace'`` replaces existing entries, and ``'ignore'``
+            keeps existing entries.
+        defaults: dict, optional
+            Values for fields that are missing from `data`.
+
+        Returns
+        -------
+        nrows: int
+            Number of rows added or replaced.
+        """
+        if conflict not in CONFLICT_MODES:
+            msg = "conflict must be one of: {:}"\
+                    .format(', '.join(sorted(CONFLICT_MODES)))
+            raise ValueError(msg)
+        sql = 'INSERT{:} INTO {:} ({:})'.format(CONFLICT_MODES[conflict],
+                table, ', '.join(fields))
+        sql += ' VALUES ({:})'.format(', '.join(['?' for f in fields]))
+        rows = iter_rows(data, fields, defaults=defaults)
+        with self.transaction():
+            cursor = self.executemany(sql, rows)
+        return max(cursor.rowcount, 0)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager for running statements in a single transaction.
+
+        Changes are committed on exit, or rolled back if an exception is
+        raised. Also works if the connection is in autocommit mode
+        (``isolation_level=None``).
+        """
+        if self.isolation_level is None:
+            self.execute('BEGIN')
+        with self:
+            yield self
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Context manager for reading from a consistent view of the database.
+
+        Queries run in the context see the same data, even if other
+        connections write to the database in the meantime. Pending changes
+        on this connection are committed first.
+        """
+        self.commit()
+        self.execute('BEGIN')
+        try:
+            yield self
+        finally:
+            self.commit()
+
+    @contextmanager
+    def relaxed_durability(self):
+        """
+        Context manager that turns off syncing and journaling to disk.
+
+        Speeds up bulk writes at the cost of possible database corruption
+        if the operating system crashes before changes are written to
+        disk. The previous settings are restored on exit.
+        """
+        self.commit()
+        synchronous = self.execute('PRAGMA synchronous').fetchone()[0]
+        journal_mode = self.execute('PRAGMA journal_mode').fetchone()[0]
+        self.execute('PRAGMA synchronous=OFF')
+        self.execute('PRAGMA journal_mode=MEMORY')
+        try:
+            yield self
+        finally:
+            self.commit()
+            self.execute('PRAGMA journal_mode={:}'.format(journal_mode))
+            self.execute('PRAGMA synchronous={:}'.format(synchronous))
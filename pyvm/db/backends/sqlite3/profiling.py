@@ -0,0 +1,196 @@
+"""
+Instrumentation for timing SQL statements.
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+import logging
+import threading
+from timeit import default_timer
+import pandas as pd
+from pyvm.db.backends.sqlite3.base import dbapi2
+
+PROFILE_FIELDS = ['sql', 'calls', 'rows', 'execute_time', 'fetch_time',
+                  'total_time', 'mean_time', 'max_time']
+
+
+class QueryProfile(object):
+    """
+    Registry of execution statistics for SQL statements.
+
+    Safe to share between threads and connections.
+    """
+    def __init__(self, slow_query_time=None):
+        """
+        Registry of execution statistics for SQL statements.
+
+        Parameters
+        ----------
+        slow_query_time : float, optional
+            Statements that take longer than this many seconds to execute
+            are logged as warnings. Default is to not log slow statements.
+        """
+        self.enabled = False
+        self.slow_query_time = slow_query_time
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._stats)
+
+    def _get_stats(self, sql):
+        stats = self._stats.get(sql)
+        if stats is None:
+            # calls, rows, execute time, fetch time, longest execute time
+            stats = [0, 0, 0., 0., 0.]
+            self._stats[sql] = stats
+        return stats
+
+    def record_execute(self, sql, seconds, nrows=0):
+        """
+        Records one execution of a statement.
+
+        Parameters
+        ----------
+        sql : str
+            SQL statement.
+        seconds : float
+            Time taken to execute the statement.
+        nrows : int, optional
+            Number of rows changed by the statement.
+        """
+        with self._lock:
+            stats = self._get_stats(sql)
+            stats[0] += 1
+            stats[1] += nrows
+            stats[2] += seconds
+            stats[4] = max(stats[4], seconds)
+        if self.slow_query_time is not None \
+                and seconds > self.slow_query_time:
+            logging.warning('Slow SQL (%.3f s): %s', seconds, sql)
+
+    def record_fetch(self, sql, seconds, nrows):
+        """
+        Records rows fetched from the result of a statement.
+
+        Parameters
+        ----------
+        sql : str
+            SQL statement.
+        seconds : float
+            Time taken to fetch the rows.
+        nrows : int
+            Number of rows fetched.
+        """
+        with self._lock:
+            stats = self._get_stats(sql)
+            stats[1] += nrows
+            stats[3] += seconds
+
+    def reset(self):
+        """
+        Removes all statistics.
+        """
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self):
+        """
+        Returns the statistics for each statement.
+
+        Returns
+        -------
+        summary : :class:`pandas.DataFrame`
+            One row per distinct SQL statement, sorted by total time, with
+            fields:
+
+            - ``calls``: number of times the statement was executed
+            - ``rows``: number of rows fetched, or changed for statements
+              that do not return rows
+            - ``execute_time``, ``fetch_time``: seconds spent executing the
+              statement and fetching its rows
+            - ``total_time``, ``mean_time``: total and mean seconds per call
+            - ``max_time``: longest time taken to execute the statement
+        """
+        with self._lock:
+            rows = [(sql,) + tuple(stats)
+                    for sql, stats in self._stats.items()]
+        data = pd.DataFrame(rows, columns=['sql', 'calls', 'rows',
+                                           'execute_time', 'fetch_time',
+                                           'max_time'])
+        data['total_time'] = data['execute_time'] + data['fetch_time']
+        data['mean_time'] = data['total_time'] / data['calls']
+        data = data.sort_values('total_time', ascending=False)
+        return data[PROFILE_FIELDS].reset_index(drop=True)
+
+
+class ProfilingCursor(dbapi2.Cursor):
+    """
+    Cursor that records statistics in the profile of its connection.
+
+    See :class:`QueryProfile`.
+    """
+    _sql = None
+
+    def _record_fetch(self, start, nrows):
+        if self._sql is not None:
+            self.connection.profile.record_fetch(self._sql,
+                    default_timer() - start, nrows)
+
+    def _record_execute(self, sql, start):
+        self._sql = sql.strip()
+        if self.description is None:
+            nrows = max(self.rowcount, 0)
+        else:
+            nrows = 0
+        self.connection.profile.record_execute(self._sql,
+                default_timer() - start, nrows)
+
+    def execute(self, sql, *args):
+        start = default_timer()
+        dbapi2.Cursor.execute(self, sql, *args)
+        self._record_execute(sql, start)
+        return self
+
+    def executemany(self, sql, *args):
+        start = default_timer()
+        dbapi2.Cursor.executemany(self, sql, *args)
+        self._record_execute(sql, start)
+        return self
+
+    def fetchone(self):
+        start = default_timer()
+        row = dbapi2.Cursor.fetchone(self)
+        self._record_fetch(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = default_timer()
+        rows = dbapi2.Cursor.fetchmany(self, *args, **kwargs)
+        self._record_fetch(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = default_timer()
+        rows = dbapi2.Cursor.fetchall(self)
+        self._record_fetch(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = default_timer()
+        try:
+            row = dbapi2.Cursor.__next__(self)
+        except StopIteration:
+            self._record_fetch(start, 0)
+            raise
+        self._record_fetch(start, 1)
+        return row
+
+    def next(self):
+        start = default_timer()
+        try:
+            row = dbapi2.Cursor.next(self)
+        except StopIteration:
+            self._record_fetch(start, 0)
+            raise
+        self._record_fetch(start, 1)
+        return row
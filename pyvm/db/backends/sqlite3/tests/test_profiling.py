@@ -0,0 +1,91 @@
+"""
+Test suite for the sqlite3.profiling module
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+import logging
+import unittest
+from pyvm.db.backends.sqlite3.connection import Connection
+from pyvm.db.backends.sqlite3.profiling import PROFILE_FIELDS,\
+        ProfilingCursor
+
+
+class profilingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Connection()
+        self.db.execute('CREATE TABLE t (i INTEGER, x REAL)')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_profiling(self):
+        """
+        Should record calls, rows, and times for each statement
+        """
+        # nothing is recorded until profiling starts
+        self.db.execute('SELECT * FROM t').fetchall()
+        self.assertEqual(len(self.db.profile_summary()), 0)
+        self.assertFalse(isinstance(self.db.cursor(), ProfilingCursor))
+
+        with self.db.profiling() as profile:
+            self.assertTrue(isinstance(self.db.cursor(), ProfilingCursor))
+            self.db.executemany('INSERT INTO t VALUES (?, ?)',
+                                [(i, i / 2.) for i in range(10)])
+            for i in range(3):
+                self.db.execute('SELECT * FROM t WHERE i<?', (5,)).fetchall()
+            rows = [r for r in self.db.execute('SELECT i FROM t')]
+            self.assertEqual(len(rows), 10)
+            self.assertEqual(len(self.db.read_table('t')), 10)
+            self.assertEqual(len(self.db.read_sql('SELECT * FROM t')), 10)
+        self.assertFalse(profile.enabled)
+
+        summary = self.db.profile_summary()
+        self.assertEqual(list(summary.columns), PROFILE_FIELDS)
+        stats = summary.set_index('sql')
+        self.assertEqual(stats.loc['INSERT INTO t VALUES (?, ?)', 'rows'],
+                         10)
+        self.assertEqual(stats.loc['SELECT * FROM t WHERE i<?', 'calls'], 3)
+        self.assertEqual(stats.loc['SELECT * FROM t WHERE i<?', 'rows'], 15)
+        self.assertEqual(stats.loc['SELECT i FROM t', 'rows'], 10)
+        self.assertEqual(stats.loc['SELECT * FROM t', 'rows'], 20)
+        self.assertTrue((summary['total_time'] >= summary['max_time']).all())
+        self.assertTrue(summary['total_time'].is_monotonic_decreasing)
+
+        # statistics are kept until reset
+        self.db.execute('SELECT * FROM t').fetchall()
+        self.assertEqual(len(self.db.profile_summary()), 4)
+        self.db.reset_profile()
+        self.assertEqual(len(self.db.profile_summary()), 0)
+
+    def test_slow_query_log(self):
+        """
+        Should log statements that are slower than a threshold
+        """
+        messages = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                messages.append(record.getMessage())
+
+        handler = Handler(level=logging.WARNING)
+        logging.getLogger().addHandler(handler)
+        try:
+            self.db.start_profiling(slow_query_time=0)
+            self.db.execute('SELECT COUNT(*) FROM t')
+            self.db.start_profiling(slow_query_time=60)
+            self.db.execute('SELECT * FROM t')
+            self.db.stop_profiling()
+        finally:
+            logging.getLogger().removeHandler(handler)
+        self.assertEqual(len(messages), 1)
+        self.assertTrue('SELECT COUNT(*) FROM t' in messages[0])
+
+
+def suite():
+    testSuite = unittest.makeSuite(profilingTestCase, 'test')
+
+    return testSuite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,75 @@
+"""
+Test suite for the sqlite3.utils module
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+import unittest
+import numpy as np
+from pyvm.db.backends.sqlite3 import utils
+
+
+class utilsTestCase(unittest.TestCase):
+
+    def test_build_where(self):
+        """
+        Should build parameterized search expressions
+        """
+        self.assertEqual(utils.build_where({}), ('', []))
+
+        sql, params = utils.build_where({'event': 'Pn', 'recid': 101})
+        self.assertEqual(sql, '(event=?) AND (recid=?)')
+        self.assertEqual(params, ['Pn', 101])
+
+        # should match lists of values
+        sql, params = utils.build_where({'recid': np.array([101, 102]),
+                                         'srcid__ne': [1, 2, 3]})
+        self.assertEqual(sql, '(recid IN (?, ?)) AND (srcid NOT IN (?, ?, ?))')
+        self.assertEqual(params, [101, 102, 1, 2, 3])
+        self.assertEqual(type(params[0]), int)
+
+        # should use comparison operators
+        sql, params = utils.build_where({'offset__gte': 5.,
+                                         'offset__lt': 10.,
+                                         'time__between': (1., 2.)})
+        self.assertEqual(sql, '(offset>=?) AND (offset<?)'
+                         ' AND (time BETWEEN ? AND ?)')
+        self.assertEqual(params, [5., 10., 1., 2.])
+
+        # should only include valid fields
+        sql, params = utils.build_where({'event': 'Pn', 'srcx': 1.},
+                                        valid_fields=['event'])
+        self.assertEqual(sql, '(event=?)')
+
+        # should reject unsafe names and unknown operators
+        self.assertRaises(ValueError, utils.build_where,
+                          {'event=1 OR 1': 1})
+        self.assertRaises(ValueError, utils.build_where, {'time__xx': 1})
+        self.assertRaises(ValueError, utils.build_where, {'time__gt': [1]})
+
+    def test_write_cursor(self):
+        """
+        Should write query results in chunks
+        """
+        import io
+        import sqlite3
+        db = sqlite3.connect(':memory:')
+        db.execute('CREATE TABLE t (i INTEGER, x REAL, s TEXT)')
+        db.executemany('INSERT INTO t VALUES (?, ?, ?)',
+                       [(i, i / 3., None if i % 2 else 'a')
+                        for i in range(5)])
+        buf = io.StringIO()
+        n = utils.write_cursor(db.execute('SELECT * FROM t'), buf, sep=',',
+                               header=True, chunksize=2)
+        self.assertEqual(n, 5)
+        lines = buf.getvalue().split('\n')
+        self.assertEqual(lines[:3], ['i,x,s', '0,0.0,a',
+                                     '1,{!r},'.format(1 / 3.)])
+
+
+def suite():
+    testSuite = unittest.makeSuite(utilsTestCase, 'test')
+
+    return testSuite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
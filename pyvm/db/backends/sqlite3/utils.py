@@ -3,62 +3,293 @@ Sqlite utilities
 """
 from __future__ import (absolute_import, division, print_function,
         unicode_literals)
+import re
+import numbers
+import numpy as np
 
-def py2str(values):
+# Comparison operators for `field__operator` search keys
+OPERATORS = {'eq': '=', 'ne': '!=', 'gt': '>', 'gte': '>=', 'lt': '<',
+             'lte': '<=', 'between': 'BETWEEN'}
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Conflict clauses for INSERT statements
+CONFLICT_MODES = {'error': '', 'replace': ' OR REPLACE',
+                  'ignore': ' OR IGNORE'}
+
+
+def check_identifier(name):
     """
-    Convert python variables to strings for use in SQLite statements.
+    Check that a table or field name is safe to use in a SQLite statement.
 
-    :param values: List of values to convert.
-    :returns: List of strings.
+    :param name: Name to check.
+    :returns: The name.
+    :raises ValueError: If the name is not a plain identifier.
     """
-    if type(values) in [str, unicode]:
-        values = [values]
-    strings = []
-    for v in values:
-        if type(v) in [str, unicode]:
-            strings.append("'" + str(v) + "'")
-        else:
-            strings.append(str(v))
-    return strings
+    if not IDENTIFIER.match(name):
+        raise ValueError("Invalid identifier: {:}".format(name))
+    return name
+
 
-def format_search(match_dict, list_op='OR', key_op='AND', op='=',
-        valid_fields=None):
+def build_where(match_dict, valid_fields=None):
     """
-    Format a dictionary of search terms into a SQLite search string.
+    Build a parameterized SQLite WHERE clause from a dictionary of terms.
+
+    Keys are field names, optionally followed by a double underscore and
+    one of the operators: ``eq`` (default), ``ne``, ``gt``, ``gte``,
+    ``lt``, ``lte``, or ``between``. Lists of values match any value
+    (``IN``), or no value with ``ne`` (``NOT IN``). Values for
+    ``between`` are ``(low, high)`` pairs. Terms for different keys are
+    combined with ``AND``.
 
     Parameters
     ----------
     match_dict : dict
         Keywords and values to match.
-    list_op : str, optional
-        SQLite operator to use when combining multiple values for a single key.
-    key_op : str, optional
-        SQLite operator to use when combining multiple values.
-    valid_fields: list
+    valid_fields : list, optional
         List of possible fields to include from `match_dict`. Useful when
         building searches for different tables using the same values.
 
     Returns
     -------
     sql : str
-        SQLite query
+        SQLite search expression with ``?`` placeholders, without the
+        ``WHERE`` keyword. Empty if there are no terms.
+    params : list
+        Values for the placeholders.
+
+    Examples
+    --------
+    >>> build_where({'event': ['Pg', 'Pn'], 'offset__lt': 50.})
+    ('(event IN (?, ?)) AND (offset<?)', ['Pg', 'Pn', 50.0])
+    """
+    fields = []
+    params = []
+    for key in sorted(match_dict):
+        if '__' in key:
+            field, op = key.rsplit('__', 1)
+        else:
+            field, op = key, 'eq'
+        if valid_fields and field not in valid_fields:
+            continue
+        check_identifier(field)
+        if op not in OPERATORS:
+            raise ValueError("Unknown operator '{:}' in '{:}'".format(op, key))
+        value = match_dict[key]
+        if hasattr(value, 'tolist'):
+            # numpy arrays and scalars to native types
+            value = value.tolist()
+        if op == 'between':
+            low, high = value
+            fields.append('({:} BETWEEN ? AND ?)'.format(field))
+            params += [low, high]
+        elif hasattr(value, '__iter__') and not isinstance(value,
+                                                           (str, bytes)):
+            value = list(value)
+            if op not in ['eq', 'ne']:
+                msg = "Lists of values cannot be used with '{:}'".format(op)
+                raise ValueError(msg)
+            sql = '({:} {:}IN ({:}))'.format(field,
+                    'NOT ' if op == 'ne' else '',
+                    ', '.join(['?' for v in value]))
+            fields.append(sql)
+            params += value
+        else:
+            fields.append('({:}{:}?)'.format(field, OPERATORS[op]))
+            params.append(value)
+    return ' AND '.join(fields), params
+
+
+def iter_rows(data, fields, defaults=None):
+    """
+    Convert tabular data to rows of native Python values.
+
+    Parameters
+    ----------
+    data : {:class:`pandas.DataFrame`, dict, numpy.ndarray, list}
+        Data to convert. DataFrames, dictionaries of columns, and numpy
+        structured arrays are matched to `fields` by name. Other arrays and
+        sequences must have one row per entry with values in the order of
+        `fields`.
+    fields : list
+        Names of the fields to return in each row.
+    defaults : dict, optional
+        Values for fields that are missing from `data`. For unnamed data,
+        only the trailing fields can be missing.
+
+    Returns
+    -------
+    rows : iterable
+        Tuples of values in the order of `fields`.
+    """
+    if defaults is None:
+        defaults = {}
+    if hasattr(data, 'columns') or isinstance(data, dict) \
+            or getattr(getattr(data, 'dtype', None), 'names', None):
+        if hasattr(data, 'columns'):
+            names = list(data.columns)
+        elif isinstance(data, dict):
+            names = list(data.keys())
+        else:
+            names = list(data.dtype.names)
+        nrows = len(data[names[0]]) if len(names) > 0 else 0
+        columns = []
+        for f in fields:
+            if f in names:
+                column = data[f]
+                if hasattr(column, 'tolist'):
+                    column = column.tolist()
+                columns.append(column)
+            elif f in defaults:
+                columns.append([defaults[f]] * nrows)
+            else:
+                raise ValueError("Missing required field '{:}'.".format(f))
+        return zip(*columns)
+
+    if hasattr(data, 'tolist'):
+        data = data.tolist()
+    def _rows():
+        for row in data:
+            row = tuple(row)
+            if len(row) < len(fields):
+                try:
+                    row += tuple([defaults[f]
+                                  for f in fields[len(row):]])
+                except KeyError as e:
+                    msg = "Missing required field '{:}'.".format(e.args[0])
+                    raise ValueError(msg)
+            yield row
+    return _rows()
+
+
+def format_value(value):
+    """
+    Format a value from a SQLite query for a delimited text file.
+
+    :param value: Value to format.
+    :returns: String with the shortest representation that round trips
+        floats, and an empty string for ``NULL`` values.
+    """
+    if value is None:
+        return ''
+    elif isinstance(value, float):
+        return repr(value)
+    return '{:}'.format(value)
+
+
+def write_cursor(cursor, buf, sep='\t', header=False, chunksize=10000):
     """
-    if not valid_fields:
-        valid_fields = [k for k in match_dict]
+    Write the rows of a query to a delimited text file.
 
-    keys = [k for k in match_dict if k in valid_fields]
+    Rows are fetched and written `chunksize` rows at a time, so that memory
+    use does not depend on the number of rows.
 
+    Parameters
+    ----------
+    cursor : :class:`sqlite3.Cursor`
+        Cursor for an executed query.
+    buf : buffer
+        Buffer with a ``write`` method to write rows to.
+    sep : str, optional
+        Field delimiter.
+    header : bool, optional
+        Determines whether or not to write a header row of field names.
+    chunksize : int, optional
+        Number of rows to fetch at a time.
+
+    Returns
+    -------
+    nrows : int
+        Number of rows written, excluding the header.
+    """
+    if header:
+        buf.write(sep.join([d[0] for d in cursor.description]) + '\n')
+    nrows = 0
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if len(rows) == 0:
+            break
+        buf.write(''.join([sep.join([format_value(v) for v in row]) + '\n'
+                           for row in rows]))
+        nrows += len(rows)
+    return nrows
+
+
+def infer_dtype(names, rows, dtypes=None):
+    """
+    Choose numpy types for the fields of query results.
+
+    Fields with text or binary values are stored as objects, fields with
+    only integer values as 64-bit integers, and all other fields
+    (including integer fields with ``NULL`` values) as 64-bit floats, with
+    ``NULL`` values stored as ``NaN``.
+
+    Parameters
+    ----------
+    names : list
+        Field names.
+    rows : list
+        Sample of rows to infer types from.
+    dtypes : dict, optional
+        Numpy types to use for some or all fields, by field name.
+
+    Returns
+    -------
+    dtype : :class:`numpy.dtype`
+        Structured type with one field per name.
+    """
+    if dtypes is None:
+        dtypes = {}
+    fields = []
+    for j, name in enumerate(names):
+        if name in dtypes:
+            fields.append((str(name), dtypes[name]))
+            continue
+        values = [r[j] for r in rows]
+        notnull = [v for v in values if v is not None]
+        if any([not isinstance(v, numbers.Real) for v in notnull]):
+            dtype = np.object_
+        elif len(notnull) > 0 and len(notnull) == len(values) \
+                and all([isinstance(v, numbers.Integral) for v in notnull]):
+            dtype = np.int64
+        else:
+            dtype = np.float64
+        fields.append((str(name), dtype))
+    return np.dtype(fields)
+
+
+def promote_dtype(dtype, rows, dtypes=None):
+    """
+    Widen the inferred types of query results to hold more rows.
+
+    Integer fields become 64-bit floats if ``rows`` has ``NULL`` values
+    for them, and numeric fields become objects if ``rows`` has text or
+    binary values for them.
+
+    Parameters
+    ----------
+    dtype : :class:`numpy.dtype`
+        Structured type inferred by :func:`infer_dtype`.
+    rows : list
+        Rows that do not fit ``dtype``.
+    dtypes : dict, optional
+        Numpy types given for some or all fields, by field name. These
+        fields are not changed.
+
+    Returns
+    -------
+    dtype : :class:`numpy.dtype`
+        Structured type with the same field names.
+    """
+    if dtypes is None:
+        dtypes = {}
+    rank = {'i': 0, 'u': 0, 'f': 1}
+    other = infer_dtype(dtype.names, rows)
     fields = []
-    _list_op = ' ' + list_op + ' '
-
-    for k in keys:
-        try:
-            values = ['{:}{:}{:}'.format(k, op, v)\
-                      for v in py2str(match_dict[k])]
-        except TypeError:
-            values = ['{:}{:}{:}'.format(k, op, py2str([match_dict[k]])[0])]
-        fields.append('(' + _list_op.join(values) + ')')
-    _key_op = ' ' + key_op + ' '
-    sql = _key_op.join(fields)
-
-    return sql
+    for name in dtype.names:
+        _dtype = dtype[name]
+        if name not in dtypes and rank.get(other[name].kind, 2)\
+                > rank.get(_dtype.kind, 2):
+            _dtype = other[name]
+        fields.append((str(name), _dtype))
+    return np.dtype(fields)
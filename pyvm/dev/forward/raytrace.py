@@ -3,72 +3,139 @@ Raytracing utilities
 """
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
-import subprocess
-import warnings
-import time
+import os
+import shutil
 import tempfile
+import numpy as np
+from pyvm.db.backends.sqlite3.utils import build_where
+from pyvm.forward.raytracing.raytracing import raytrace_from_ascii
+from pyvm.forward.raytracing.rayfan import readRayfanGroup, RayfanGroup
+
+PICK_FIELDS = ['recid', 'srcid', 'branchid', 'subid', 'offset', 'time',
+               'error', 'srcx', 'srcy', 'srcz', 'recx', 'recy', 'recz']
+PICK_FORMAT = '%d %d %d %d %.9g %.9g %.9g'
+POINT_FORMAT = '%d %.9g %.9g %.9g'
+
 
 def _pickarray2tables(pickdat):
     """
     Builds source, receiver, and pick tables from an array of pick times.
-    
+
     Parameters
     ----------
     pickdat: array_like
-         9xN array with rows containing [src_x, srx_y, src_z, rec_x, rec_y,
-         src_z, pick_time, phase_id, branch_id].
+        13xN array with rows containing [rec_id, src_id, branch_id,
+        subbranch_id, offset, pick_time, pick_error, src_x, src_y, src_z,
+        rec_x, rec_y, rec_z].
 
     Returns
     -------
     src: numpy.ndarray
-        4xN array with rows containing [src_id, src_x, src_y, src_z]
+        Nx4 array with rows containing [src_id, src_x, src_y, src_z] for
+        each unique source, sorted by src_id.
     rec: numpy.ndarray
-        4xN array with rows containing [rec_id, rec_x, rec_y, rec_z]
+        Nx4 array with rows containing [rec_id, rec_x, rec_y, rec_z] for
+        each unique receiver, sorted by rec_id.
     picks: numpy.ndarray
-        7xN array with rows containing [rec_id, src_id, phase_id, branch_id, _x, rec_y, rec_z]
+        Nx7 array with rows containing [rec_id, src_id, branch_id,
+        subbranch_id, offset, pick_time, pick_error].
     """
-f.write('100 9000 1 0 9.999 9.999 0.000\n')
+    pickdat = np.atleast_2d(np.asarray(pickdat, dtype=float))
+    _, isrc = np.unique(pickdat[:, 1], return_index=True)
+    _, irec = np.unique(pickdat[:, 0], return_index=True)
+    src = pickdat[isrc][:, [1, 7, 8, 9]]
+    rec = pickdat[irec][:, [0, 10, 11, 12]]
+    return src, rec, pickdat[:, :7]
 
 
-        sql = 'SELECT DISTINCT ensemble, trace, branch, subbranch, offset,'
-        sql += 'time, error FROM {:}'.format(MASTER_VIEW)
+def _merge_points(table0, table1):
+    """
+    Merges two point tables, keeping the first row for each ID.
+    """
+    table = np.concatenate((table0, table1))
+    _, idx = np.unique(table[:, 0], return_index=True)
+    return table[idx]
 
 
-def _raytrace_from_arrays(vmfile, pickdat, warnonly=True):
+def raytrace_from_picks(vm, pickdb, rayfile=None, chunksize=10000,
+                        tracer_options=None, **query):
     """
-    Backend for the raytracer that takes pick data as an array
+    Raytrace picks selected from a pick database.
+
+    Picks are read from the database in chunks and written straight to
+    temporary raytracer input files, while tables of unique sources and
+    receivers are built from each chunk.
 
     Parameters
     ----------
-    vmfile: str
-        Filename of a VM-format velocity model.
+    vm: {:class:`pyvm.models.vm.VM`, str}
+        Model or filename of a VM-format velocity model to raytrace.
+    pickdb: :class:`pyvm.picks.pickdb.PickDatabase`
+        Database with the picks to raytrace.
+    rayfile: str, optional
+        Filename to keep the output VM Tomography rayfan file as. Default
+        is to only return the rayfans.
+    chunksize: int, optional
+        Number of picks to read from the database at a time.
+    tracer_options: dict, optional
+        Keyword arguments for
+        :func:`pyvm.forward.raytracing.raytracing.raytrace_from_ascii`.
+    query: optional
+        Keyword arguments for selecting picks from the database (e.g.,
+        ``event='Pn'``). Default is to include all picks.
 
-    pickdat: array_like
-         9xN array with rows containing [src_x, srx_y, src_z, rec_x, rec_y,
-         src_z, pick_time, phase_id, branch_id].
+    Returns
+    -------
+    rays: :class:`pyvm.forward.raytracing.rayfan.RayfanGroup`
+        Rayfans for the selected picks.
     """
-    srcdat = [[d[0], d[1], d[2]] for d in pickdat]
-    recdat = [[d[3], d[4], d[5]] for d in pickdat]
-    recdat = np.unique([[d[3], d[4], d[5]] for d in pickdat])
-
-
-    #instfile = tempfile.NamedTemporaryFile(delete=True)
-    #shotfile = tempfile.NamedTemporaryFile(delete=True)
-    #pickfile = tempfile.NamedTemporaryFile(delete=True)
-
-    
-
-
-    raise NotImplementedError
-
-f = open(instfile, 'w')
-f.write('100 25. 0.006 0.0\n')
-f.close()
-
-f = open(shotfile, 'w')
-f.write('9000 5. 0.0 0.006\n')
-f.close()
-
-f = open(pickfile, 'w')
-f.write('100 9000 1 0 9.999 9.999 0.000\n')
-f.close()
+    tracer_options = dict(tracer_options or {})
+    tracer_options.setdefault('verbose', False)
+    workdir = tempfile.mkdtemp(prefix='.raytrace_')
+    try:
+        if hasattr(vm, 'grid'):
+            vmfile = os.path.join(workdir, 'model.vm')
+            vm.write(vmfile)
+        else:
+            vmfile = vm
+        instfile = os.path.join(workdir, 'inst.dat')
+        shotfile = os.path.join(workdir, 'shot.dat')
+        pickfile = os.path.join(workdir, 'pick.dat')
+        _rayfile = os.path.join(workdir, 'picks.rays')
+
+        sql = 'SELECT ' + ', '.join(PICK_FIELDS) + ' FROM master_picks'
+        where, params = build_where(query)
+        if where:
+            sql += ' WHERE ' + where
+        src = np.zeros((0, 4))
+        rec = np.zeros((0, 4))
+        npicks = 0
+        cursor = pickdb.execute(sql, params)
+        with open(pickfile, 'w') as f:
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if len(rows) == 0:
+                    break
+                _src, _rec, picks = _pickarray2tables([tuple(r)
+                                                       for r in rows])
+                src = _merge_points(src, _src)
+                rec = _merge_points(rec, _rec)
+                np.savetxt(f, picks, fmt=str(PICK_FORMAT))
+                npicks += len(picks)
+        if npicks == 0:
+            return RayfanGroup()
+        np.savetxt(shotfile, src, fmt=str(POINT_FORMAT))
+        np.savetxt(instfile, rec, fmt=str(POINT_FORMAT))
+
+        raytrace_from_ascii(vmfile, _rayfile, instfile=instfile,
+                            shotfile=shotfile, pickfile=pickfile,
+                            **tracer_options)
+        if not os.path.isfile(_rayfile):
+            return RayfanGroup()
+        with open(_rayfile, 'rb') as f:
+            rays = readRayfanGroup(f)
+        if rayfile is not None:
+            shutil.move(_rayfile, rayfile)
+        return rays
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,93 @@
+"""
+Test suite for the development raytracing module
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from pyvm.utils.loaders import get_example_file, install_example_program
+from pyvm.models.vm import VM
+from pyvm.picks.pickdb import PickDatabase
+from pyvm.forward.raytracing import raytracing, rayfan
+from pyvm.dev.forward import raytrace
+
+
+class raytraceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._program = raytracing.RAYTR_PROGRAM
+        raytracing.RAYTR_PROGRAM = install_example_program(
+                'fake_slim_rays.py', self.tmpdir, 'slim_rays')
+
+        self.db = PickDatabase()
+        self.db.add_event('Pg', branchid=1)
+        self.db.add_event('Pn', branchid=2)
+        for i in range(5):
+            self.db.add_receiver(100 + i, 10. * (i + 1), 0., 2.)
+        for j in range(4):
+            self.db.add_source(9000 + j, 5. * (j + 1), 0., 0.006)
+        for event, nrec in [('Pg', 5), ('Pn', 2)]:
+            for i in range(nrec):
+                for j in range(4):
+                    self.db.add_pick(event, 9000 + j, 100 + i,
+                                     1. + i + 0.1 * j, error=0.05)
+
+    def tearDown(self):
+        raytracing.RAYTR_PROGRAM = self._program
+        shutil.rmtree(self.tmpdir)
+
+    def test_pickarray2tables(self):
+        """
+        Should build unique source and receiver tables from picks
+        """
+        pickdat = [[101, 9001, 1, 0, 0., 1.1, 0.05, 5., 0., 0., 20., 0., 2.],
+                   [100, 9001, 1, 0, 0., 1.0, 0.05, 5., 0., 0., 10., 0., 2.],
+                   [101, 9000, 2, 0, 0., 2.1, 0.05, 1., 0., 0., 20., 0., 2.]]
+        src, rec, picks = raytrace._pickarray2tables(pickdat)
+        np.testing.assert_equal(src, [[9000, 1., 0., 0.], [9001, 5., 0., 0.]])
+        np.testing.assert_equal(rec, [[100, 10., 0., 2.],
+                                      [101, 20., 0., 2.]])
+        self.assertEqual(picks.shape, (3, 7))
+
+    def test_raytrace_from_picks(self):
+        """
+        Should raytrace picks selected from a pick database
+        """
+        vmfile = get_example_file('benchmark2d.vm')
+        rays = raytrace.raytrace_from_picks(vmfile, self.db, chunksize=3)
+        self.assertEqual([r.start_point_id for r in rays.rayfans],
+                         [100, 101, 102, 103, 104])
+        self.assertEqual(rays.nrays, 28)
+        np.testing.assert_allclose(rays.rayfans[1].pick_times[:4],
+                                   [2.0, 2.1, 2.2, 2.3], rtol=1e-6)
+
+        # should select picks and accept a model
+        rayfile = os.path.join(self.tmpdir, 'pn.rays')
+        tracer_options = {'grid_size': (10, 1, 10)}
+        rays = raytrace.raytrace_from_picks(VM(vmfile), self.db,
+                                            rayfile=rayfile, event='Pn',
+                                            tracer_options=tracer_options)
+        self.assertEqual(tracer_options, {'grid_size': (10, 1, 10)})
+        self.assertTrue(rays.file.closed)
+        self.assertEqual([r.start_point_id for r in rays.rayfans],
+                         [100, 101])
+        self.assertEqual(set(rays.rayfans[0].event_ids), set([2]))
+        self.assertEqual(rayfan.readRayfanGroup(rayfile).nrays, 8)
+
+        # should return no rays if no picks are selected
+        rays = raytrace.raytrace_from_picks(vmfile, self.db, event='PmP')
+        self.assertEqual(len(rays.rayfans), 0)
+
+
+def suite():
+    testSuite = unittest.makeSuite(raytraceTestCase, 'test')
+
+    return testSuite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
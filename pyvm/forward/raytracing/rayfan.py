@@ -2,6 +2,7 @@
 Support for working with VM Tomography binary rayfan files.
 """
 import os
+import shutil
 import warnings
 from struct import unpack
 from pyvm.io import pack
@@ -113,19 +114,20 @@ class RayfanGroup(object):
         endian: str
             Sets endianness of the file. Default is to use machine's native byte order.
         """
-        file = open(filename, 'wb')
+        with open(filename, 'wb') as file:
 
-        # write version flag (only included for version >1)
-        if version > 1:
-            pack.pack_4byte_Integer(file, np.int32(-version), endian=endian)
-
-        # number of rayfans in the group file
-        pack.pack_4byte_Integer(file, np.int32(len(self.rayfans)), endian=endian)
+            # write version flag (only included for version >1)
+            if version > 1:
+                pack.pack_4byte_Integer(file, np.int32(-version),
+                                        endian=endian)
 
-        # write each rayfan
-        for rfn in self.rayfans:
-            rfn.write(file, version=version, endian=endian)
+            # number of rayfans in the group file
+            pack.pack_4byte_Integer(file, np.int32(len(self.rayfans)),
+                                    endian=endian)
 
+            # write each rayfan
+            for rfn in self.rayfans:
+                rfn.write(file, version=version, endian=endian)
 
     def _get_all_azimuths(self):
         """
@@ -181,18 +183,32 @@ class Rayfan(object):
     """
     Class for working with a single rayfan.
     """
-    def __init__(self, file, endian='@', version=DEFAULT_RAYFAN_VERSION):
+    def __init__(self, file=None, endian='@', version=DEFAULT_RAYFAN_VERSION):
         """
         Class for handling an individual rayfan.
 
-        :param file: An open file-like object with the file pointer set at the
-            beginning of a rayfan file.
+        :param file: Optional. An open file-like object with the file
+            pointer set at the beginning of a rayfan file. Default is to
+            create an empty rayfan.
         :param endian: Optional. The endianness of the file. Default is
             to use machine's native byte order.
         :param version: Optional. Sets the version number of the
             rayfan file format. Default is version 2.
         """
-        self.read(file, endian=endian, version=version)
+        if file is None:
+            self.start_point_id = 0
+            self.nrays = 0
+            self.static_correction = 0.
+            self.end_point_ids = ()
+            self.event_ids = ()
+            self.event_subids = ()
+            self.pick_times = ()
+            self.travel_times = ()
+            self.pick_errors = ()
+            self.paths = []
+            self.endpoints = []
+        else:
+            self.read(file, endian=endian, version=version)
 
     def read(self, file, endian='@', version=DEFAULT_RAYFAN_VERSION):
         """
@@ -364,6 +380,46 @@ class Rayfan(object):
     bottom_points = property(fget=_get_ray_bottom_points)
 
 
+def make_rayfan(start_point_id, end_point_ids, travel_times, paths,
+                event_ids=None, event_subids=None, pick_times=None,
+                pick_errors=None, static_correction=0.):
+    """
+    Build a rayfan from raypaths.
+
+    :param start_point_id: ID of the point that rays were traced from.
+    :param end_point_ids: ID of the end point of each ray.
+    :param travel_times: Travel time of each ray.
+    :param paths: List of ``(n, 3)`` raypath coordinate arrays that start
+        at the end point and finish at the start point.
+    :param event_ids: Optional. Branch ID of each ray. Default is zeros.
+    :param event_subids: Optional. Sub-branch ID of each ray. Default is
+        zeros.
+    :param pick_times: Optional. Pick time of each ray. Default is zeros.
+    :param pick_errors: Optional. Pick error of each ray. Default is zeros.
+    :param static_correction: Optional. Static correction for the rayfan.
+    :returns: :class:`Rayfan`
+    """
+    nrays = len(paths)
+    zeros = np.zeros(nrays)
+    rfn = Rayfan()
+    rfn.start_point_id = start_point_id
+    rfn.nrays = nrays
+    rfn.static_correction = static_correction
+    rfn.end_point_ids = np.asarray(end_point_ids, dtype=np.int32)
+    for attr, value, dtype in [('event_ids', event_ids, np.int32),
+                               ('event_subids', event_subids, np.int32),
+                               ('pick_times', pick_times, np.float32),
+                               ('pick_errors', pick_errors, np.float32)]:
+        if value is None:
+            value = zeros
+        rfn.__setattr__(attr, np.asarray(value, dtype=dtype))
+    rfn.travel_times = np.asarray(travel_times, dtype=np.float32)
+    rfn.paths = paths
+    rfn.endpoints = [p[0] if len(p) > 0 else [None, None, None]
+                     for p in paths]
+    return rfn
+
+
 def readRayfanGroup(file, endian=ENDIAN):
     """
     Read a VM tomography rayfan file.
@@ -378,3 +434,79 @@ def readRayfanGroup(file, endian=ENDIAN):
     return rfn
 
 
+
+
+def read_rayfile_header(file, endian=ENDIAN):
+    """
+    Read the header of a VM tomography rayfan file.
+
+    :param file: An open file-like object with the file pointer set at the
+        beginning of a rayfan file.
+    :param endian: Optional. The endianness of the file. Default is
+        to use machine's native byte order.
+    :returns: Tuple of ``(version, nrayfans, header_size)`` where
+        ``header_size`` is the number of bytes in the header.
+    """
+    fmt = '{:}i'.format(endian)
+    n = unpack(fmt, file.read(4))[0]
+    if n < 0:
+        version = -n
+        n = unpack(fmt, file.read(4))[0]
+        return version, n, 8
+    else:
+        return 1, n, 4
+
+
+def append_rayfile(src, dst, endian=ENDIAN):
+    """
+    Append all rayfans in one rayfan file to another rayfan file.
+
+    The rayfan count in the header of ``dst`` is updated in place and the
+    rayfans from ``src`` are copied to the end of ``dst``. If ``dst`` does
+    not exist, ``src`` is copied to ``dst``.
+
+    :param src: Filename of the rayfan file to append.
+    :param dst: Filename of the rayfan file to append to.
+    :param endian: Optional. The endianness of both files. Default is
+        to use machine's native byte order.
+    """
+    if (not os.path.isfile(src)) or (os.path.getsize(src) == 0):
+        return
+
+    if (not os.path.isfile(dst)) or (os.path.getsize(dst) == 0):
+        shutil.copyfile(src, dst)
+        return
+
+    with open(src, 'rb') as fsrc:
+        version0, n0, _ = read_rayfile_header(fsrc, endian=endian)
+        with open(dst, 'r+b') as fdst:
+            version1, n1, size1 = read_rayfile_header(fdst, endian=endian)
+            if version0 != version1:
+                msg = 'Cannot append a version {:} rayfan file to a'\
+                        .format(version0)
+                msg += ' version {:} rayfan file.'.format(version1)
+                raise RayfanError(msg)
+            fdst.seek(size1 - 4)
+            pack.pack_4byte_Integer(fdst, np.int32(n0 + n1), endian=endian)
+            fdst.seek(0, os.SEEK_END)
+            shutil.copyfileobj(fsrc, fdst)
+
+
+def truncate_rayfile(filename, size, nrayfans, endian=ENDIAN):
+    """
+    Truncate a rayfan file and update the rayfan count in its header.
+
+    Used to discard a partially written rayfan from the end of a file.
+
+    :param filename: Filename of the rayfan file.
+    :param size: Size in bytes to truncate the file to. Must be at the end
+        of a complete rayfan.
+    :param nrayfans: Number of complete rayfans before ``size``.
+    :param endian: Optional. The endianness of the file. Default is
+        to use machine's native byte order.
+    """
+    with open(filename, 'r+b') as f:
+        _, _, header_size = read_rayfile_header(f, endian=endian)
+        f.truncate(size)
+        f.seek(header_size - 4)
+        pack.pack_4byte_Integer(f, np.int32(nrayfans), endian=endian)
@@ -1,11 +1,26 @@
 import os
 import time
+import errno
+import shutil
+import tempfile
 import subprocess
 import warnings
+from struct import unpack
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import pandas as pd
 from pyvm.models.vm import VM
+from pyvm.forward.raytracing.rayfan import append_rayfile,\
+        read_rayfile_header, truncate_rayfile, readRayfanGroup,\
+        RayfanGroup, make_rayfan, ENDIAN
 
 
 RAYTR_PROGRAM = 'slim_rays'
+RUN_LOG_COLUMNS = ['receiver', 'wall_time', 'cpu_time', 'nrays', 'nbytes',
+                   'returncode']
+CHECKPOINT_SUFFIX = '.ckpt'
+INCREMENTAL_LOG_COLUMNS = ['receiver', 'nrays', 'max_change', 'retraced',
+                           'failed']
 
 
 def raytrace_from_ascii(vmfile, rayfile, instfile='inst.dat',
@@ -13,7 +28,8 @@ def raytrace_from_ascii(vmfile, rayfile, instfile='inst.dat',
                         grid_size=None, forward_star_size=[12, 12, 24],
                         min_angle=0.5, min_velocity=1.4, max_node_size=620,
                         top_layer=0, bottom_layer=None, stdout=None,
-                        stderr=None, verbose=True):
+                        stderr=None, verbose=True, n_workers=1,
+                        resume=False):
     """
     Wrapper for running the VM Tomography raytracer using a ASCII input files.
 
@@ -56,6 +72,34 @@ def raytrace_from_ascii(vmfile, rayfile, instfile='inst.dat',
         Determines whether or not to print information from the
         raytracing program.  Valid values are ``True``, ``False``, or numeric
         level.
+    n_workers : int, optional
+        Number of receivers to raytrace concurrently. If greater than one,
+        each receiver is traced to its own temporary rayfan file and the
+        results are appended to ``rayfile`` in the order that receivers are
+        listed in ``instfile``. Default is to trace one receiver at a time.
+    resume : bool, optional
+        Determines whether or not to resume an interrupted run. While
+        raytracing, the receivers that have finished and the size of
+        ``rayfile`` after each receiver are recorded in a checkpoint
+        manifest named ``rayfile`` + ``'.ckpt'``, which is removed when all
+        receivers have finished. Receivers for which the raytracing program
+        fails are not recorded, and the manifest is kept, so that they are
+        traced again when resuming. If ``True`` and a manifest exists,
+        ``rayfile`` is truncated to the end of the last finished receiver
+        and only the remaining receivers are traced. Default (``False``)
+        is to overwrite ``rayfile`` and trace all receivers.
+
+    Returns
+    -------
+    log : :class:`pandas.DataFrame`
+        Run log with one row per receiver, in the order that receivers are
+        listed in ``instfile``, and the columns: ``receiver``, ``wall_time``
+        (seconds), ``cpu_time`` (user plus system seconds used by the
+        raytracing program, or ``NaN`` where the platform does not report
+        it), ``nrays`` (number of rays written),
+        ``nbytes`` (growth of the rayfan file in bytes), and
+        ``returncode`` (exit status of the raytracing program). When
+        resuming, only receivers traced in this run are included.
     """
     # set numeric verbosity level
     if verbose and (type(verbose) == bool):
@@ -68,6 +112,7 @@ def raytrace_from_ascii(vmfile, rayfile, instfile='inst.dat',
     if grid_size is None:
         grid_size = (vm.nx, vm.ny, vm.nz)
     # set forward star size for 2D cases
+    forward_star_size = list(forward_star_size)
     if vm.nx == 1:
         forward_star_size[0] = 0
     elif vm.ny == 1:
@@ -76,85 +121,808 @@ def raytrace_from_ascii(vmfile, rayfile, instfile='inst.dat',
     if bottom_layer is None:
         bottom_layer = vm.nr
     # Get instrument locations
-    finst = open(instfile, 'rb')
-    inst = {}
-    for row in finst:
-        dat = row.split()
-        inst[int(dat[0])] = [float(d) for d in dat[1:4]]
-    finst.close()
+    inst = _read_instruments(instfile)
+    # Restart from the checkpoint or start a new rayfile
+    manifest = rayfile + CHECKPOINT_SUFFIX
+    done = []
+    if resume:
+        done = _restore_checkpoint(rayfile, manifest)
+    if len(done) == 0:
+        for filename in [rayfile, manifest]:
+            if os.path.isfile(filename):
+                os.remove(filename)
+    elif verbose >= 2:
+        print('Resuming after {:} finished receiver(s).'.format(len(done)))
+    done = set(done)
+    inst = [(_inst, xyz) for _inst, xyz in inst if _inst not in done]
     # Raytrace each instrument
     ninst = len(inst)
     if verbose >= 2:
         print('Raytracing paths to {:} receiver(s)...'.format(ninst))
-    if os.path.isfile(rayfile):
-        os.remove(rayfile)
-    start_all = time.clock()
-    for i, _inst in enumerate(inst):
-        # Set flag to leave rayfan file open for additional instruments
-        if i == 0:
-            irayfile_exists = 0
-        else:
-            irayfile_exists = 1
-        recx, recy, recz = inst[_inst]
-        # Build input
-        if verbose >= 3:
-            print(' Tracing rays for receiver #{:} ({:} of {:})'\
-                    .format(_inst, i + 1, ninst))
-        sh = '#!/bin/bash\n'
-        sh += '#\n'
-        sh += '{:} << eof\n'.format(RAYTR_PROGRAM)
-        sh += '{:}\n'.format(vmfile)
-        sh += '{:}\n'.format(_inst)
-        sh += '{:},{:},{:}\n'.format(grid_size[0], grid_size[1], grid_size[2])
-        sh += '{:}\n'.format(1. / min_velocity)
-        sh += '{:}\n'.format(max_node_size)
-        sh += '{:<10.5f} {:<10.5f} {:<10.5f}\n'.format(recx, recy, recz)
-        sh += '{:},{:}\n'.format(top_layer, bottom_layer)
-        sh += '{:},{:},{:}\n'.format(forward_star_size[0],
-                                     forward_star_size[1],
-                                     forward_star_size[2])
-        sh += '{:}\n'.format(min_angle)
-        sh += '{:}\n'.format(shotfile)
-        sh += '{:}\n'.format(pickfile)
-        sh += '{:}\n'.format(rayfile)
-        sh += '{:}\n'.format(irayfile_exists)
-        sh += '0.0\n'  # XXX seting instrument static to 0. here!
-                       # TODO take as input
-        sh += 'eof\n'
-
-        start = time.clock()
-        if os.path.isfile(rayfile):
-            raysize0 = os.path.getsize(rayfile)
-        else:
-            raysize0 = 0
-
-        if (verbose >=4):
-            print(sh)
-
-        if (verbose >= 4) or (stdout is not None):
-            subprocess.call(sh, shell=True, stdout=stdout,
-                                         stderr=stderr)
-        else:
-            with open(os.devnull, "w") as fnull:
-                subprocess.call(sh, shell=True, stdout=fnull,
-                                stderr=stderr)
-        elapsed = (time.clock() - start)
-        if os.path.isfile(rayfile):
-            raysize1 = os.path.getsize(rayfile)
-        else:
-            raysize1 = 0
-        if (raysize1 == raysize0) and verbose >= 1:
-            msg = 'Did not appear to trace rays for receiver #{:}'\
-                    .format(_inst)
-            warnings.warn(msg)
-        if verbose >= 3:
-            print('Completed raytracing for receiver #{:} in {:} seconds.'\
-                .format(_inst, elapsed))
+    params = dict(vmfile=vmfile, grid_size=grid_size,
+                  forward_star_size=forward_star_size, min_angle=min_angle,
+                  min_velocity=min_velocity, max_node_size=max_node_size,
+                  top_layer=top_layer, bottom_layer=bottom_layer,
+                  shotfile=shotfile, pickfile=pickfile)
+    start_all = time.time()
+    log = []
+    fckpt = open(manifest, 'a')
+    if n_workers > 1:
+        workdir = tempfile.mkdtemp(prefix='.raytrace_',
+                dir=os.path.dirname(os.path.abspath(rayfile)))
+        def _trace(job):
+            i, (_inst, xyz) = job
+            _rayfile = os.path.join(workdir, '{:}.rays'.format(i))
+            run = _trace_receiver(_inst, xyz, _rayfile, 0, params, i, ninst,
+                                  stdout=stdout, stderr=stderr,
+                                  verbose=verbose)
+            return _rayfile, run
+        pool = ThreadPool(n_workers)
+        try:
+            for _rayfile, run in pool.imap(_trace, enumerate(inst)):
+                append_rayfile(_rayfile, rayfile)
+                if os.path.isfile(_rayfile):
+                    os.remove(_rayfile)
+                if run[-1] == 0:
+                    _write_checkpoint(fckpt, run[0], rayfile)
+                log.append(run)
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(workdir, ignore_errors=True)
+            fckpt.close()
+    else:
+        try:
+            for i, (_inst, xyz) in enumerate(inst):
+                # Set flag to leave rayfan file open for additional
+                # instruments
+                if os.path.isfile(rayfile) and os.path.getsize(rayfile) > 0:
+                    irayfile_exists = 1
+                else:
+                    irayfile_exists = 0
+                log.append(_trace_receiver(_inst, xyz, rayfile,
+                                           irayfile_exists, params, i, ninst,
+                                           stdout=stdout, stderr=stderr,
+                                           verbose=verbose))
+                if log[-1][-1] == 0:
+                    _write_checkpoint(fckpt, _inst, rayfile)
+        finally:
+            fckpt.close()
+    if all([run[-1] == 0 for run in log]):
+        os.remove(manifest)
     if verbose >= 2:
         print('Completed raytracing for all recievers in {:} seconds.'\
-                .format(time.clock() - start_all))
+                .format(time.time() - start_all))
     if os.path.isfile(rayfile) and verbose > 1:
         print('Output rayfile is: {:}'.format(rayfile))
     elif not os.path.isfile(rayfile) and (verbose >= 1):
         msg = 'Did not create a rayfile.'
         warnings.warn(msg)
+    return pd.DataFrame(log, columns=RUN_LOG_COLUMNS)
+
+
+
+def raytrace_incremental(vmfile, rayfile, previous_vmfile, previous_rayfile,
+                         tolerance=0.001, instfile='inst.dat',
+                         verbose=True, **kwargs):
+    """
+    Retrace only receivers whose travel times are changed by a model update.
+
+    The travel time of each ray in ``previous_rayfile`` is integrated along
+    its existing path through both the previous and the updated slowness
+    models. Receivers with any ray whose travel time changes by more than
+    ``tolerance`` are retraced with :func:`raytrace_from_ascii`. The rays of
+    all other receivers are reused with their travel times updated by the
+    change in path-integrated travel time.
+
+    Parameters
+    ----------
+    vmfile : str
+        Filename of the updated VM Tomography slowness model.
+    rayfile : str
+        Filename of the output VM Tomography rayfan file.
+    previous_vmfile : str
+        Filename of the slowness model that ``previous_rayfile`` was traced
+        through.
+    previous_rayfile : str
+        Filename of the rayfan file traced through ``previous_vmfile``.
+    tolerance : float, optional
+        Largest travel-time change, in seconds, for which the previous
+        raypaths are reused.
+    instfile : str, optional
+        Filename of the ASCII-formatted instrument location file. Receivers
+        without rays in ``previous_rayfile`` are always traced.
+    verbose : {bool, int}, optional
+        See :func:`raytrace_from_ascii`.
+    **kwargs
+        Additional keyword arguments for :func:`raytrace_from_ascii`.
+
+    Returns
+    -------
+    log : :class:`pandas.DataFrame`
+        Log with one row per receiver and the columns: ``receiver``,
+        ``nrays`` (number of previous rays), ``max_change`` (largest absolute
+        change in path-integrated travel time), ``retraced``, and ``failed``
+        (retraced receivers that the raytracer produced no rays for). Failed
+        receivers are left out of ``rayfile`` rather than keeping their
+        outdated rays.
+    """
+    if verbose and (type(verbose) == bool):
+        verbose = 4
+    with open(previous_rayfile, 'rb') as f:
+        previous = readRayfanGroup(f)
+    vm0 = VM(previous_vmfile)
+    vm1 = VM(vmfile)
+    sl0 = _model_slowness(vm0)
+    sl1 = _model_slowness(vm1)
+    # Compare travel times along the previous raypaths
+    rayfans = {}
+    log = []
+    for rfn in previous.rayfans:
+        dt = integrate_paths(sl1, vm1.grid, rfn.paths)\
+                - integrate_paths(sl0, vm0.grid, rfn.paths)
+        max_change = np.max(np.abs(dt)) if len(dt) > 0 else 0.
+        retraced = max_change > tolerance
+        if not retraced:
+            rfn.travel_times = np.asarray(rfn.travel_times) + dt
+            rayfans[rfn.start_point_id] = rfn
+        log.append((rfn.start_point_id, rfn.nrays, max_change, retraced,
+                    False))
+    inst = _read_instruments(instfile)
+    logged = set([row[0] for row in log])
+    for _inst, _ in inst:
+        if _inst not in logged:
+            log.append((_inst, 0, np.nan, True, False))
+    log = pd.DataFrame(log, columns=INCREMENTAL_LOG_COLUMNS)
+    # Retrace receivers with large changes
+    retrace = set(log['receiver'][log['retraced']])
+    if verbose >= 2:
+        print('Retracing {:} of {:} receiver(s)...'.format(len(retrace),
+                                                          len(inst)))
+    if len(retrace) > 0:
+        workdir = tempfile.mkdtemp(prefix='.raytrace_',
+                dir=os.path.dirname(os.path.abspath(rayfile)))
+        try:
+            _instfile = os.path.join(workdir, 'inst.dat')
+            _rayfile = os.path.join(workdir, 'retraced.rays')
+            _write_points(_instfile, instfile, retrace)
+            raytrace_from_ascii(vmfile, _rayfile, instfile=_instfile,
+                                verbose=verbose, **kwargs)
+            if os.path.isfile(_rayfile):
+                with open(_rayfile, 'rb') as f:
+                    for rfn in readRayfanGroup(f).rayfans:
+                        rayfans[rfn.start_point_id] = rfn
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        log['failed'] = log['retraced'] & ~log['receiver'].isin(list(rayfans))
+        if log['failed'].any() and (verbose >= 1):
+            msg = 'Could not retrace receiver(s): {:}'.format(
+                    ', '.join(str(r) for r in log['receiver'][log['failed']]))
+            warnings.warn(msg)
+    # Write reused and retraced rayfans in receiver order
+    rays = RayfanGroup()
+    rays.rayfans = [rayfans[_inst] for _inst, _ in inst if _inst in rayfans]
+    rays.write(rayfile, version=previous.FORMAT)
+    return log
+
+
+
+def plan_raytrace(instfile='inst.dat', shotfile='shot.dat',
+                  pickfile='pick.dat'):
+    """
+    Choose the cheaper side of a survey to raytrace from.
+
+    The raytracing program is run once for each tracing origin, so by
+    reciprocity it is cheapest to trace from whichever of the picked
+    receivers or picked shots are fewer.
+
+    Parameters
+    ----------
+    instfile, shotfile, pickfile : str, optional
+        Filenames of the ASCII-formatted instrument location, shot location,
+        and pick time files. See :func:`raytrace_from_ascii`.
+
+    Returns
+    -------
+    plan : dict
+        Dictionary with the keys: ``'origin'`` (``'receivers'`` or
+        ``'sources'``), ``'receivers'`` and ``'sources'`` (sorted IDs of
+        receivers and shots that have picks), ``'nruns'`` (number of
+        raytracing program runs), and ``'ninst'`` and ``'nshot'`` (number of
+        receivers and shots in ``instfile`` and ``shotfile``).
+    """
+    ids = np.atleast_2d(np.loadtxt(pickfile, usecols=(0, 1), ndmin=2))
+    receivers = np.unique(np.asarray(ids[:, 0], dtype=int))
+    sources = np.unique(np.asarray(ids[:, 1], dtype=int))
+    if len(sources) < len(receivers):
+        origin = 'sources'
+    else:
+        origin = 'receivers'
+    return {'origin': origin, 'receivers': receivers, 'sources': sources,
+            'nruns': min(len(receivers), len(sources)),
+            'ninst': len(_read_instruments(instfile)),
+            'nshot': len(_read_instruments(shotfile))}
+
+
+def raytrace_reciprocal(vmfile, rayfile, instfile='inst.dat',
+                        shotfile='shot.dat', pickfile='pick.dat',
+                        verbose=True, **kwargs):
+    """
+    Raytrace from the cheaper side of a survey using reciprocity.
+
+    Uses :func:`plan_raytrace` to choose between tracing from the picked
+    receivers or the picked shots. If shots are fewer, the roles of shots
+    and receivers are swapped in the raytracing input files and swapped
+    back in the output rayfans, so that each rayfan in ``rayfile`` starts at
+    a receiver (``start_point_id``) and ends at shots (``end_point_ids``),
+    as if traced by :func:`raytrace_from_ascii`.
+
+    Parameters
+    ----------
+    vmfile, rayfile, instfile, shotfile, pickfile : str
+        See :func:`raytrace_from_ascii`.
+    verbose : {bool, int}, optional
+        See :func:`raytrace_from_ascii`.
+    **kwargs
+        Additional keyword arguments for :func:`raytrace_from_ascii`.
+
+    Returns
+    -------
+    log : :class:`pandas.DataFrame`
+        Run log from :func:`raytrace_from_ascii`. The ``receiver`` column
+        holds the IDs of the tracing origins, which are shot IDs if the
+        roles were swapped.
+    """
+    if verbose and (type(verbose) == bool):
+        verbose = 4
+    plan = plan_raytrace(instfile=instfile, shotfile=shotfile,
+                         pickfile=pickfile)
+    if verbose >= 2:
+        print('Raytracing from {:} {:} instead of {:} {:}.'.format(
+            plan['nruns'], plan['origin'],
+            max(len(plan['receivers']), len(plan['sources'])),
+            {'receivers': 'sources',
+             'sources': 'receivers'}[plan['origin']]))
+    workdir = tempfile.mkdtemp(prefix='.raytrace_',
+            dir=os.path.dirname(os.path.abspath(rayfile)))
+    try:
+        _instfile = os.path.join(workdir, 'inst.dat')
+        if plan['origin'] == 'receivers':
+            _write_points(_instfile, instfile, plan['receivers'])
+            return raytrace_from_ascii(vmfile, rayfile, instfile=_instfile,
+                                       shotfile=shotfile, pickfile=pickfile,
+                                       verbose=verbose, **kwargs)
+        # swap roles of shots and receivers
+        _shotfile = os.path.join(workdir, 'shot.dat')
+        _pickfile = os.path.join(workdir, 'pick.dat')
+        _rayfile = os.path.join(workdir, 'reciprocal.rays')
+        _write_points(_instfile, shotfile, plan['sources'])
+        _write_points(_shotfile, instfile, plan['receivers'])
+        with open(pickfile, 'r') as fin, open(_pickfile, 'w') as fout:
+            for row in fin:
+                dat = row.split()
+                if len(dat) == 0:
+                    continue
+                dat[0], dat[1] = dat[1], dat[0]
+                fout.write(' '.join(dat) + '\n')
+        log = raytrace_from_ascii(vmfile, _rayfile, instfile=_instfile,
+                                  shotfile=_shotfile, pickfile=_pickfile,
+                                  verbose=verbose, **kwargs)
+        if os.path.isfile(_rayfile):
+            with open(_rayfile, 'rb') as f:
+                rays = swap_rayfans(readRayfanGroup(f),
+                                    order=[i for i, _ in
+                                           _read_instruments(instfile)])
+            rays.write(rayfile)
+        elif os.path.isfile(rayfile):
+            os.remove(rayfile)
+        return log
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def swap_rayfans(rays, order=None):
+    """
+    Regroup rayfans by their end points.
+
+    Converts rayfans traced from shots to receivers into rayfans traced
+    from receivers to shots (or vice versa). Raypaths are reversed so that
+    they start at the new end point.
+
+    Parameters
+    ----------
+    rays : :class:`pyvm.forward.raytracing.rayfan.RayfanGroup`
+        Rayfans to regroup.
+    order : list, optional
+        Order of the new start points in the output. Default is to sort
+        them by ID.
+
+    Returns
+    -------
+    rays : :class:`pyvm.forward.raytracing.rayfan.RayfanGroup`
+        Regrouped rayfans.
+    """
+    groups = {}
+    for rfn in rays.rayfans:
+        for i in range(rfn.nrays):
+            groups.setdefault(rfn.end_point_ids[i], []).append((
+                rfn.start_point_id, rfn.event_ids[i], rfn.event_subids[i],
+                rfn.pick_times[i], rfn.travel_times[i], rfn.pick_errors[i],
+                np.asarray(rfn.paths[i])[::-1]))
+    if order is None:
+        order = sorted(groups)
+    swapped = RayfanGroup()
+    for _id in order:
+        if _id not in groups:
+            continue
+        dat = list(zip(*groups[_id]))
+        swapped.rayfans.append(make_rayfan(_id, dat[0], dat[4],
+                list(dat[6]), event_ids=dat[1], event_subids=dat[2],
+                pick_times=dat[3], pick_errors=dat[5]))
+    return swapped
+
+
+
+def raytrace_by_branch(vmfile, rayfile, pickdb, branches=None, n_workers=1,
+                       verbose=True, **kwargs):
+    """
+    Raytrace picks from a pick database in groups of event branches.
+
+    Picks are grouped by their ``branchid`` and ``subid`` and each group is
+    traced with :func:`raytrace_from_ascii` using its own settings, so that
+    the raytracer only searches the layers that a branch can reach. Groups
+    are traced concurrently and their rayfans are appended to ``rayfile``
+    in order of ``branchid`` and ``subid``.
+
+    Parameters
+    ----------
+    vmfile : str
+        Filename of the VM Tomography slowness model to raytrace.
+    rayfile : str
+        Filename of the output VM Tomography rayfan file.
+    pickdb : :class:`pyvm.picks.pickdb.PickDatabase`
+        Database with the picks to raytrace.
+    branches : dict, optional
+        Raytracing settings for each group of picks. Keys are either
+        ``(branchid, subid)`` tuples or ``branchid`` integers, and values
+        are dictionaries of keyword arguments for
+        :func:`raytrace_from_ascii` (e.g., ``top_layer``,
+        ``bottom_layer``, ``forward_star_size``). Settings for a
+        ``(branchid, subid)`` key take precedence over settings for its
+        ``branchid``. Groups without settings are traced with ``kwargs``.
+    n_workers : int, optional
+        Number of groups to raytrace concurrently.
+    verbose : {bool, int}, optional
+        See :func:`raytrace_from_ascii`.
+    **kwargs
+        Default keyword arguments for :func:`raytrace_from_ascii`.
+
+    Returns
+    -------
+    log : :class:`pandas.DataFrame`
+        Run logs from :func:`raytrace_from_ascii` for all groups, with
+        the additional columns ``branchid`` and ``subid``.
+
+    Examples
+    --------
+    Trace Pg refractions through the upper two layers, and PmP
+    reflections and Pn refractions through the crust and upper mantle:
+
+    >>> raytrace_by_branch('model.vm', 'model.rays', pickdb,
+    ...                    branches={0: {'bottom_layer': 1},
+    ...                              1: {'bottom_layer': 3},
+    ...                              2: {'top_layer': 2}},
+    ...                    n_workers=3)  # doctest: +SKIP
+    """
+    if verbose and (type(verbose) == bool):
+        verbose = 4
+    if branches is None:
+        branches = {}
+    sql = "SELECT DISTINCT branchid, subid FROM master_picks"
+    sql += " ORDER BY branchid, subid"
+    groups = [(row[0], row[1]) for row in pickdb.execute(sql)]
+    if verbose >= 2:
+        print('Raytracing {:} group(s) of branches...'.format(len(groups)))
+    for filename in [rayfile, rayfile + CHECKPOINT_SUFFIX]:
+        if os.path.isfile(filename):
+            os.remove(filename)
+    workdir = tempfile.mkdtemp(prefix='.raytrace_',
+            dir=os.path.dirname(os.path.abspath(rayfile)))
+    # write input files here, as the database connection belongs to this
+    # thread
+    jobs = []
+    for i, (branchid, subid) in enumerate(groups):
+        prefix = os.path.join(workdir, '{:}.'.format(i))
+        files = dict([(k, prefix + k[:-4] + '.dat')
+                      for k in ['instfile', 'shotfile', 'pickfile']])
+        pickdb.to_vmtomo(sources_file=files['shotfile'],
+                         receivers_file=files['instfile'],
+                         picks_file=files['pickfile'],
+                         branchid=branchid, subid=subid)
+        settings = dict(kwargs)
+        settings.update(branches.get(branchid, {}))
+        settings.update(branches.get((branchid, subid), {}))
+        settings.update(files)
+        jobs.append((branchid, subid, prefix + 'rays', settings))
+    def _trace(job):
+        branchid, subid, _rayfile, settings = job
+        if verbose >= 2:
+            print('Raytracing branch {:}.{:}...'.format(branchid, subid))
+        log = raytrace_from_ascii(vmfile, _rayfile, verbose=verbose,
+                                  **settings)
+        log.insert(0, 'subid', subid)
+        log.insert(0, 'branchid', branchid)
+        return _rayfile, log
+    logs = []
+    pool = ThreadPool(max(1, n_workers))
+    try:
+        for _rayfile, log in pool.imap(_trace, jobs):
+            append_rayfile(_rayfile, rayfile)
+            logs.append(log)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if len(logs) == 0:
+        return pd.DataFrame(columns=['branchid', 'subid'] + RUN_LOG_COLUMNS)
+    return pd.concat(logs, ignore_index=True)
+
+def _write_points(filename, source, ids):
+    """
+    Copy the rows for a set of IDs from an ASCII location file.
+    """
+    ids = set(ids)
+    with open(filename, 'w') as fout:
+        for _id, (x, y, z) in _read_instruments(source):
+            if _id in ids:
+                fout.write('{:} {:} {:} {:}\n'.format(_id, x, y, z))
+
+def integrate_paths(sl, grid, paths):
+    """
+    Integrate slowness along raypaths.
+
+    Raypath segments are divided into pieces no longer than the smallest
+    grid spacing, and slowness is sampled at the grid node nearest to the
+    midpoint of each piece.
+
+    Parameters
+    ----------
+    sl : ndarray
+        Slowness grid with shape ``(nx, ny, nz)``.
+    grid : :class:`pyvm.models.grids.CartesianGrid3D`
+        Grid that defines the node coordinates of ``sl``.
+    paths : list
+        List of ``(n, 3)`` arrays of raypath coordinates.
+
+    Returns
+    -------
+    times : ndarray
+        Travel time along each raypath.
+    """
+    times = np.zeros(len(paths))
+    segments = [np.asarray(p) for p in paths if len(p) > 1]
+    if len(segments) == 0:
+        return times
+    iray = np.concatenate([np.repeat(i, len(p) - 1)\
+                           for i, p in enumerate(paths) if len(p) > 1])
+    p0 = np.concatenate([p[:-1] for p in segments])
+    delta = np.concatenate([np.diff(p, axis=0) for p in segments])
+    length = np.sqrt(np.sum(delta ** 2, axis=1))
+    # split segments into pieces no longer than the grid spacing
+    step = np.min([d for d, n in zip(grid.spacing, grid.shape) if n > 1])
+    npiece = np.maximum(1, np.ceil(length / step)).astype(int)
+    iseg = np.repeat(np.arange(len(p0)), npiece)
+    first = np.repeat(np.cumsum(npiece) - npiece, npiece)
+    frac = (np.arange(len(iseg)) - first + 0.5) / npiece[iseg]
+    ijk = grid.xyz2ijk(p0[iseg] + frac[:, np.newaxis] * delta[iseg])
+    dt = (length / npiece)[iseg] * sl[ijk[:, 0], ijk[:, 1], ijk[:, 2]]
+    times += np.bincount(iray[iseg], weights=dt, minlength=len(paths))
+    return times
+
+
+def _model_slowness(vm):
+    """
+    Return the slowness grid of a model with interface jumps applied.
+    """
+    vm.apply_jumps()
+    return vm.sl
+
+def _read_instruments(instfile):
+    """
+    Read instrument locations from an ASCII instrument file.
+
+    Parameters
+    ----------
+    instfile : str
+        Filename of the ASCII-formatted instrument location file with
+        the four columns: ``inst_id, x, y, z``.
+
+    Returns
+    -------
+    inst : list
+        List of ``(inst_id, [x, y, z])`` tuples in the order that
+        instruments appear in ``instfile``.
+    """
+    inst = []
+    with open(instfile, 'rb') as finst:
+        for row in finst:
+            dat = row.split()
+            if len(dat) == 0:
+                continue
+            inst.append((int(dat[0]), [float(d) for d in dat[1:4]]))
+    return inst
+
+
+def _write_checkpoint(fckpt, inst_id, rayfile):
+    """
+    Record a finished receiver in the checkpoint manifest.
+
+    Parameters
+    ----------
+    fckpt : file
+        Checkpoint manifest opened for appending.
+    inst_id : int
+        ID of the receiver that finished.
+    rayfile : str
+        Filename of the output rayfan file.
+    """
+    if os.path.isfile(rayfile):
+        size = os.path.getsize(rayfile)
+    else:
+        size = 0
+    fckpt.write('{:} {:}\n'.format(inst_id, size))
+    fckpt.flush()
+    os.fsync(fckpt.fileno())
+
+
+def _restore_checkpoint(rayfile, manifest):
+    """
+    Roll a rayfan file back to the last receiver in a checkpoint manifest.
+
+    Any data written after the last finished receiver (i.e., a partial
+    rayfan from an interrupted run) is discarded.
+
+    Parameters
+    ----------
+    rayfile : str
+        Filename of the output rayfan file.
+    manifest : str
+        Filename of the checkpoint manifest.
+
+    Returns
+    -------
+    done : list
+        IDs of receivers that finished before the run was interrupted.
+        Empty if the run cannot be resumed.
+    """
+    if not (os.path.isfile(manifest) and os.path.isfile(rayfile)):
+        return []
+    filesize = os.path.getsize(rayfile)
+    entries = []
+    with open(manifest, 'r') as f:
+        for row in f:
+            dat = row.split()
+            if len(dat) != 2 or int(dat[1]) > filesize:
+                # incomplete entry or rayfile was truncated after it
+                break
+            entries.append((int(dat[0]), int(dat[1])))
+    sizes = sorted(set([size for _, size in entries if size > 0]))
+    if len(sizes) == 0:
+        return []
+    # each receiver that grew the rayfile added one rayfan
+    truncate_rayfile(rayfile, sizes[-1], len(sizes))
+    # rewrite the manifest without any incomplete entries
+    with open(manifest, 'w') as f:
+        for _inst, size in entries:
+            f.write('{:} {:}\n'.format(_inst, size))
+    done = [_inst for _inst, _ in entries]
+    return done
+
+
+def _build_raytr_input(inst_id, inst_xyz, rayfile, irayfile_exists,
+                       params):
+    """
+    Build the parameter block read by the raytracing program on stdin.
+
+    Parameters
+    ----------
+    inst_id : int
+        Receiver ID.
+    inst_xyz : (float, float, float)
+        Receiver coordinates.
+    rayfile : str
+        Filename of the output rayfan file.
+    irayfile_exists : int
+        Set to 1 to append to an existing ``rayfile`` or 0 to create a new
+        file.
+    params : dict
+        Raytracing parameters common to all receivers. See
+        :func:`raytrace_from_ascii`.
+
+    Returns
+    -------
+    block : str
+        Newline-separated raytracing parameters.
+    """
+    recx, recy, recz = inst_xyz
+    grid_size = params['grid_size']
+    forward_star_size = params['forward_star_size']
+    block = '{:}\n'.format(params['vmfile'])
+    block += '{:}\n'.format(inst_id)
+    block += '{:},{:},{:}\n'.format(grid_size[0], grid_size[1],
+                                    grid_size[2])
+    block += '{:}\n'.format(1. / params['min_velocity'])
+    block += '{:}\n'.format(params['max_node_size'])
+    block += '{:<10.5f} {:<10.5f} {:<10.5f}\n'.format(recx, recy, recz)
+    block += '{:},{:}\n'.format(params['top_layer'], params['bottom_layer'])
+    block += '{:},{:},{:}\n'.format(forward_star_size[0],
+                                    forward_star_size[1],
+                                    forward_star_size[2])
+    block += '{:}\n'.format(params['min_angle'])
+    block += '{:}\n'.format(params['shotfile'])
+    block += '{:}\n'.format(params['pickfile'])
+    block += '{:}\n'.format(rayfile)
+    block += '{:}\n'.format(irayfile_exists)
+    block += '0.0\n'  # XXX seting instrument static to 0. here!
+                      # TODO take as input
+    return block
+
+
+def _run_raytr(block, stdout=None, stderr=None):
+    """
+    Run the raytracing program with a parameter block on stdin.
+
+    Parameters
+    ----------
+    block : str
+        Parameter block built by :func:`_build_raytr_input`.
+    stdout, stderr : optional
+        See :func:`raytrace_from_ascii`.
+
+    Returns
+    -------
+    returncode : int
+        Exit status of the raytracing program. Negative values indicate
+        that the program was terminated by a signal.
+    cpu_time : float
+        User plus system CPU time used by the raytracing program in
+        seconds, or ``NaN`` on platforms without :func:`os.wait4`.
+    """
+    proc = subprocess.Popen([RAYTR_PROGRAM], stdin=subprocess.PIPE,
+                            stdout=stdout, stderr=stderr)
+    cpu_time = np.nan
+    try:
+        try:
+            proc.stdin.write(block.encode('utf-8'))
+            proc.stdin.close()
+        except (IOError, OSError) as e:
+            # program exited before reading all of its input
+            if e.errno != errno.EPIPE:
+                raise
+        if hasattr(os, 'wait4'):
+            while True:
+                try:
+                    _, status, usage = os.wait4(proc.pid, 0)
+                    break
+                except OSError as e:
+                    if e.errno != errno.EINTR:
+                        raise
+            if os.WIFSIGNALED(status):
+                proc.returncode = -os.WTERMSIG(status)
+            else:
+                proc.returncode = os.WEXITSTATUS(status)
+            cpu_time = usage.ru_utime + usage.ru_stime
+        else:
+            proc.wait()
+    finally:
+        if proc.returncode is None:
+            # interrupted before the program finished
+            proc.kill()
+            proc.wait()
+    return proc.returncode, cpu_time
+
+
+def _count_rays(rayfile, offset):
+    """
+    Return the number of rays in the rayfan starting at a byte offset.
+
+    Parameters
+    ----------
+    rayfile : str
+        Filename of the rayfan file.
+    offset : int
+        Byte offset of the rayfan in ``rayfile``. If 0, the first rayfan
+        after the file header is used.
+    """
+    with open(rayfile, 'rb') as f:
+        if offset == 0:
+            _, _, offset = read_rayfile_header(f, endian=ENDIAN)
+        f.seek(offset + 4)
+        return unpack('{:}i'.format(ENDIAN), f.read(4))[0]
+
+
+def _trace_receiver(inst_id, inst_xyz, rayfile, irayfile_exists, params,
+                    i=0, ninst=1, stdout=None, stderr=None, verbose=True):
+    """
+    Run the raytracing program for a single receiver.
+
+    Parameters
+    ----------
+    inst_id : int
+        Receiver ID.
+    inst_xyz : (float, float, float)
+        Receiver coordinates.
+    rayfile : str
+        Filename of the output rayfan file.
+    irayfile_exists : int
+        Set to 1 to append to an existing ``rayfile`` or 0 to create a new
+        file.
+    params : dict
+        Raytracing parameters common to all receivers. See
+        :func:`raytrace_from_ascii`.
+    i, ninst : int, optional
+        Index of this receiver and total number of receivers. Only used
+        for status messages.
+    stdout, stderr, verbose : optional
+        See :func:`raytrace_from_ascii`.
+
+    Returns
+    -------
+    run : tuple
+        Run log entry with the fields in :data:`RUN_LOG_COLUMNS`. If the
+        raytracing program fails, anything it wrote is removed from
+        ``rayfile`` and no rays are logged.
+    """
+    if verbose >= 3:
+        print(' Tracing rays for receiver #{:} ({:} of {:})'\
+                .format(inst_id, i + 1, ninst))
+    block = _build_raytr_input(inst_id, inst_xyz, rayfile, irayfile_exists,
+                               params)
+
+    if os.path.isfile(rayfile):
+        raysize0 = os.path.getsize(rayfile)
+    else:
+        raysize0 = 0
+    if raysize0 > 0:
+        with open(rayfile, 'rb') as f:
+            _, nrayfans0, _ = read_rayfile_header(f, endian=ENDIAN)
+
+    if (verbose >=4):
+        print(block)
+
+    start = time.time()
+    if (verbose >= 4) or (stdout is not None):
+        returncode, cpu_time = _run_raytr(block, stdout=stdout,
+                                          stderr=stderr)
+    else:
+        with open(os.devnull, "w") as fnull:
+            returncode, cpu_time = _run_raytr(block, stdout=fnull,
+                                              stderr=stderr)
+    elapsed = (time.time() - start)
+    if returncode != 0:
+        # discard a partially written rayfan
+        if raysize0 > 0:
+            truncate_rayfile(rayfile, raysize0, nrayfans0)
+        elif os.path.isfile(rayfile):
+            os.remove(rayfile)
+        if verbose >= 1:
+            msg = 'Raytracing program failed for receiver #{:} with exit'\
+                    ' status {:}'.format(inst_id, returncode)
+            warnings.warn(msg)
+    if os.path.isfile(rayfile):
+        raysize1 = os.path.getsize(rayfile)
+    else:
+        raysize1 = 0
+    if raysize1 > raysize0:
+        nrays = _count_rays(rayfile, raysize0)
+    else:
+        nrays = 0
+    if (raysize1 == raysize0) and (returncode == 0) and verbose >= 1:
+        msg = 'Did not appear to trace rays for receiver #{:}'\
+                .format(inst_id)
+        warnings.warn(msg)
+    if verbose >= 3:
+        print('Completed raytracing for receiver #{:} in {:} seconds.'\
+            .format(inst_id, elapsed))
+    return (inst_id, elapsed, cpu_time, nrays, raysize1 - raysize0,
+            returncode)
@@ -0,0 +1,77 @@
+"""
+Minimal stand-in for the VM Tomography ``slim_rays`` program.
+
+Reads the ``slim_rays`` parameter block from stdin and writes one rayfan
+with a straight raypath from each picked shot to the receiver. Travel times
+are the straight-line distance divided by 5 km/s.
+
+If the receiver ID is listed in the ``FAKE_SLIM_RAYS_FAIL`` environment
+variable, half of the rayfan is written before exiting with status 1.
+"""
+from __future__ import print_function
+import os
+import sys
+import struct
+
+ENDIAN = '<' if sys.byteorder == 'little' else '>'
+VELOCITY = 5.0
+
+
+def main():
+    params = [line.strip() for line in sys.stdin.readlines()]
+    inst = int(params[1])
+    recx, recy, recz = [float(v) for v in params[5].split()]
+    shotfile, pickfile, rayfile = params[9], params[10], params[11]
+    append = int(params[12]) == 1
+    static = float(params[13])
+
+    shots = {}
+    for row in open(shotfile):
+        dat = row.split()
+        shots[int(dat[0])] = [float(v) for v in dat[1:4]]
+
+    rays = []
+    for row in open(pickfile):
+        dat = row.split()
+        if int(dat[0]) != inst:
+            continue
+        shot = int(dat[1])
+        x, y, z = shots[shot]
+        dist = ((x - recx) ** 2 + (y - recy) ** 2 + (z - recz) ** 2) ** 0.5
+        rays.append((shot, int(dat[2]), int(dat[3]), float(dat[5]),
+                     dist / VELOCITY, float(dat[6]),
+                     [x, y, z, recx, recy, recz]))
+
+    body = struct.pack(ENDIAN + 'iii', inst, len(rays), 2 * len(rays))
+    body += struct.pack(ENDIAN + 'f', static)
+    for i in range(3):
+        body += struct.pack(ENDIAN + 'i' * len(rays),
+                            *[r[i] for r in rays])
+    body += struct.pack(ENDIAN + 'i' * len(rays), *[2 for r in rays])
+    for i in range(3, 6):
+        body += struct.pack(ENDIAN + 'f' * len(rays),
+                            *[r[i] for r in rays])
+    for r in rays:
+        body += struct.pack(ENDIAN + 'ffffff', *r[6])
+
+    if append and os.path.isfile(rayfile):
+        f = open(rayfile, 'r+b')
+        f.seek(4)
+        n = struct.unpack(ENDIAN + 'i', f.read(4))[0]
+        f.seek(4)
+        f.write(struct.pack(ENDIAN + 'i', n + 1))
+        f.seek(0, os.SEEK_END)
+    else:
+        f = open(rayfile, 'wb')
+        f.write(struct.pack(ENDIAN + 'ii', -2, 1))
+    if str(inst) in os.environ.get('FAKE_SLIM_RAYS_FAIL', '').split(','):
+        f.write(body[:len(body) // 2])
+        f.close()
+        sys.exit(1)
+    f.write(body)
+    f.close()
+    print('Traced {:} rays for receiver {:}'.format(len(rays), inst))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+"""
+Test suite for the raytracing module
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+
+import os
+import errno
+import signal
+import shutil
+import subprocess
+import tempfile
+import unittest
+import numpy as np
+from pyvm.utils.loaders import get_example_file, install_example_program
+from pyvm.models.vm import VM
+from pyvm.picks.pickdb import PickDatabase
+from pyvm.forward.raytracing import raytracing, rayfan
+
+
+def write_geometry(directory, ninst=5, nshot=4):
+    """
+    Write simple instrument, shot, and pick files.
+    """
+    instfile = os.path.join(directory, 'inst.dat')
+    shotfile = os.path.join(directory, 'shot.dat')
+    pickfile = os.path.join(directory, 'pick.dat')
+    with open(instfile, 'w') as f:
+        for i in range(ninst):
+            f.write('{:} {:} 0.0 2.0\n'.format(100 + i, 10. * (i + 1)))
+    with open(shotfile, 'w') as f:
+        for j in range(nshot):
+            f.write('{:} {:} 0.0 0.006\n'.format(9000 + j, 5. * (j + 1)))
+    with open(pickfile, 'w') as f:
+        for i in range(ninst):
+            for j in range(nshot):
+                f.write('{:} {:} 1 0 9.999 {:} 0.050\n'\
+                        .format(100 + i, 9000 + j, 1. + i + 0.1 * j))
+    return instfile, shotfile, pickfile
+
+
+class raytracingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._program = raytracing.RAYTR_PROGRAM
+        raytracing.RAYTR_PROGRAM = install_example_program(
+                'fake_slim_rays.py', self.tmpdir, 'slim_rays')
+        self.vmfile = get_example_file('benchmark2d.vm')
+        self.instfile, self.shotfile, self.pickfile = \
+                write_geometry(self.tmpdir)
+
+    def tearDown(self):
+        raytracing.RAYTR_PROGRAM = self._program
+        shutil.rmtree(self.tmpdir)
+
+    def trace(self, rayfile, **kwargs):
+        return raytracing.raytrace_from_ascii(self.vmfile, rayfile,
+                instfile=self.instfile, shotfile=self.shotfile,
+                pickfile=self.pickfile, verbose=False, **kwargs)
+
+    def test_raytrace_from_ascii(self):
+        """
+        Should trace rays for each receiver into one rayfile
+        """
+        rayfile = os.path.join(self.tmpdir, 'serial.rays')
+        self.trace(rayfile)
+
+        rays = rayfan.readRayfanGroup(rayfile)
+        self.assertEqual([r.start_point_id for r in rays.rayfans],
+                         [100, 101, 102, 103, 104])
+        self.assertEqual(rays.nrays, 20)
+
+    def test_raytrace_from_ascii_parallel(self):
+        """
+        Should trace receivers concurrently and merge in receiver order
+        """
+        rayfile0 = os.path.join(self.tmpdir, 'serial.rays')
+        self.trace(rayfile0)
+
+        rayfile1 = os.path.join(self.tmpdir, 'parallel.rays')
+        self.trace(rayfile1, n_workers=3)
+
+        with open(rayfile0, 'rb') as f0, open(rayfile1, 'rb') as f1:
+            self.assertEqual(f0.read(), f1.read())
+
+        # should clean up temporary rayfiles
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                ['inst.dat', 'parallel.rays', 'pick.dat', 'serial.rays',
+                 'shot.dat', 'slim_rays'])
+
+    def test_run_raytr(self):
+        """
+        Should retry interrupted waits and kill the program on errors
+        """
+        wait4 = os.wait4
+        calls = []
+        def _wait4(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OSError(errno.EINTR, 'Interrupted system call')
+            return wait4(*args)
+        os.wait4 = _wait4
+        try:
+            log = self.trace(os.path.join(self.tmpdir, 'eintr.rays'))
+        finally:
+            os.wait4 = wait4
+        self.assertEqual(list(log['returncode']), [0, 0, 0, 0, 0])
+        self.assertEqual(len(calls), 6)
+
+        program = os.path.join(self.tmpdir, 'sleep')
+        with open(program, 'w') as f:
+            f.write('#!/bin/sh\nsleep 30\n')
+        os.chmod(program, 0o755)
+        raytracing.RAYTR_PROGRAM = program
+        procs = []
+        popen = subprocess.Popen
+        class _Popen(popen):
+            def __init__(self, *args, **kwargs):
+                popen.__init__(self, *args, **kwargs)
+                procs.append(self)
+        def _interrupt(*args):
+            raise KeyboardInterrupt
+        subprocess.Popen = _Popen
+        os.wait4 = _interrupt
+        try:
+            self.assertRaises(KeyboardInterrupt, raytracing._run_raytr, '')
+        finally:
+            subprocess.Popen = popen
+            os.wait4 = wait4
+        self.assertEqual(procs[0].returncode, -signal.SIGKILL)
+
+    def test_run_log(self):
+        """
+        Should return a per-receiver run log
+        """
+        rayfile = os.path.join(self.tmpdir, 'serial.rays')
+        log = self.trace(rayfile)
+
+        self.assertEqual(list(log.columns), raytracing.RUN_LOG_COLUMNS)
+        self.assertEqual(list(log['receiver']), [100, 101, 102, 103, 104])
+        self.assertEqual(list(log['nrays']), [4, 4, 4, 4, 4])
+        self.assertEqual(list(log['returncode']), [0, 0, 0, 0, 0])
+        self.assertEqual(log['nbytes'].sum(), os.path.getsize(rayfile))
+        self.assertTrue((log['wall_time'] > 0).all())
+        self.assertTrue((log['cpu_time'] >= 0).all())
+
+        # should log the same rays when tracing in parallel
+        log1 = self.trace(rayfile, n_workers=2)
+        self.assertEqual(list(log1['receiver']), list(log['receiver']))
+        self.assertEqual(list(log1['nrays']), list(log['nrays']))
+
+    def test_resume(self):
+        """
+        Should resume an interrupted run from the checkpoint manifest
+        """
+        rayfile0 = os.path.join(self.tmpdir, 'full.rays')
+        self.trace(rayfile0)
+        # should remove the manifest after finishing
+        self.assertFalse(os.path.isfile(rayfile0
+                                        + raytracing.CHECKPOINT_SUFFIX))
+
+        # interrupt the run after writing part of the third rayfan
+        rayfile1 = os.path.join(self.tmpdir, 'resumed.rays')
+        trace_receiver = raytracing._trace_receiver
+        def _crash(inst_id, *args, **kwargs):
+            if inst_id == 102:
+                with open(rayfile1, 'ab') as f:
+                    f.write(b'\x66\x00\x00\x00\x04')
+                raise KeyboardInterrupt
+            return trace_receiver(inst_id, *args, **kwargs)
+        raytracing._trace_receiver = _crash
+        try:
+            self.assertRaises(KeyboardInterrupt, self.trace, rayfile1)
+        finally:
+            raytracing._trace_receiver = trace_receiver
+        self.assertTrue(os.path.isfile(rayfile1
+                                       + raytracing.CHECKPOINT_SUFFIX))
+
+        # should only trace the remaining receivers
+        log = self.trace(rayfile1, resume=True)
+        self.assertEqual(list(log['receiver']), [102, 103, 104])
+        with open(rayfile0, 'rb') as f0, open(rayfile1, 'rb') as f1:
+            self.assertEqual(f0.read(), f1.read())
+
+        # should start over if there is nothing to resume
+        log = self.trace(rayfile1, resume=True)
+        self.assertEqual(len(log), 5)
+
+    def test_failed_receiver(self):
+        """
+        Should discard rays of failed receivers and retrace them on resume
+        """
+        os.environ['FAKE_SLIM_RAYS_FAIL'] = '102'
+        try:
+            for n_workers in [1, 2]:
+                rayfile = os.path.join(self.tmpdir,
+                                       '{:}.rays'.format(n_workers))
+                log = self.trace(rayfile, n_workers=n_workers)
+                self.assertEqual(list(log['returncode']), [0, 0, 1, 0, 0])
+                self.assertEqual(log['nbytes'][2], 0)
+                rays = rayfan.readRayfanGroup(rayfile)
+                self.assertEqual([r.start_point_id for r in rays.rayfans],
+                                 [100, 101, 103, 104])
+                self.assertTrue(os.path.isfile(rayfile
+                        + raytracing.CHECKPOINT_SUFFIX))
+        finally:
+            del os.environ['FAKE_SLIM_RAYS_FAIL']
+
+        log = self.trace(rayfile, resume=True)
+        self.assertEqual(list(log['receiver']), [102])
+        rays = rayfan.readRayfanGroup(rayfile)
+        self.assertEqual(sorted([r.start_point_id for r in rays.rayfans]),
+                         [100, 101, 102, 103, 104])
+        self.assertFalse(os.path.isfile(rayfile
+                                        + raytracing.CHECKPOINT_SUFFIX))
+
+    def test_raytrace_incremental(self):
+        """
+        Should only retrace receivers with rays through model changes
+        """
+        rayfile0 = os.path.join(self.tmpdir, 'previous.rays')
+        self.trace(rayfile0)
+        previous = rayfan.readRayfanGroup(rayfile0)
+
+        # slow down the model beyond the rays of all but the last receiver
+        vm = VM(self.vmfile)
+        vmfile = os.path.join(self.tmpdir, 'updated.vm')
+        vm.sl[vm.grid.x2i([45.])[0]:, :, :] *= 1.1
+        vm.write(vmfile)
+
+        rayfile1 = os.path.join(self.tmpdir, 'updated.rays')
+        log = raytracing.raytrace_incremental(vmfile, rayfile1, self.vmfile,
+                rayfile0, instfile=self.instfile, shotfile=self.shotfile,
+                pickfile=self.pickfile, verbose=False)
+        self.assertEqual(list(log['receiver']), [100, 101, 102, 103, 104])
+        self.assertEqual(list(log['retraced']),
+                         [False, False, False, False, True])
+
+        # should keep receiver order and reuse unchanged travel times
+        rays = rayfan.readRayfanGroup(rayfile1)
+        self.assertEqual([r.start_point_id for r in rays.rayfans],
+                         [100, 101, 102, 103, 104])
+        for rfn0, rfn1 in zip(previous.rayfans[:4], rays.rayfans[:4]):
+            np.testing.assert_allclose(rfn0.travel_times, rfn1.travel_times)
+        self.assertFalse(log['failed'].any())
+
+        # should drop outdated rays of receivers that fail to retrace
+        trace = raytracing.raytrace_from_ascii
+        raytracing.raytrace_from_ascii = lambda *args, **kwargs: None
+        try:
+            log = raytracing.raytrace_incremental(vmfile, rayfile1,
+                    self.vmfile, rayfile0, instfile=self.instfile,
+                    verbose=False)
+        finally:
+            raytracing.raytrace_from_ascii = trace
+        self.assertEqual(list(log['failed']),
+                         [False, False, False, False, True])
+        rays = rayfan.readRayfanGroup(rayfile1)
+        self.assertEqual([r.start_point_id for r in rays.rayfans],
+                         [100, 101, 102, 103])
+
+    def test_integrate_paths(self):
+        """
+        Should integrate slowness along raypaths
+        """
+        vm = VM(shape=(11, 1, 11), spacing=(1, 1, 1))
+        vm.sl = 0.5 * np.ones(vm.grid.shape)
+        paths = [np.asarray([[0., 0., 0.], [3., 0., 4.], [3., 0., 8.]]),
+                 np.asarray([[1., 0., 1.]])]
+        times = raytracing.integrate_paths(vm.sl, vm.grid, paths)
+        np.testing.assert_allclose(times, [4.5, 0.])
+
+    def test_append_rayfile(self):
+        """
+        Should append rayfans and update the rayfan count
+        """
+        rayfile = os.path.join(self.tmpdir, 'serial.rays')
+        self.trace(rayfile)
+
+        merged = os.path.join(self.tmpdir, 'merged.rays')
+        rayfan.append_rayfile(rayfile, merged)
+        rayfan.append_rayfile(rayfile, merged)
+
+        rays = rayfan.readRayfanGroup(merged)
+        self.assertEqual(len(rays.rayfans), 10)
+        self.assertEqual(rays.nrays, 40)
+
+    def test_plan_raytrace(self):
+        """
+        Should plan to trace from the side with fewer picked points
+        """
+        plan = raytracing.plan_raytrace(instfile=self.instfile,
+                shotfile=self.shotfile, pickfile=self.pickfile)
+        self.assertEqual(plan['origin'], 'sources')
+        self.assertEqual(plan['nruns'], 4)
+        self.assertEqual(list(plan['sources']), [9000, 9001, 9002, 9003])
+
+        # should only count points that have picks
+        with open(self.pickfile, 'w') as f:
+            for i in range(5):
+                f.write('{:} 9000 1 0 9.999 1.0 0.050\n'.format(100 + i))
+                f.write('{:} 9001 1 0 9.999 1.0 0.050\n'.format(100 + i))
+        plan = raytracing.plan_raytrace(instfile=self.instfile,
+                shotfile=self.shotfile, pickfile=self.pickfile)
+        self.assertEqual(plan['origin'], 'sources')
+        self.assertEqual(plan['nruns'], 2)
+        self.assertEqual(plan['nshot'], 4)
+
+        _, _, pickfile = write_geometry(self.tmpdir, ninst=2)
+        plan = raytracing.plan_raytrace(instfile=self.instfile,
+                shotfile=self.shotfile, pickfile=pickfile)
+        self.assertEqual(plan['origin'], 'receivers')
+        self.assertEqual(plan['nruns'], 2)
+
+    def test_raytrace_reciprocal(self):
+        """
+        Should trace from shots and return rayfans grouped by receiver
+        """
+        rayfile0 = os.path.join(self.tmpdir, 'direct.rays')
+        self.trace(rayfile0)
+        direct = rayfan.readRayfanGroup(rayfile0)
+
+        rayfile1 = os.path.join(self.tmpdir, 'reciprocal.rays')
+        log = raytracing.raytrace_reciprocal(self.vmfile, rayfile1,
+                instfile=self.instfile, shotfile=self.shotfile,
+                pickfile=self.pickfile, verbose=False)
+        self.assertEqual(list(log['receiver']), [9000, 9001, 9002, 9003])
+
+        reciprocal = rayfan.readRayfanGroup(rayfile1)
+        self.assertEqual(len(reciprocal.rayfans), 5)
+        for rfn0, rfn1 in zip(direct.rayfans, reciprocal.rayfans):
+            self.assertEqual(rfn0.start_point_id, rfn1.start_point_id)
+            np.testing.assert_equal(rfn0.end_point_ids, rfn1.end_point_ids)
+            np.testing.assert_allclose(rfn0.pick_times, rfn1.pick_times)
+            np.testing.assert_allclose(rfn0.travel_times, rfn1.travel_times,
+                                       rtol=1e-6)
+            for path0, path1 in zip(rfn0.paths, rfn1.paths):
+                np.testing.assert_allclose(path0, path1)
+
+        # should clean up temporary files
+        self.assertFalse([f for f in os.listdir(self.tmpdir)
+                          if f.startswith('.raytrace_')])
+
+    def test_raytrace_by_branch(self):
+        """
+        Should trace each branch with its own settings and merge the rays
+        """
+        db = PickDatabase()
+        db.add_event('Pg', branchid=1)
+        db.add_event('PmP', branchid=2)
+        db.add_event('Pn', branchid=2, subid=1)
+        for i in range(5):
+            db.add_receiver(100 + i, 10. * (i + 1), 0., 2.)
+        for j in range(4):
+            db.add_source(9000 + j, 5. * (j + 1), 0., 0.006)
+        for event, nrec in [('Pg', 2), ('PmP', 5), ('Pn', 3)]:
+            for i in range(nrec):
+                for j in range(4):
+                    db.add_pick(event, 9000 + j, 100 + i, 1.)
+
+        settings = []
+        trace = raytracing.raytrace_from_ascii
+        def _trace(vmfile, rayfile, **kwargs):
+            settings.append(kwargs)
+            return trace(vmfile, rayfile, **kwargs)
+        raytracing.raytrace_from_ascii = _trace
+        try:
+            rayfile = os.path.join(self.tmpdir, 'branches.rays')
+            log = raytracing.raytrace_by_branch(self.vmfile, rayfile, db,
+                    branches={2: {'bottom_layer': 2},
+                              (2, 1): {'top_layer': 1}},
+                    n_workers=3, verbose=False, min_angle=1.0)
+        finally:
+            raytracing.raytrace_from_ascii = trace
+
+        # should apply the settings for each group
+        settings.sort(key=lambda kw: kw['pickfile'])
+        self.assertEqual([kw.get('top_layer') for kw in settings],
+                         [None, None, 1])
+        self.assertEqual([kw.get('bottom_layer') for kw in settings],
+                         [None, 2, 2])
+        self.assertEqual([kw['min_angle'] for kw in settings],
+                         [1.0, 1.0, 1.0])
+
+        # should merge rayfans in branch order
+        self.assertEqual(list(log['branchid']), [1] * 2 + [2] * 8)
+        self.assertEqual(list(log['subid']), [0] * 7 + [1] * 3)
+        rays = rayfan.readRayfanGroup(rayfile)
+        self.assertEqual([r.start_point_id for r in rays.rayfans],
+                         [100, 101, 100, 101, 102, 103, 104, 100, 101, 102])
+        self.assertEqual(rays.nrays, 40)
+        self.assertEqual(set(rays.rayfans[-1].event_subids), set([1]))
+
+
+def suite():
+    testSuite = unittest.makeSuite(raytracingTestCase, 'test')
+
+    return testSuite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,152 @@
+"""
+Test suite for the shortest_path module
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from pyvm.models.vm import VM
+from pyvm.forward.raytracing import rayfan
+from pyvm.forward.raytracing.shortest_path import ShortestPathTracer,\
+        raytrace_shortest_path
+from pyvm.forward.raytracing.ttcache import TravelTimeCache
+
+
+class shortestPathTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.vm = VM(shape=(81, 1, 41), spacing=(0.5, 1, 0.5))
+        self.vm.sl = 0.2 * np.ones(self.vm.grid.shape)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_traveltimes(self):
+        """
+        Should compute first-arrival travel times on the model grid
+        """
+        tracer = ShortestPathTracer(self.vm)
+        source = (10., 0., 5.)
+        times = tracer.traveltimes(source)
+        self.assertEqual(times.shape, self.vm.grid.shape)
+
+        # should be close to straight-line times in a constant model
+        x, _, z = np.meshgrid(*self.vm.grid.ranges, indexing='ij')
+        exact = 0.2 * np.sqrt((x - source[0]) ** 2 + (z - source[2]) ** 2)
+        self.assertEqual(times[20, 0, 10], 0.)
+        self.assertTrue(np.all(times >= exact - 1e-6))
+        self.assertTrue(np.all(times <= 1.03 * exact + 1e-6))
+
+        # should solve a batch of sources at once
+        batch = tracer.traveltimes([source, (30., 0., 0.)])
+        self.assertEqual(batch.shape, (2, ) + self.vm.grid.shape)
+        np.testing.assert_allclose(batch[0], times)
+
+    def test_batch(self):
+        """
+        Should not route paths through other sources in a batch
+        """
+        # paths through another source are shorter than grid paths where
+        # slowness changes quickly
+        np.random.seed(1)
+        self.vm.sl = np.random.uniform(0.1, 2., self.vm.grid.shape)
+        tracer = ShortestPathTracer(self.vm)
+        sources = np.random.uniform(0, 4, (20, 3))
+        sources[:, 1] = 0.
+        batch = tracer.traveltimes(sources)
+        for source, times in zip(sources, batch):
+            np.testing.assert_allclose(times, tracer.traveltimes(source))
+            # end points should trace back to their own source
+            _times, paths = tracer.trace(source, sources)
+            for path in paths:
+                np.testing.assert_allclose(path[-1], source)
+
+    def test_trace(self):
+        """
+        Should trace raypaths from end points back to the source
+        """
+        tracer = ShortestPathTracer(self.vm)
+        source = (10., 0., 5.)
+        endpoints = [(0., 0., 0.), (35.2, 0., 1.3)]
+        times, paths = tracer.trace(source, endpoints)
+
+        for point, path in zip(endpoints, paths):
+            np.testing.assert_allclose(path[0], point)
+            np.testing.assert_allclose(path[-1], source)
+        # travel time should equal the path-integrated time
+        for t, path in zip(times, paths):
+            length = np.sum(np.sqrt(np.sum(np.diff(path, axis=0) ** 2,
+                                           axis=1)))
+            self.assertAlmostEqual(t, 0.2 * length)
+
+    def test_jumps(self):
+        """
+        Should apply slowness jumps below interfaces
+        """
+        self.vm.insert_interface(10., jp=-0.1)
+        tracer = ShortestPathTracer(self.vm)
+        self.assertAlmostEqual(tracer.sl[0, 0, 0], 0.2)
+        self.assertAlmostEqual(tracer.sl[0, 0, -1], 0.1)
+        # should not change the model
+        self.assertAlmostEqual(self.vm.sl[0, 0, -1], 0.2)
+
+    def test_raytrace_shortest_path(self):
+        """
+        Should trace ASCII pick files to a readable rayfan file
+        """
+        instfile = os.path.join(self.tmpdir, 'inst.dat')
+        shotfile = os.path.join(self.tmpdir, 'shot.dat')
+        pickfile = os.path.join(self.tmpdir, 'pick.dat')
+        rayfile = os.path.join(self.tmpdir, 'test.rays')
+        with open(instfile, 'w') as f:
+            f.write('100 10.0 0.0 10.0\n101 30.0 0.0 10.0\n')
+            f.write('102 20.0 0.0 10.0\n')
+        with open(shotfile, 'w') as f:
+            f.write('9000 5.0 0.0 0.0\n9001 25.0 0.0 0.0\n')
+        with open(pickfile, 'w') as f:
+            f.write('100 9000 1 0 0.0 2.5 0.05\n')
+            f.write('100 9001 1 0 0.0 3.5 0.05\n')
+            f.write('101 9001 2 1 0.0 2.4 0.05\n')
+
+        rays = raytrace_shortest_path(self.vm, rayfile, instfile=instfile,
+                shotfile=shotfile, pickfile=pickfile, batch_size=1)
+
+        # should only trace instruments with picks
+        self.assertEqual([r.start_point_id for r in rays.rayfans], [100, 101])
+
+        # should be readable by the rayfan reader
+        rays1 = rayfan.readRayfanGroup(rayfile)
+        self.assertEqual(len(rays1.rayfans), 2)
+        rfn = rays1.rayfans[0]
+        self.assertEqual(list(rfn.end_point_ids), [9000, 9001])
+        self.assertEqual(list(rays1.rayfans[1].event_ids), [2])
+        self.assertEqual(list(rays1.rayfans[1].event_subids), [1])
+        np.testing.assert_allclose(rfn.pick_times, [2.5, 3.5])
+        np.testing.assert_allclose(rfn.travel_times,
+                                   rays.rayfans[0].travel_times)
+        np.testing.assert_allclose(rfn.travel_times,
+                0.2 * np.hypot([5., 15.], [10., 10.]), rtol=0.02)
+
+        # should reuse cached fields
+        cache = TravelTimeCache(os.path.join(self.tmpdir, 'tt'))
+        for _ in range(2):
+            _rays = raytrace_shortest_path(self.vm, instfile=instfile,
+                    shotfile=shotfile, pickfile=pickfile, cache=cache)
+            self.assertEqual(len(cache), 4)
+            for rfn0, rfn1 in zip(rays.rayfans, _rays.rayfans):
+                np.testing.assert_allclose(rfn1.travel_times,
+                                           rfn0.travel_times)
+
+
+def suite():
+    testSuite = unittest.makeSuite(shortestPathTestCase, 'test')
+
+    return testSuite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
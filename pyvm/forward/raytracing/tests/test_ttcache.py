@@ -0,0 +1,152 @@
+"""
+Test suite for the ttcache module
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from pyvm.models.vm import VM
+from pyvm.forward.raytracing.ttcache import TravelTimeCache,\
+        model_fingerprint
+from pyvm.forward.raytracing.shortest_path import ShortestPathTracer
+
+
+class ttcacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.vm = VM(shape=(41, 1, 21), spacing=(0.5, 1, 0.5))
+        self.vm.sl = 0.2 * np.ones(self.vm.grid.shape)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_model_fingerprint(self):
+        """
+        Should change when the model content changes
+        """
+        fp0 = model_fingerprint(self.vm)
+        self.assertEqual(fp0, model_fingerprint(self.vm.copy()))
+
+        vm = self.vm.copy()
+        vm.sl[0, 0, 0] = 0.3
+        self.assertNotEqual(fp0, model_fingerprint(vm))
+
+        vm = self.vm.copy()
+        vm.insert_interface(5.)
+        self.assertNotEqual(fp0, model_fingerprint(vm))
+
+    def test_get_put(self):
+        """
+        Should store and memory map travel-time fields
+        """
+        cache = TravelTimeCache(os.path.join(self.tmpdir, 'tt'))
+        source = (1., 0., 2.)
+        self.assertIsNone(cache.get(self.vm, source))
+
+        times = np.random.rand(*self.vm.grid.shape)
+        cache.put(self.vm, source, times, forward_star_size=(2, 2, 2))
+        self.assertEqual(len(cache), 1)
+
+        # should only match the same model, source, and settings
+        self.assertIsNone(cache.get(self.vm, source))
+        self.assertIsNone(cache.get(self.vm, (1., 0., 2.1),
+                                   forward_star_size=(2, 2, 2)))
+        _times = cache.get(model_fingerprint(self.vm), source,
+                           forward_star_size=(2, 2, 2))
+        self.assertTrue(isinstance(_times, np.memmap))
+        np.testing.assert_array_equal(_times, times)
+
+    def test_evict(self):
+        """
+        Should evict least recently used fields beyond the size budget
+        """
+        times = np.zeros(self.vm.grid.shape)
+        cache = TravelTimeCache(self.tmpdir, max_bytes=1)
+        cache.put(self.vm, (0., 0., 0.), times)
+        nbytes = cache.nbytes
+
+        cache.max_bytes = 2 * nbytes
+        cache.put(self.vm, (1., 0., 0.), times)
+        # set access times well apart, as file times can have a resolution
+        # of seconds
+        now = time.time()
+        for source, age in [((0., 0., 0.), 200), ((1., 0., 0.), 100)]:
+            path = cache._get_path(cache.key(self.vm, source))
+            os.utime(path, (now - age, now - age))
+        cache.get(self.vm, (0., 0., 0.))
+        cache.put(self.vm, (2., 0., 0.), times)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 2 * nbytes)
+        self.assertIsNone(cache.get(self.vm, (1., 0., 0.)))
+        self.assertIsNotNone(cache.get(self.vm, (0., 0., 0.)))
+
+    def test_tracer_cache(self):
+        """
+        Should reuse cached fields in the shortest path tracer
+        """
+        cache = TravelTimeCache(self.tmpdir)
+        tracer = ShortestPathTracer(self.vm, cache=cache)
+        sources = [(1., 0., 2.), (5., 0., 1.)]
+        times = tracer.traveltimes(sources)
+        self.assertEqual(len(cache), 2)
+
+        # should read fields computed for the same model from the store
+        tracer1 = ShortestPathTracer(self.vm.copy(), cache=cache)
+        _times = tracer1.traveltimes(sources[1])
+        self.assertTrue(isinstance(_times, np.memmap))
+        np.testing.assert_array_equal(_times, times[1])
+        self.assertEqual(len(cache), 2)
+
+        # should not reuse fields for a different forward star
+        tracer2 = ShortestPathTracer(self.vm, forward_star_size=(1, 1, 1),
+                                     cache=cache)
+        tracer2.traveltimes(sources[1])
+        self.assertEqual(len(cache), 3)
+
+    def test_tracer_reuse(self):
+        """
+        Should reuse cached fields for raypaths and reciprocal lookups
+        """
+        cache = TravelTimeCache(self.tmpdir)
+        tracer = ShortestPathTracer(self.vm, cache=cache)
+        receiver = (10., 0., 8.)
+        shots = [(1., 0., 0.), (15., 0., 0.5)]
+        times, paths = ShortestPathTracer(self.vm).trace(receiver, shots)
+
+        # should store fields and predecessors for tracing raypaths
+        _times, _paths = tracer.trace(receiver, shots)
+        self.assertEqual(len(cache), 2)
+        tracer1 = ShortestPathTracer(self.vm.copy(), cache=cache)
+        for _ in range(2):
+            _times, _paths = tracer1.trace(receiver, shots)
+            np.testing.assert_allclose(_times, times)
+            for path, _path in zip(paths, _paths):
+                np.testing.assert_allclose(_path, path)
+        self.assertEqual(len(cache), 2)
+
+        # should look up shot-to-receiver times in the receiver field
+        _times = tracer1.traveltimes_between(shots[0], [receiver])
+        np.testing.assert_allclose(_times, times[:1])
+        self.assertEqual(len(cache), 2)
+        # should solve from the origin if neither end is stored
+        _times = tracer1.traveltimes_between(receiver, shots + [(5., 0., 9.)])
+        np.testing.assert_allclose(_times[:2], times)
+        self.assertEqual(len(cache), 2)
+        tracer1.traveltimes_between((5., 0., 9.), shots)
+        self.assertEqual(len(cache), 3)
+
+
+def suite():
+    testSuite = unittest.makeSuite(ttcacheTestCase, 'test')
+
+    return testSuite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,220 @@
+"""
+On-disk store for travel-time fields.
+
+Travel-time fields are saved as NumPy ``.npy`` files named by a hash of the
+slowness model, the source position, and the solver settings, and are read
+back as read-only memory maps. The least recently used fields are removed
+when the store grows beyond its size budget.
+
+Examples
+--------
+>>> import numpy as np
+>>> from pyvm.models.vm import VM
+>>> from pyvm.forward.raytracing.shortest_path import ShortestPathTracer
+>>> vm = VM(shape=(101, 1, 51), spacing=(0.5, 1, 0.5))
+>>> vm.sl = 0.2 * np.ones(vm.grid.shape)
+>>> cache = TravelTimeCache('ttcache', max_bytes=2 ** 30)
+>>> tracer = ShortestPathTracer(vm, cache=cache)
+>>> times = tracer.traveltimes((10., 0., 5.))  # solved and stored
+>>> times = tracer.traveltimes((10., 0., 5.))  # read from the store
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+
+import os
+import glob
+import hashlib
+import tempfile
+import numpy as np
+
+
+def model_fingerprint(vm):
+    """
+    Return a hash of the content of a VM model.
+
+    The hash covers the grid dimensions, origin, spacing, and slowness
+    values, and the interface depths (``rf``), slowness jumps (``jp``), and
+    interface flags (``ir``, ``ij``).
+
+    Parameters
+    ----------
+    vm : :class:`pyvm.models.vm.VM`
+        Model to fingerprint.
+
+    Returns
+    -------
+    fingerprint : str
+        Hexadecimal SHA-1 digest.
+    """
+    sha = hashlib.sha1()
+    sha.update(np.asarray(vm.grid.shape, dtype=np.int64).tobytes())
+    sha.update(np.asarray(vm.grid.origin, dtype=np.float64).tobytes())
+    sha.update(np.asarray(vm.grid.spacing, dtype=np.float64).tobytes())
+    sha.update(np.ascontiguousarray(vm.sl, dtype=np.float32).tobytes())
+    for attr, dtype in [('rf', np.float32), ('jp', np.float32),
+                        ('ir', np.int32), ('ij', np.int32)]:
+        sha.update(np.ascontiguousarray(vm.__getattribute__(attr),
+                                        dtype=dtype).tobytes())
+    return sha.hexdigest()
+
+
+class TravelTimeCache(object):
+    """
+    Least-recently-used, on-disk store for travel-time fields.
+    """
+    def __init__(self, directory, max_bytes=2 ** 30):
+        """
+        Least-recently-used, on-disk store for travel-time fields.
+
+        Parameters
+        ----------
+        directory : str
+            Directory to store travel-time fields in. Created if it does
+            not exist. Several processes can share the same directory.
+        max_bytes : int, optional
+            Size budget for all fields in the store. Default is 1 GiB.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __len__(self):
+        return len(self._get_files())
+
+    def _get_files(self):
+        """
+        Returns a list of the files in the store.
+        """
+        return glob.glob(os.path.join(self.directory, '*.npy'))
+
+    def _get_nbytes(self):
+        """
+        Returns the total size of all fields in the store.
+        """
+        return sum([os.path.getsize(f) for f in self._get_files()])
+
+    nbytes = property(fget=_get_nbytes)
+
+    def key(self, model, source, **params):
+        """
+        Return the key for a travel-time field.
+
+        Parameters
+        ----------
+        model : {:class:`pyvm.models.vm.VM`, str}
+            Model or model fingerprint from :func:`model_fingerprint`.
+        source : (float, float, float)
+            Coordinates of the origin of the field. Rounded to 1e-6 model
+            units. Keys do not depend on whether the origin is a source or
+            a receiver, so by reciprocity a field computed from a receiver
+            can serve queries from sources to that receiver.
+        **params
+            Solver settings that change the travel-time field (e.g.,
+            ``forward_star_size``), or other names that tell apart fields
+            stored for the same origin (e.g., ``field='predecessors'``).
+
+        Returns
+        -------
+        key : str
+            Hexadecimal SHA-1 digest.
+        """
+        if hasattr(model, 'grid'):
+            model = model_fingerprint(model)
+        sha = hashlib.sha1(model.encode('ascii'))
+        sha.update(' '.join(['{:.6f}'.format(float(v)) for v in source])\
+                .encode('ascii'))
+        for k in sorted(params):
+            sha.update('{:}={:}'.format(k, params[k]).encode('utf-8'))
+        return sha.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, model, source, **params):
+        """
+        Return a stored travel-time field.
+
+        Parameters
+        ----------
+        model, source, **params
+            See :meth:`key`.
+
+        Returns
+        -------
+        times : {:class:`numpy.memmap`, None}
+            Read-only memory map of the travel-time field, or ``None`` if
+            the field is not in the store.
+        """
+        path = self._get_path(self.key(model, source, **params))
+        try:
+            times = np.load(path, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+        # mark as recently used
+        os.utime(path, None)
+        return times
+
+    def put(self, model, source, times, **params):
+        """
+        Add a travel-time field to the store.
+
+        Least recently used fields are removed if the store grows beyond
+        its size budget.
+
+        Parameters
+        ----------
+        model, source, **params
+            See :meth:`key`.
+        times : ndarray
+            Travel-time field.
+
+        Returns
+        -------
+        times : :class:`numpy.memmap`
+            Read-only memory map of the stored field.
+        """
+        path = self._get_path(self.key(model, source, **params))
+        # write to a temporary file first so readers never see partial data
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.asarray(times))
+        os.rename(tmp, path)
+        self.evict(keep=path)
+        return np.load(path, mmap_mode='r')
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used fields until the store fits its budget.
+
+        Parameters
+        ----------
+        keep : str, optional
+            Path of a file that should not be removed.
+        """
+        files = []
+        for f in self._get_files():
+            try:
+                stat = os.stat(f)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, f))
+        files.sort()
+        nbytes = sum([size for _, size, _ in files])
+        for _, size, f in files:
+            if nbytes <= self.max_bytes:
+                break
+            if f == keep:
+                continue
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+            nbytes -= size
+
+    def clear(self):
+        """
+        Remove all fields from the store.
+        """
+        for f in self._get_files():
+            os.remove(f)
@@ -0,0 +1,682 @@
+"""
+In-memory pick database backed by numpy arrays.
+
+:class:`ArrayPickDatabase` has the same tables as
+:class:`pyvm.picks.pickdb.PickDatabase`, stored as typed numpy columns,
+with hash indexes on the event names and source and receiver IDs. Picks
+keep the row numbers of their event, source, and receiver, so that
+filtering picks and gathering fields of ``master_picks`` are vectorized
+array operations, without parsing or joining in SQL.
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+import io
+import numpy as np
+import pandas as pd
+from pyvm.db.backends.sqlite3.connection import DatabaseIntegrityError
+from pyvm.db.backends.sqlite3.utils import OPERATORS, CONFLICT_MODES,\
+        check_identifier, format_value, iter_rows
+from pyvm.picks.pickdb import PickDatabase, PICK_FIELDS, VMTOMO_PICK_ORDER
+
+# Fields and types of each table
+TABLE_FIELDS = {}
+TABLE_FIELDS['events'] = [('event', np.object_), ('branchid', np.int64),
+                          ('subid', np.int64), ('description', np.object_)]
+TABLE_FIELDS['sources'] = [('srcid', np.int64), ('srcx', np.float64),
+                           ('srcy', np.float64), ('srcz', np.float64)]
+TABLE_FIELDS['receivers'] = [('recid', np.int64), ('recx', np.float64),
+                             ('recy', np.float64), ('recz', np.float64)]
+# row numbers of the event, source, and receiver of each pick
+TABLE_FIELDS['picks'] = [('ievent', np.int64), ('isrc', np.int64),
+                         ('irec', np.int64), ('time', np.float64),
+                         ('error', np.float64), ('offset', np.float64)]
+
+# Fields of the master_picks view, by the table they are read from
+MASTER_PICKS_FIELDS = ['event', 'branchid', 'subid', 'srcid', 'srcx', 'srcy',
+                       'srcz', 'recid', 'recx', 'recy', 'recz', 'offset',
+                       'time', 'error']
+MASTER_PICKS_TABLES = {'events': 'ievent', 'sources': 'isrc',
+                       'receivers': 'irec'}
+
+
+class ColumnTable(object):
+    """
+    Table of typed numpy columns that can grow.
+    """
+    def __init__(self, fields):
+        """
+        Table of typed numpy columns that can grow.
+
+        Parameters
+        ----------
+        fields: list
+            ``(name, dtype)`` pairs for each column.
+        """
+        self.fields = [f[0] for f in fields]
+        self._columns = dict([(name, np.empty(0, dtype=dtype))
+                              for name, dtype in fields])
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, field):
+        return self._columns[field][:self.size]
+
+    def resize(self, size):
+        """
+        Changes the number of rows.
+
+        New rows are uninitialized. Storage grows by at least a factor of
+        two, so that adding rows one at a time takes amortized constant
+        time.
+        """
+        capacity = len(self._columns[self.fields[0]])
+        if size > capacity:
+            capacity = max(size, 2 * capacity, 16)
+            for name in self.fields:
+                column = np.empty(capacity,
+                                  dtype=self._columns[name].dtype)
+                column[:self.size] = self._columns[name][:self.size]
+                self._columns[name] = column
+        self.size = size
+
+    def set(self, rows, columns):
+        """
+        Sets values of rows.
+
+        Parameters
+        ----------
+        rows: numpy.ndarray
+            Row numbers to set. For repeated rows, the last values are
+            kept.
+        columns: dict
+            Arrays of values for each field, with one value per row.
+        """
+        for name in columns:
+            self._columns[name][rows] = columns[name]
+
+    def to_frame(self, fields=None):
+        """
+        Returns a :class:`pandas.DataFrame` with a copy of the columns.
+        """
+        if fields is None:
+            fields = self.fields
+        return pd.DataFrame(dict([(f, self[f].copy()) for f in fields]),
+                            columns=fields)
+
+
+def _compare(column, op, value, key):
+    """
+    Returns a mask of the values in a column that match a search term.
+
+    See :func:`pyvm.db.backends.sqlite3.utils.build_where` for the
+    operators.
+    """
+    if op not in OPERATORS:
+        raise ValueError("Unknown operator '{:}' in '{:}'".format(op, key))
+    if hasattr(value, 'tolist'):
+        value = value.tolist()
+    if op == 'between':
+        low, high = value
+        return (column >= low) & (column <= high)
+    elif hasattr(value, '__iter__') and not isinstance(value, (str, bytes)):
+        if op not in ['eq', 'ne']:
+            msg = "Lists of values cannot be used with '{:}'".format(op)
+            raise ValueError(msg)
+        mask = np.isin(column, list(value))
+        return ~mask if op == 'ne' else mask
+    elif op == 'eq':
+        return column == value
+    elif op == 'ne':
+        return column != value
+    elif op == 'gt':
+        return column > value
+    elif op == 'gte':
+        return column >= value
+    elif op == 'lt':
+        return column < value
+    else:
+        return column <= value
+
+
+def _columns(data, fields, defaults=None):
+    """
+    Converts tabular data to a dictionary of columns.
+
+    See :func:`pyvm.db.backends.sqlite3.utils.iter_rows` for the accepted
+    data.
+    """
+    if defaults is None:
+        defaults = {}
+    if hasattr(data, 'columns') or isinstance(data, dict) \
+            or getattr(getattr(data, 'dtype', None), 'names', None):
+        if hasattr(data, 'columns'):
+            names = list(data.columns)
+        elif isinstance(data, dict):
+            names = list(data.keys())
+        else:
+            names = list(data.dtype.names)
+        nrows = len(data[names[0]]) if len(names) > 0 else 0
+        columns = {}
+        for f in fields:
+            if f in names:
+                columns[f] = np.asarray(data[f])
+            elif f in defaults:
+                columns[f] = np.asarray([defaults[f]] * nrows)
+            else:
+                raise ValueError("Missing required field '{:}'.".format(f))
+        return columns
+    rows = list(iter_rows(data, fields, defaults=defaults))
+    if len(rows) == 0:
+        return dict([(f, np.empty(0)) for f in fields])
+    return dict([(f, np.asarray(c)) for f, c in zip(fields, zip(*rows))])
+
+
+class ArrayPickDatabase(object):
+    """
+    In-memory pick database backed by numpy arrays.
+
+    Has the same methods for adding, counting, selecting, and exporting
+    picks as :class:`pyvm.picks.pickdb.PickDatabase`, but no SQL
+    interface. Use :meth:`from_pickdb` and :meth:`to_pickdb` to convert
+    between the two.
+    """
+    def __init__(self):
+        """
+        In-memory pick database backed by numpy arrays.
+        """
+        self.tables = dict([(table, ColumnTable(TABLE_FIELDS[table]))
+                            for table in TABLE_FIELDS])
+        # row numbers by event name, source ID, receiver ID, and
+        # (event row, source ID, receiver ID) for picks
+        self._index = {'events': {}, 'sources': {}, 'receivers': {}}
+        self._pick_index = None
+
+    def _get_events(self):
+        return self.tables['events'].to_frame()
+    events = property(fget=_get_events)
+
+    def _get_sources(self):
+        return self.tables['sources'].to_frame()
+    sources = property(fget=_get_sources)
+
+    def _get_receivers(self):
+        return self.tables['receivers'].to_frame()
+    receivers = property(fget=_get_receivers)
+
+    def _get_picks(self):
+        return pd.DataFrame(self.select('picks'))
+    picks = property(fget=_get_picks)
+
+    def _get_pick_index(self):
+        """
+        Returns the index of picks, building it if needed.
+        """
+        if self._pick_index is None:
+            picks = self.tables['picks']
+            keys = zip(picks['ievent'].tolist(),
+                       self.tables['sources']['srcid'][picks['isrc']]
+                       .tolist(),
+                       self.tables['receivers']['recid'][picks['irec']]
+                       .tolist())
+            self._pick_index = dict(zip(keys, range(len(picks))))
+        return self._pick_index
+
+    def _lookup(self, table, keys, field):
+        """
+        Returns the row numbers of events, sources, or receivers.
+        """
+        index = self._index[table]
+        keys = np.asarray(keys)
+        if len(keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        rows = np.asarray([index.get(k, -1) for k in unique.tolist()],
+                          dtype=np.int64)
+        if (rows < 0).any():
+            missing = unique[rows < 0].tolist()
+            msg = "No {:} with {:}: {:}".format(table, field,
+                    ', '.join([format_value(k) for k in missing[:10]]))
+            raise DatabaseIntegrityError(msg)
+        return rows[inverse]
+
+    def _insert(self, table, index, keys, columns, conflict):
+        """
+        Adds or replaces rows in a table.
+
+        Returns the row numbers that were changed.
+        """
+        if conflict not in CONFLICT_MODES:
+            msg = "conflict must be one of: {:}"\
+                    .format(', '.join(sorted(CONFLICT_MODES)))
+            raise ValueError(msg)
+        data = self.tables[table]
+        size = len(data)
+        rows = np.empty(len(keys), dtype=np.int64)
+        added = []
+        for i, key in enumerate(keys):
+            row = index.get(key)
+            if row is None:
+                row = size + len(added)
+                index[key] = row
+                added.append(key)
+            elif conflict == 'error':
+                for _key in added:
+                    del index[_key]
+                msg = "UNIQUE constraint failed for {:} {:}"\
+                        .format(table, key)
+                raise DatabaseIntegrityError(msg)
+            elif conflict == 'ignore':
+                row = -1
+            rows[i] = row
+        keep = rows >= 0
+        data.resize(size + len(added))
+        data.set(rows[keep], dict([(f, columns[f][keep])
+                                   for f in columns]))
+        return rows[keep]
+
+    def add_event(self, event, branchid=0, subid=0, description='',
+            replace=False):
+        """
+        Adds an event to the event table.
+
+        See :meth:`pyvm.picks.pickdb.PickDatabase.add_event`.
+        """
+        self.add_events([(event, branchid, subid, description)],
+                        conflict='replace' if replace else 'error')
+
+    def add_events(self, data, conflict='error'):
+        """
+        Adds many events to the event table.
+
+        Parameters
+        ----------
+        data: {:class:`pandas.DataFrame`, dict, numpy.ndarray, list}
+            Event data with the fields ``event, branchid, subid,
+            description``. Only ``event`` is required.
+        conflict: str, optional
+            See :meth:`pyvm.picks.pickdb.PickDatabase.add_sources`.
+
+        Returns
+        -------
+        nrows: int
+            Number of events added or replaced.
+        """
+        columns = _columns(data, [f[0] for f in TABLE_FIELDS['events']],
+                           defaults={'branchid': 0, 'subid': 0,
+                                     'description': ''})
+        rows = self._insert('events', self._index['events'],
+                            columns['event'].tolist(), columns, conflict)
+        return len(rows)
+
+    def _add_points(self, table, data, conflict):
+        """
+        Adds many sources or receivers.
+        """
+        fields = [f[0] for f in TABLE_FIELDS[table]]
+        columns = _columns(data, fields)
+        rows = self._insert(table, self._index[table],
+                            columns[fields[0]].tolist(), columns, conflict)
+        if conflict == 'replace' and len(self.tables['picks']) > 0:
+            # update offsets of picks for moved points
+            field = MASTER_PICKS_TABLES[table]
+            picks = np.nonzero(np.isin(self.tables['picks'][field],
+                                       rows))[0]
+            self._update_offsets(picks)
+        return len(rows)
+
+    def add_source(self, srcid, srcx, srcy, srcz, replace=False):
+        """
+        Adds a source to the sources table.
+
+        See :meth:`pyvm.picks.pickdb.PickDatabase.add_source`.
+        """
+        self.add_sources([(srcid, srcx, srcy, srcz)],
+                         conflict='replace' if replace else 'error')
+
+    def add_receiver(self, recid, recx, recy, recz, replace=False):
+        """
+        Adds a receiver to the receivers table.
+
+        See :meth:`pyvm.picks.pickdb.PickDatabase.add_receiver`.
+        """
+        self.add_receivers([(recid, recx, recy, recz)],
+                           conflict='replace' if replace else 'error')
+
+    def add_sources(self, data, conflict='error'):
+        """
+        Adds many sources to the sources table.
+
+        See :meth:`pyvm.picks.pickdb.PickDatabase.add_sources`.
+        """
+        return self._add_points('sources', data, conflict)
+
+    def add_receivers(self, data, conflict='error'):
+        """
+        Adds many receivers to the receivers table.
+
+        See :meth:`pyvm.picks.pickdb.PickDatabase.add_receivers`.
+        """
+        return self._add_points('receivers', data, conflict)
+
+    def add_pick(self, event, srcid, recid, time, error=0.0,
+            replace=False):
+        """
+        Adds a pick to the picks table.
+
+        See :meth:`pyvm.picks.pickdb.PickDatabase.add_pick`.
+        """
+        self.add_picks([(event, srcid, recid, time, error)],
+                       conflict='replace' if replace else 'error')
+
+    def add_picks(self, data, conflict='error'):
+        """
+        Adds many picks to the picks table.
+
+        See :meth:`pyvm.picks.pickdb.PickDatabase.add_picks`.
+        """
+        columns = _columns(data, PICK_FIELDS, defaults={'error': 0.0})
+        picks = {'ievent': self._lookup('events', columns['event'],
+                                        'event'),
+                 'isrc': self._lookup('sources', columns['srcid'],
+                                      'srcid'),
+                 'irec': self._lookup('receivers', columns['recid'],
+                                      'recid'),
+                 'time': columns['time'], 'error': columns['error']}
+        keys = zip(picks['ievent'].tolist(), columns['srcid'].tolist(),
+                   columns['recid'].tolist())
+        rows = self._insert('picks', self._get_pick_index(), list(keys),
+                            picks, conflict)
+        self._update_offsets(rows)
+        return len(rows)
+
+    def _update_offsets(self, rows):
+        """
+        Recomputes offsets of picks from source and receiver coordinates.
+        """
+        picks = self.tables['picks']
+        sources = self.tables['sources']
+        receivers = self.tables['receivers']
+        isrc = picks['isrc'][rows]
+        irec = picks['irec'][rows]
+        offsets = np.hypot(receivers['recx'][irec] - sources['srcx'][isrc],
+                           receivers['recy'][irec] - sources['srcy'][isrc])
+        picks.set(rows, {'offset': offsets})
+
+    def _get_table(self, table):
+        """
+        Returns the columns of a table, or of picks for ``master_picks``.
+        """
+        if table == 'master_picks':
+            table = 'picks'
+        if table not in self.tables:
+            raise ValueError("No such table: '{:}'".format(table))
+        return self.tables[table]
+
+    def _join(self, table, field):
+        """
+        Returns the table that a field of ``picks`` or ``master_picks`` is
+        read from and the pick field with row numbers in that table, or
+        `None` for fields stored with picks.
+        """
+        if table not in ['picks', 'master_picks'] \
+                or field in self.tables['picks'].fields:
+            return None
+        for _table, index in MASTER_PICKS_TABLES.items():
+            if field in self.tables[_table].fields \
+                    and (table == 'master_picks' or field in PICK_FIELDS):
+                return _table, index
+        return None
+
+    def _get_field(self, table, field, rows=None):
+        """
+        Returns the values of a field for rows of a table.
+        """
+        join = self._join(table, field)
+        if join is not None:
+            index = self.tables['picks'][join[1]]
+            if rows is not None:
+                index = index[rows]
+            return self.tables[join[0]][field][index]
+        data = self._get_table(table)
+        if field not in data.fields:
+            raise ValueError("No field '{:}' in '{:}'".format(field, table))
+        return data[field] if rows is None else data[field][rows]
+
+    def _find(self, table, **kwargs):
+        """
+        Returns a mask of the rows that match search terms, or `None` if
+        there are no terms.
+        """
+        mask = None
+        for key in sorted(kwargs):
+            if '__' in key:
+                field, op = key.rsplit('__', 1)
+            else:
+                field, op = key, 'eq'
+            check_identifier(field)
+            join = self._join(table, field)
+            if join is not None:
+                # search the smaller table, then gather for each pick
+                _mask = _compare(self.tables[join[0]][field], op,
+                                 kwargs[key], key)
+                _mask = _mask[self.tables['picks'][join[1]]]
+            else:
+                _mask = _compare(self._get_field(table, field), op,
+                                 kwargs[key], key)
+            mask = _mask if mask is None else mask & _mask
+        return mask
+
+    def count(self, table, **kwargs):
+        """
+        Get the number of rows in a table.
+
+        Parameters
+        ----------
+        table: str
+            Name of table to get count from: ``'events'``, ``'sources'``,
+            ``'receivers'``, ``'picks'``, or ``'master_picks'``.
+        **kwargs
+            Keyword arguments for selecting rows. See
+            :func:`pyvm.db.backends.sqlite3.utils.build_where`.
+        """
+        mask = self._find(table, **kwargs)
+        if mask is None:
+            return len(self._get_table(table))
+        return int(np.count_nonzero(mask))
+
+    def select(self, table, fields=None, order_by=None, limit=None,
+            **kwargs):
+        """
+        Selects rows from a table.
+
+        Parameters
+        ----------
+        table: str
+            Name of table to select from: ``'events'``, ``'sources'``,
+            ``'receivers'``, ``'picks'``, or ``'master_picks'``.
+        fields: list, optional
+            Names of fields to select. Default is to select all fields.
+        order_by: {str, list}, optional
+            Name or names of fields to sort rows by.
+        limit: int, optional
+            Maximum number of rows to select.
+        **kwargs
+            Keyword arguments for selecting rows. See
+            :func:`pyvm.db.backends.sqlite3.utils.build_where`.
+
+        Returns
+        -------
+        data: numpy.ndarray
+            Structured array with one field per selected field, like
+            :meth:`pyvm.picks.pickdb.PickDatabase.read_arrays`.
+        """
+        if fields is None:
+            if table == 'master_picks':
+                fields = MASTER_PICKS_FIELDS
+            elif table == 'picks':
+                fields = PICK_FIELDS + ['offset']
+            else:
+                fields = self._get_table(table).fields
+        mask = self._find(table, **kwargs)
+        rows = None if mask is None else np.nonzero(mask)[0]
+        if order_by is not None:
+            if not isinstance(order_by, (list, tuple)):
+                order_by = [order_by]
+            keys = [self._get_field(table, f, rows=rows)
+                    for f in order_by[::-1]]
+            order = np.lexsort(keys)
+            rows = order if rows is None else rows[order]
+        if limit is not None:
+            if rows is None:
+                rows = np.arange(min(int(limit), self.count(table)))
+            else:
+                rows = rows[:int(limit)]
+        columns = [self._get_field(table, f, rows=rows) for f in fields]
+        data = np.empty(len(columns[0]) if columns else 0,
+                        dtype=[(str(f), c.dtype)
+                               for f, c in zip(fields, columns)])
+        for f, c in zip(fields, columns):
+            data[str(f)] = c
+        return data
+
+    def to_vmtomo(self, sources_file=None, receivers_file=None,
+            picks_file=None, header=False, sep='\t', offset_min=None,
+            offset_max=None, chunksize=10000, **kwargs):
+        """
+        Formats pick data for input to the underlying tomography code.
+
+        Output is the same as for
+        :meth:`pyvm.picks.pickdb.PickDatabase.to_vmtomo`, which describes
+        the parameters.
+        """
+        if offset_min is not None:
+            kwargs['offset__gte'] = offset_min
+        if offset_max is not None:
+            kwargs['offset__lte'] = offset_max
+        mask = self._find('master_picks', **kwargs)
+
+        picks = self.tables['picks']
+        outputs = []
+        for table, field in [('sources', 'isrc'), ('receivers', 'irec')]:
+            if mask is None:
+                rows = np.arange(len(self.tables[table]))
+            else:
+                rows = np.unique(picks[field][mask])
+            fields = self.tables[table].fields
+            order = np.argsort(self.tables[table][fields[0]][rows],
+                               kind='mergesort')
+            outputs.append((fields, table, rows[order]))
+        fields = ['recid', 'srcid', 'branchid', 'subid', 'offset', 'time',
+                  'error']
+        rows = np.arange(len(picks)) if mask is None \
+                else np.nonzero(mask)[0]
+        # sort events by name, as in SQL
+        _, rank = np.unique(self.tables['events']['event'],
+                            return_inverse=True)
+        keys = [rank[picks['ievent'][rows]] if f == 'event'
+                else self._get_field('master_picks', f, rows=rows)
+                for f in VMTOMO_PICK_ORDER[::-1]]
+        outputs.append((fields, 'master_picks', rows[np.lexsort(keys)]))
+
+        output = []
+        for filename, (fields, table, rows) in zip(
+                [sources_file, receivers_file, picks_file], outputs):
+            if filename is None:
+                buf = io.StringIO()
+            elif hasattr(filename, 'write'):
+                buf = filename
+            else:
+                buf = io.open(filename, 'w')
+            try:
+                if header:
+                    buf.write(sep.join(fields) + '\n')
+                for i in range(0, len(rows), chunksize):
+                    _rows = rows[i:i + chunksize]
+                    columns = [self._get_field(table, f, rows=_rows)
+                               .tolist() for f in fields]
+                    buf.write(''.join([sep.join([format_value(v)
+                                                 for v in row]) + '\n'
+                                       for row in zip(*columns)]))
+                if filename is None:
+                    output.append(buf.getvalue())
+                else:
+                    output.append(None)
+            finally:
+                if buf is not filename:
+                    buf.close()
+
+        return tuple(output)
+
+    @classmethod
+    def from_pickdb(cls, pickdb):
+        """
+        Copies all data from a pick database.
+
+        Parameters
+        ----------
+        pickdb: :class:`pyvm.picks.pickdb.PickDatabase`
+            Database to copy.
+
+        Returns
+        -------
+        db: :class:`ArrayPickDatabase`
+            Array-backed copy of the database.
+        """
+        db = cls()
+        with pickdb.snapshot():
+            for table in ['events', 'sources', 'receivers']:
+                fields = [f[0] for f in TABLE_FIELDS[table]]
+                data = pickdb.read_arrays('SELECT {:} FROM {:}'.format(
+                    ', '.join(fields), table),
+                    dtypes=dict(TABLE_FIELDS[table]))
+                db.tables[table].resize(len(data))
+                db.tables[table].set(np.arange(len(data)),
+                                     dict([(f, data[f]) for f in fields]))
+                db._index[table] = dict(zip(data[fields[0]].tolist(),
+                                            range(len(data))))
+            data = pickdb.read_arrays('SELECT event, srcid, recid, time,'
+                                      ' error FROM picks',
+                                      dtypes={'event': np.object_,
+                                              'time': np.float64,
+                                              'error': np.float64})
+        rows = np.arange(len(data))
+        db.tables['picks'].resize(len(data))
+        db.tables['picks'].set(rows, {
+            'ievent': db._lookup('events', data['event'], 'event'),
+            'isrc': db._lookup('sources', data['srcid'], 'srcid'),
+            'irec': db._lookup('receivers', data['recid'], 'recid'),
+            'time': data['time'], 'error': data['error']})
+        db._update_offsets(rows)
+        return db
+
+    def to_pickdb(self, pickdb=None, conflict='error', fast=False):
+        """
+        Copies all data to a pick database.
+
+        Parameters
+        ----------
+        pickdb: :class:`pyvm.picks.pickdb.PickDatabase`, optional
+            Database to add the data to. Default is to create a new
+            in-memory database.
+        conflict, fast: optional
+            See :meth:`pyvm.picks.pickdb.PickDatabase.add_sources`.
+
+        Returns
+        -------
+        pickdb: :class:`pyvm.picks.pickdb.PickDatabase`
+            Database with the data.
+        """
+        if pickdb is None:
+            pickdb = PickDatabase()
+        fields = [f[0] for f in TABLE_FIELDS['events']]
+        pickdb._insertmany('events', fields, self.tables['events']
+                           .to_frame(), conflict=conflict, fast=fast)
+        pickdb.add_sources(self.tables['sources'].to_frame(),
+                           conflict=conflict, fast=fast)
+        pickdb.add_receivers(self.tables['receivers'].to_frame(),
+                             conflict=conflict, fast=fast)
+        pickdb.add_picks(self.select('picks', fields=PICK_FIELDS),
+                         conflict=conflict, fast=fast)
+        return pickdb
@@ -0,0 +1,287 @@
+"""
+asyncio interface to pick databases.
+
+Queries and bulk inserts run on a bounded pool of worker threads, so that
+they do not block the event loop. Each worker thread reads through its own
+read-only connection (see the ``pooled`` option of
+:class:`pyvm.picks.pickdb.PickDatabase`), and writes are made one at a
+time through a single writer connection.
+
+Requires Python 3.
+
+Examples
+--------
+>>> db = AsyncPickDatabase('picks.sqlite', max_workers=8)  # doctest: +SKIP
+>>> async def count_picks(recids):  # doctest: +SKIP
+...     counts = await asyncio.gather(*[db.count('picks', recid=recid)
+...                                     for recid in recids])
+...     async for rows in db.iterate('SELECT * FROM picks', chunksize=1000):
+...         process(rows)
+...     return counts
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+import functools
+import threading
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    asyncio = None
+from pyvm.picks.pickdb import PickDatabase
+
+# Returned by worker threads when a query has no more rows
+_DONE = object()
+
+
+class AsyncPickDatabase(object):
+    """
+    asyncio interface to a pick database file.
+    """
+    def __init__(self, database, max_workers=4, loop=None, **kwargs):
+        """
+        asyncio interface to a pick database file.
+
+        Parameters
+        ----------
+        database : str
+            Filename of the pick database.
+        max_workers : int, optional
+            Largest number of queries and inserts to run at the same time.
+        loop : :class:`asyncio.AbstractEventLoop`, optional
+            Event loop to run on. Default is the running event loop when
+            each method is called.
+        **kwargs
+            Keyword arguments for :class:`pyvm.picks.pickdb.PickDatabase`.
+        """
+        if asyncio is None:
+            raise ImportError('AsyncPickDatabase requires asyncio.')
+        kwargs['pooled'] = True
+        self.db = PickDatabase(database, **kwargs)
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers)
+        self._loop = loop
+        # iterators with open connections, closed with the database
+        self._iterators = set()
+        self._lock = threading.Lock()
+
+    def _get_loop(self):
+        if self._loop is not None:
+            return self._loop
+        try:
+            return asyncio.get_running_loop()
+        except (AttributeError, RuntimeError):
+            return asyncio.get_event_loop()
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run a function on the worker threads.
+
+        Parameters
+        ----------
+        func : function
+            Function to run, usually a method of :attr:`db`.
+        *args, **kwargs
+            Arguments for `func`.
+
+        Returns
+        -------
+        future : :class:`asyncio.Future`
+            Future for the result of `func`.
+        """
+        return self._get_loop().run_in_executor(self.executor,
+                functools.partial(func, *args, **kwargs))
+
+    def execute(self, sql, params=()):
+        """
+        Execute a SQL statement and fetch all rows.
+
+        Returns a future for the list of rows.
+        """
+        return self.run(lambda: self.db.execute(sql, params).fetchall())
+
+    def read_sql(self, sql, **kwargs):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.read_sql`.
+        """
+        return self.run(self.db.read_sql, sql, **kwargs)
+
+    def read_table(self, table):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.read_table`.
+        """
+        return self.run(self.db.read_table, table)
+
+    def read_arrays(self, sql, params=(), **kwargs):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.read_arrays`.
+        """
+        return self.run(self.db.read_arrays, sql, params=params, **kwargs)
+
+    def count(self, table, **kwargs):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.count`.
+        """
+        return self.run(self.db.count, table, **kwargs)
+
+    def select(self, table, **kwargs):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.select` and fetch all
+        rows.
+        """
+        return self.run(lambda: self.db.select(table, **kwargs).fetchall())
+
+    def to_vmtomo(self, *args, **kwargs):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.to_vmtomo`.
+        """
+        return self.run(self.db.to_vmtomo, *args, **kwargs)
+
+    def picks_in_box(self, *args, **kwargs):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.picks_in_box`.
+        """
+        return self.run(self.db.picks_in_box, *args, **kwargs)
+
+    def add_event(self, *args, **kwargs):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.add_event`.
+        """
+        return self.run(self.db.add_event, *args, **kwargs)
+
+    def add_sources(self, data, **kwargs):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.add_sources`.
+        """
+        return self.run(self.db.add_sources, data, **kwargs)
+
+    def add_receivers(self, data, **kwargs):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.add_receivers`.
+        """
+        return self.run(self.db.add_receivers, data, **kwargs)
+
+    def add_picks(self, data, **kwargs):
+        """
+        Run :meth:`pyvm.picks.pickdb.PickDatabase.add_picks`.
+        """
+        return self.run(self.db.add_picks, data, **kwargs)
+
+    def iterate(self, sql, params=(), chunksize=1000):
+        """
+        Iterate over the rows of a query in chunks.
+
+        Parameters
+        ----------
+        sql : str
+            SELECT statement to execute.
+        params : {tuple, list, dict}, optional
+            Parameters for the statement.
+        chunksize : int, optional
+            Largest number of rows in each chunk.
+
+        Returns
+        -------
+        chunks : :class:`AsyncChunkIterator`
+            Asynchronous iterator (for use with ``async for``) over lists of
+            rows.
+        """
+        return AsyncChunkIterator(self, sql, params=params,
+                                  chunksize=chunksize)
+
+    def close(self):
+        """
+        Wait for running queries to finish and close the database.
+
+        Also closes the connections of iterators that were not finished.
+        """
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            iterators = list(self._iterators)
+        for iterator in iterators:
+            iterator._close()
+        self.db.close()
+
+
+class AsyncChunkIterator(object):
+    """
+    Asynchronous iterator over chunks of rows from a query.
+
+    The query runs on its own read-only connection, which is closed when
+    all rows have been fetched, the query fails, or :meth:`close` is
+    called. Connections of iterators that are left early (e.g., with
+    ``break``) are closed by :meth:`AsyncPickDatabase.close`.
+    """
+    def __init__(self, adb, sql, params=(), chunksize=1000):
+        self.adb = adb
+        self.sql = sql
+        self.params = params
+        self.chunksize = chunksize
+        self._connection = None
+        self._cursor = None
+        self._done = False
+
+    def _fetch(self):
+        """
+        Fetch the next chunk of rows on a worker thread.
+
+        Returns ``_DONE`` when there are no more rows.
+        """
+        if self._done:
+            return _DONE
+        try:
+            if self._cursor is None:
+                self._connection = self.adb.db.connect_reader()
+                with self.adb._lock:
+                    self.adb._iterators.add(self)
+                self._cursor = self._connection.execute(self.sql,
+                                                        self.params)
+            rows = self._cursor.fetchmany(self.chunksize)
+        except Exception:
+            self._close()
+            raise
+        if len(rows) == 0:
+            self._close()
+            return _DONE
+        return rows
+
+    def _close(self):
+        self._done = True
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+            self._cursor = None
+        with self.adb._lock:
+            self.adb._iterators.discard(self)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        # StopAsyncIteration is raised on the event loop, as futures of the
+        # worker threads should only fail with errors from the query
+        result = self.adb._get_loop().create_future()
+        future = self.adb.run(self._fetch)
+
+        def _done(future):
+            if result.cancelled():
+                return
+            if future.cancelled():
+                result.cancel()
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            elif future.result() is _DONE:
+                result.set_exception(StopAsyncIteration())
+            else:
+                result.set_result(future.result())
+
+        future.add_done_callback(_done)
+        return result
+
+    def close(self):
+        """
+        Stop iterating and close the connection.
+
+        Returns a future that is done when the connection is closed.
+        """
+        return self.adb.run(self._close)
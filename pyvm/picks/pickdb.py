@@ -1,46 +1,123 @@
 from __future__ import (absolute_import, division, print_function,
         unicode_literals)
-from pyvm.db.backends.sqlite3.connection import Connection
-from pyvm.db.backends.sqlite3.utils import format_search
-from pyvm.picks.schema import TABLES, BASIC_TABLES, BASIC_VIEWS, VMTOMO_VIEWS
+import io
+import os
+import math
+import tempfile
+import threading
+from contextlib import contextmanager
+from itertools import islice
+import numpy as np
+from pandas.io import sql as psql
+from pyvm.db.backends.sqlite3.base import dbapi2
+from pyvm.db.backends.sqlite3.connection import Connection, DatabaseError,\
+        DatabaseIntegrityError
+from pyvm.db.backends.sqlite3.cache import ResultCache, read_only_result
+from pyvm.db.backends.sqlite3.utils import build_where, iter_rows,\
+        write_cursor, CONFLICT_MODES
+from pyvm.picks.schema import TABLES, BASIC_TABLES, BASIC_VIEWS, VMTOMO_VIEWS,\
+        INDEXES, RTREE_TABLES, RTREE_TRIGGERS, CHANGE_TRIGGERS
 
+PICK_FIELDS = ['event', 'srcid', 'recid', 'time', 'error']
+
+# Order of picks written by PickDatabase.to_vmtomo()
+VMTOMO_PICK_ORDER = ['recid', 'srcid', 'branchid', 'subid', 'event']
+
+# Statements that pooled databases run on read-only connections
+READ_STATEMENTS = ['SELECT', 'WITH', 'EXPLAIN']
+
+# Tables copied by PickDatabase.merge(), in the order they are copied
+MERGE_TABLES = ['events', 'sources', 'receivers', 'picks']
+
+# Recomputes offsets for picks matching a WHERE clause
+UPDATE_OFFSETS = "UPDATE picks SET offset=(SELECT offset(srcx, srcy, recx,"\
+        " recy) FROM sources, receivers WHERE sources.srcid=picks.srcid"\
+        " AND receivers.recid=picks.recid) WHERE {:}"
+
+# Point tables and their field prefixes
+POINT_TABLES = {'sources': ('sources', 'src'),
+                'receivers': ('receivers', 'rec')}
+
+
+def offset(x1, y1, x2, y2):
+    """
+    Horizontal distance between two points.
+
+    Registered as the SQL function ``offset(x1, y1, x2, y2)`` in pick
+    databases.
+    """
+    if None in (x1, y1, x2, y2):
+        return None
+    return math.hypot(x2 - x1, y2 - y1)
 
 
 class PickDatabase(Connection):
 
     def __init__(self, database=':memory:', spatial=False, rebuild=False,
-            strict_integrity=True):
+            strict_integrity=True, cache_size=256 * 2 ** 20, pooled=False,
+            track_changes=False):
 
-        Connection.__init__(self, database=database, spatial=spatial)
+        if pooled and (database == ':memory:' or database == ''):
+            raise ValueError('Pooled connections require a database file.')
 
-        # Setup tables
-        if not spatial:
-            self._init_basic_tables(rebuild=rebuild)
-            self.SPATIAL = False
-        else:
-            #TODO spatialite tables
-            msg = "Spatialite support is not yet implemented."
-            msg += " Use `spatial=False` for now."
-            raise NotImplementedError(msg)
+        # spatial queries use SQLite's rtree module, not Spatialite
+        Connection.__init__(self, database=database, spatial=False,
+                check_same_thread=not pooled)
 
-        self._init_tables(rebuild=rebuild)
+        # Pool of read-only connections for threads other than this one
+        self.POOLED = pooled
+        self._database = database
+        self._owner = threading.current_thread()
+        self._local = threading.local()
+        self._readers = []
+        self._write_lock = threading.RLock()
+        if pooled:
+            # let readers run while writing, and commit each write
+            self.execute('PRAGMA journal_mode=WAL')
+            self.isolation_level = None
 
-        # Setup views
-        if not self.SPATIAL:
-            self._init_basic_views(rebuild=rebuild)
-        else:
-            #TODO spatialite views
-            pass
+        # Cache for results of reads, invalidated by writes
+        self.cache = ResultCache(max_bytes=cache_size)
+        self._generation = 0
 
-        self._init_vmtomo_views(rebuild=rebuild)
+        self.create_function('offset', 4, offset)
+
+        # Log changes to the data (see `_init_change_log`)
+        self.TRACK_CHANGES = track_changes
+
+        # Setup tables and views
+        self._init_schema(spatial=spatial, rebuild=rebuild)
 
         # Enforce data integrity
         if strict_integrity:
             self.execute('PRAGMA foreign_keys=ON')
 
+    def _init_schema(self, spatial=False, rebuild=False):
+        """
+        Initializes or upgrades all tables, views, indexes, and triggers
+        """
+        self.SPATIAL = spatial
+
+        self._init_basic_tables(rebuild=rebuild)
+
+        self._init_tables(rebuild=rebuild)
+
+        self._init_offsets()
+
+        # Setup views
+        self._init_basic_views(rebuild=rebuild)
+
+        self._init_vmtomo_views(rebuild=rebuild)
+
+        self._init_indexes(rebuild=rebuild)
+
+        self._init_rtree(rebuild=rebuild)
+
+        self._init_change_log(rebuild=rebuild)
+
     def _init_tables(self, rebuild=False):
         """
-        Initializes tables common to non-Spatialite and Spatialite databases
+        Initializes event, pick, and change log tables
         """
         for table in TABLES:
             if rebuild:
@@ -49,11 +126,73 @@ class PickDatabase(Connection):
             if table not in self.tables:
                 self.execute(TABLES[table])
 
+    def _init_offsets(self):
+        """
+        Adds and fills the offset column in pick tables from older databases
+        """
+        if 'offset' in self._get_fields('picks'):
+            return
+        self.execute("ALTER TABLE 'picks' ADD COLUMN offset REAL")
+        # recreate views that read offsets
+        if 'master_picks' in self.views:
+            self.execute("DROP VIEW 'master_picks'")
+        self._update_offsets('srcid', [r[0] for r in
+                             self.execute('SELECT srcid FROM sources')])
+
+    def _update_offsets(self, field, ids):
+        """
+        Recomputes offsets for picks with the given source or receiver IDs.
+
+        Parameters
+        ----------
+        field: str
+            ``'srcid'`` or ``'recid'``.
+        ids: list
+            IDs of the sources or receivers that picks are updated for.
+        """
+        sql = UPDATE_OFFSETS.format('{:}=?'.format(field))
+        self._touch()
+        with self.transaction():
+            self.executemany(sql, [(_id,) for _id in ids])
+
+    def _get_offsets(self, srcids, recids):
+        """
+        Computes offsets for source and receiver ID pairs.
+
+        Parameters
+        ----------
+        srcids, recids: array_like
+            Source and receiver IDs.
+
+        Returns
+        -------
+        offsets: list
+            Horizontal distance between each source and receiver, or `None`
+            if the source or receiver does not exist.
+        """
+        coords = []
+        for table, field, ids in [('sources', 'src', srcids),
+                                  ('receivers', 'rec', recids)]:
+            sql = 'SELECT {:}id, {:}x, {:}y FROM {:} ORDER BY {:}id'\
+                    .format(field, field, field, table, field)
+            points = np.asarray(self.execute(sql).fetchall(), dtype=float)
+            points = points.reshape(-1, 3)
+            ids = np.asarray(ids, dtype=float)
+            idx = np.clip(np.searchsorted(points[:, 0], ids), 0,
+                          max(len(points) - 1, 0))
+            if len(points) == 0:
+                xy = np.nan * np.ones((len(ids), 2))
+            else:
+                xy = points[idx, 1:]
+                xy[points[idx, 0] != ids] = np.nan
+            coords.append(xy)
+        offsets = np.hypot(coords[1][:, 0] - coords[0][:, 0],
+                           coords[1][:, 1] - coords[0][:, 1])
+        return [None if np.isnan(o) else o for o in offsets.tolist()]
+
     def _init_basic_tables(self, rebuild=False):
         """
         Initializes basic pick database tables.
-
-        These tables are used by non-spatialite databases.
         """
         for table in BASIC_TABLES:
             if rebuild:
@@ -65,8 +204,6 @@ class PickDatabase(Connection):
     def _init_basic_views(self, rebuild=False):
         """
         Initializes basic pick database views.
-
-        These views are used by non-spatialite databases.
         """
         for view in BASIC_VIEWS:
             if rebuild:
@@ -86,6 +223,384 @@ class PickDatabase(Connection):
             if view not in self.views:
                 self.execute(VMTOMO_VIEWS[view])
 
+    def _init_indexes(self, rebuild=False):
+        """
+        Initialize secondary indexes for pick queries
+        """
+        indexes = self.indexes
+        for index in INDEXES:
+            if rebuild and index in indexes:
+                self.drop_index(index)
+                indexes.remove(index)
+            if index not in indexes:
+                self.execute(INDEXES[index])
+
+    def _init_rtree(self, rebuild=False):
+        """
+        Initialize R*-tree indexes of source and receiver coordinates
+
+        Indexes are only built if the database was opened with
+        ``spatial=True``, and are removed otherwise, as keeping them in
+        sync adds to the cost of adding sources and receivers. Sets
+        ``RTREE`` to `False` if there is no index or SQLite was built
+        without the R*-tree module, in which case spatial queries filter
+        the point tables directly.
+        """
+        self.RTREE = self.SPATIAL
+        if rebuild or not self.SPATIAL:
+            triggers = self.triggers
+            for trigger in RTREE_TRIGGERS:
+                if trigger in triggers:
+                    self.execute("DROP TRIGGER '{:}'".format(trigger))
+            tables = self.tables
+            for table in RTREE_TABLES:
+                if table in tables:
+                    self.execute("DROP TABLE '{:}'".format(table))
+        if not self.SPATIAL:
+            return
+        tables = self.tables
+        for table in RTREE_TABLES:
+            if table in tables:
+                continue
+            try:
+                self.execute(RTREE_TABLES[table])
+            except DatabaseError:
+                self.RTREE = False
+                return
+            # index existing points
+            points, field = POINT_TABLES[table.replace('_rtree', '')]
+            sql = "INSERT INTO '{:}' SELECT {:}id, {:}x, {:}x, {:}y, {:}y"\
+                    .format(table, field, field, field, field, field)
+            sql += " FROM '{:}'".format(points)
+            with self.transaction():
+                self.execute(sql)
+        triggers = self.triggers
+        for trigger in RTREE_TRIGGERS:
+            if trigger not in triggers:
+                self.execute(RTREE_TRIGGERS[trigger])
+
+    def _init_change_log(self, rebuild=False):
+        """
+        Initialize triggers that log changes to the changes table
+
+        Triggers are only installed if the database was opened with
+        ``track_changes=True``, and are removed otherwise. Logging every
+        row roughly doubles the time taken to add picks.
+        """
+        triggers = self.triggers
+        for trigger in CHANGE_TRIGGERS:
+            if (rebuild or not self.TRACK_CHANGES) and trigger in triggers:
+                self.execute("DROP TRIGGER '{:}'".format(trigger))
+                triggers.remove(trigger)
+            if self.TRACK_CHANGES and trigger not in triggers:
+                self.execute(CHANGE_TRIGGERS[trigger])
+
+    def _get_version(self):
+        """
+        Returns the version of the data.
+
+        The version increases with every event, source, receiver, and pick
+        that is added, changed, or removed while the database is opened with
+        ``track_changes=True``, and is 0 for a new database. Changes made
+        without tracking are not counted.
+        """
+        sql = "SELECT seq FROM sqlite_sequence WHERE name='changes'"
+        row = self.execute(sql).fetchone()
+        return 0 if row is None else row[0]
+
+    version = property(_get_version)
+
+    def changes_since(self, version, table=None):
+        """
+        Returns the log of changes made after a version of the data.
+
+        Parameters
+        ----------
+        version: int
+            Version to list changes after (e.g., the value of
+            :attr:`version` when the data were last exported).
+        table: str, optional
+            Only list changes to this table: ``'events'``, ``'sources'``,
+            ``'receivers'``, or ``'picks'``. Default is to list changes to
+            all tables.
+
+        Returns
+        -------
+        changes: :class:`pandas.DataFrame`
+            One row per change, in the order they were made, with the
+            version after the change, the table name, the action
+            (``'insert'``, ``'update'``, or ``'delete'``), and the
+            ``event``, ``srcid``, and ``recid`` fields that identify the
+            changed row. Rows replaced while adding data are logged as
+            inserts.
+        """
+        sql = 'SELECT version, tablename, action, event, srcid, recid'
+        sql += ' FROM changes WHERE version>?'
+        params = [int(version)]
+        if table is not None:
+            sql += ' AND tablename=?'
+            params.append(table)
+        sql += ' ORDER BY version'
+        return self.read_sql(sql, params=params)
+
+    def prune_changes(self, version=None):
+        """
+        Removes old entries from the log of changes.
+
+        Versions keep increasing after entries are removed.
+
+        Parameters
+        ----------
+        version: int, optional
+            Remove changes up to and including this version. Default is
+            to remove all changes.
+        """
+        if version is None:
+            version = self.version
+        self._touch()
+        with self.transaction():
+            self.execute('DELETE FROM changes WHERE version<=?',
+                         (int(version),))
+
+    def _touch(self):
+        """
+        Marks cached query results as out of date.
+
+        Called by every method that changes data.
+        """
+        self._generation += 1
+
+    def _get_data_version(self):
+        """
+        Returns a value that changes whenever the data might have changed.
+
+        Combines the write-generation counter, the number of rows changed
+        by this connection, and the SQLite data version, which changes
+        when other connections write to the database file. Data versions
+        are only comparable for the same connection, so the connection
+        used for reading is included.
+        """
+        reader = self._reader()
+        try:
+            data_version = reader.execute(
+                    'SELECT * FROM pragma_data_version').fetchone()[0]
+        except Exception:
+            data_version = None
+        return (self._generation, self.total_changes, id(reader),
+                data_version)
+
+    def _reader(self):
+        """
+        Returns the connection for reading in the current thread.
+
+        For pooled databases, threads other than the one that opened the
+        database get their own read-only connection, as does the opening
+        thread while in :meth:`snapshot`. Otherwise, reads use this
+        connection.
+        """
+        if not self.POOLED:
+            return self
+        snapshot = getattr(self._local, 'snapshot', None)
+        if snapshot is not None:
+            return snapshot
+        if threading.current_thread() is self._owner:
+            return self
+        return self._thread_reader()
+
+    def _thread_reader(self):
+        """
+        Returns the read-only connection of the current thread.
+        """
+        reader = getattr(self._local, 'reader', None)
+        if reader is None:
+            # closed in close()
+            reader = self.connect_reader()
+            self._local.reader = reader
+            with self._write_lock:
+                self._readers.append(reader)
+        return reader
+
+    def connect_reader(self):
+        """
+        Opens a new read-only connection to the database file.
+
+        The connection can be used from any thread, but only by one thread
+        at a time.
+
+        Returns
+        -------
+        reader: :class:`pyvm.db.backends.sqlite3.connection.Connection`
+            Read-only connection with the ``offset()`` SQL function, that
+            shares the :attr:`profile` of this connection.
+        """
+        reader = Connection(self._database, check_same_thread=False)
+        reader.create_function('offset', 4, offset)
+        reader.execute('PRAGMA query_only=ON')
+        # record statistics with those of this connection
+        reader.profile = self.profile
+        return reader
+
+    def execute(self, *args, **kwargs):
+        """
+        Executes a SQL statement.
+
+        For pooled databases, queries from threads other than the one that
+        opened the database run on read-only connections, and all other
+        statements run on the shared writer connection, one at a time.
+        """
+        reader = self._reader()
+        if reader is not self:
+            if args[0].lstrip().split(None, 1)[0].upper() \
+                    in READ_STATEMENTS:
+                return reader.execute(*args, **kwargs)
+        with self._write_lock:
+            return Connection.execute(self, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        """
+        Executes a SQL statement for each set of parameters.
+        """
+        with self._write_lock:
+            return Connection.executemany(self, *args, **kwargs)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager for running statements in a single transaction.
+
+        For pooled databases, other threads cannot write until the
+        transaction ends.
+        """
+        with self._write_lock:
+            with Connection.transaction(self):
+                yield self
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Context manager for reading from a consistent view of the database.
+
+        For pooled databases, the snapshot is read on a read-only
+        connection in every thread, so that other threads can keep writing
+        while it is open. Writes made in the context are not seen by reads
+        in the context.
+
+        See :meth:`pyvm.db.backends.sqlite3.connection.Connection.snapshot`.
+        """
+        if not self.POOLED:
+            with Connection.snapshot(self):
+                yield self
+            return
+        if getattr(self._local, 'snapshot', None) is not None:
+            # already in a snapshot
+            yield self
+            return
+        reader = self._thread_reader()
+        self._local.snapshot = reader
+        try:
+            with Connection.snapshot(reader):
+                yield self
+        finally:
+            self._local.snapshot = None
+
+    def _tuple_cursor(self):
+        """
+        Returns a cursor that fetches rows as tuples.
+        """
+        cursor = self._reader().cursor()
+        cursor.row_factory = None
+        return cursor
+
+    def read_sql(self, sql, **kwargs):
+        """
+        Executes a SQL statement and returns a :class:`pandas.DataFrame`
+
+        See :meth:`pyvm.db.backends.sqlite3.connection.Connection.read_sql`.
+        """
+        return psql.read_sql(sql, self._reader(), **kwargs)
+
+    def close(self):
+        """
+        Closes the database and any pooled read-only connections.
+        """
+        with self._write_lock:
+            for reader in self._readers:
+                try:
+                    reader.close()
+                except Exception:
+                    pass
+            self._readers = []
+        Connection.close(self)
+
+    def _read_cached(self, key, read):
+        """
+        Returns a cached result, reading and caching it if needed.
+
+        Results share their data with the cache, so their numpy buffers are
+        read-only; call ``.copy()`` on a result to modify it. Data frames
+        are returned as shallow copies, so adding or dropping columns does
+        not change the cached result.
+
+        Parameters
+        ----------
+        key: tuple
+            Key for the result.
+        read: function
+            Function that reads the result.
+        """
+        version = self._get_data_version()
+        value = self.cache.get(key, version)
+        if value is None:
+            value = read_only_result(read())
+            self.cache.put(key, version, value)
+        if isinstance(value, np.ndarray):
+            return value.view()
+        return value.copy(deep=False)
+
+    def clear_cache(self):
+        """
+        Removes all query results from the cache.
+        """
+        self.cache.clear()
+
+    def read_table(self, table):
+        """
+        Reads all rows from a table and returns a
+        :class:`pandas.DataFrame`
+
+        Results are cached until data in the database changes, and share
+        their read-only data with the cache; use ``.copy()`` to modify them.
+
+        Parameters
+        ----------
+        table: str
+            Table name to read data from
+
+        Returns
+        -------
+        data: :class:`pandas.DataFrame`
+            Data from the table
+        """
+        return self._read_cached(('read_table', table),
+                lambda: Connection.read_table(self, table))
+
+    def read_arrays(self, sql, params=(), chunksize=10000, dtypes=None):
+        """
+        Executes a SQL statement and returns the rows as a numpy array.
+
+        Results are cached until data in the database changes, and are
+        read-only views of the cached arrays. See
+        :meth:`pyvm.db.backends.sqlite3.connection.Connection.read_arrays`.
+        """
+        if isinstance(params, dict):
+            _params = tuple(sorted(params.items()))
+        else:
+            _params = tuple(params)
+        key = ('read_arrays', sql, _params,
+               tuple(sorted((dtypes or {}).items())))
+        return self._read_cached(key, lambda: Connection.read_arrays(self,
+                sql, params=params, chunksize=chunksize, dtypes=dtypes))
+
     def _get_events(self):
         return self.read_table('events')
     events = property(fget=_get_events)
@@ -129,6 +644,7 @@ class PickDatabase(Connection):
         sql += " INTO 'events' (event, branchid, subid, description)"
         sql += " VALUES (?, ?, ?, ?)"
 
+        self._touch()
         self.execute(sql, (event, branchid, subid, description))
 
     def add_source(self, srcid, srcx, srcy, srcz, replace=False):
@@ -140,9 +656,7 @@ class PickDatabase(Connection):
         srcid: int
             Unique integer ID.
         srcx, srcy: float
-            Easting and northing of the source. If Spatialite support is
-            enabled, these coordinates must be in the coordinate
-            reference system set by PickDatabase.SRID.
+            Easting and northing of the source.
         srcz: float
             Depth of the source.
         replace: bool, optional
@@ -150,15 +664,15 @@ class PickDatabase(Connection):
             already exists.  Default (False) is to raise an error if the
             source point already exists.
         """
-        if not self.SPATIAL:
-            sql = "INSERT"
-            if replace:
-                sql += " OR REPLACE"
-            sql += " INTO 'sources' (srcid, srcx, srcy, srcz)"
-            sql += " VALUES (?, ?, ?, ?)"
-            self.execute(sql, (srcid, srcx, srcy, srcz))
-        else:
-            raise NotImplementedError
+        sql = "INSERT"
+        if replace:
+            sql += " OR REPLACE"
+        sql += " INTO 'sources' (srcid, srcx, srcy, srcz)"
+        sql += " VALUES (?, ?, ?, ?)"
+        self._touch()
+        self.execute(sql, (srcid, srcx, srcy, srcz))
+        if replace:
+            self._update_offsets('srcid', [srcid])
 
     def add_receiver(self, recid, recx, recy, recz, replace=False):
         """
@@ -169,9 +683,7 @@ class PickDatabase(Connection):
         recid: int
             Unique integer ID.
         recx, recy: float
-            Easting and northing of the receiver. If Spatialite support is
-            enabled, these coordinates must be in the coordinate
-            reference system set by PickDatabase.SRID.
+            Easting and northing of the receiver.
         recz: float
             Depth of the receiver.
         replace: bool, optional
@@ -179,16 +691,16 @@ class PickDatabase(Connection):
             already exists.  Default (False) is to raise an error if the
             receiver point already exists.
         """
-        if not self.SPATIAL:
-            sql = "INSERT"
-            if replace:
-                sql += " OR REPLACE"
-            sql += " INTO 'receivers' (recid, recx, recy, recz)"
-            sql += " VALUES (?, ?, ?, ?)"
-            self.execute(sql, (recid, recx, recy, recz))
-        else:
-            raise NotImplementedError
-    
+        sql = "INSERT"
+        if replace:
+            sql += " OR REPLACE"
+        sql += " INTO 'receivers' (recid, recx, recy, recz)"
+        sql += " VALUES (?, ?, ?, ?)"
+        self._touch()
+        self.execute(sql, (recid, recx, recy, recz))
+        if replace:
+            self._update_offsets('recid', [recid])
+
     def add_pick(self, event, srcid, recid, time, error=0.0,
             replace=False):
         """
@@ -216,12 +728,305 @@ class PickDatabase(Connection):
         sql = "INSERT"
         if replace:
             sql += " OR REPLACE"
-        sql += " INTO 'picks' (event, srcid, recid, time, error)"
-        sql += " VALUES (?, ?, ?, ?, ?)"
-        self.execute(sql, (event, srcid, recid, time, error))
+        sql += " INTO 'picks' (event, srcid, recid, time, error, offset)"
+        sql += " VALUES (?, ?, ?, ?, ?, (SELECT offset(srcx, srcy, recx, recy)"
+        sql += " FROM sources, receivers WHERE srcid=? AND recid=?))"
+        self._touch()
+        self.execute(sql, (event, srcid, recid, time, error, srcid, recid))
+
+    def _insertmany(self, table, fields, data, conflict='error',
+            fast=False, defaults=None):
+        """
+        Adds many rows to a table in a single transaction.
+        """
+        self._touch()
+        if fast:
+            with self.relaxed_durability():
+                return self.insertmany(table, fields, data,
+                        conflict=conflict, defaults=defaults)
+        return self.insertmany(table, fields, data, conflict=conflict,
+                defaults=defaults)
+
+    def add_sources(self, data, conflict='error', fast=False):
+        """
+        Adds many sources to the sources table.
+
+        Parameters
+        ----------
+        data: {:class:`pandas.DataFrame`, dict, numpy.ndarray, list}
+            Source data with the fields ``srcid, srcx, srcy, srcz``. Arrays
+            and lists must have one row per source with values in this
+            order.
+        conflict: str, optional
+            What to do with sources that already exist: ``'error'``
+            (default) raises an error and adds none of the sources,
+            ``'replace'`` updates the existing records, and ``'ignore'``
+            keeps the existing records.
+        fast: bool, optional
+            If `True`, turn off syncing and journaling to disk while
+            loading. See
+            :meth:`pyvm.db.backends.sqlite3.connection.Connection.relaxed_durability`.
+
+        Returns
+        -------
+        nrows: int
+            Number of sources added or replaced.
+        """
+        fields = ['srcid', 'srcx', 'srcy', 'srcz']
+        rows = list(iter_rows(data, fields))
+        n = self._insertmany('sources', fields, rows, conflict=conflict,
+                fast=fast)
+        if conflict == 'replace':
+            self._update_offsets('srcid', [r[0] for r in rows])
+        return n
+
+    def add_receivers(self, data, conflict='error', fast=False):
+        """
+        Adds many receivers to the receivers table.
+
+        Parameters
+        ----------
+        data: {:class:`pandas.DataFrame`, dict, numpy.ndarray, list}
+            Receiver data with the fields ``recid, recx, recy, recz``.
+            Arrays and lists must have one row per receiver with values in
+            this order.
+        conflict: str, optional
+            What to do with receivers that already exist. See
+            :meth:`add_sources`.
+        fast: bool, optional
+            See :meth:`add_sources`.
+
+        Returns
+        -------
+        nrows: int
+            Number of receivers added or replaced.
+        """
+        fields = ['recid', 'recx', 'recy', 'recz']
+        rows = list(iter_rows(data, fields))
+        n = self._insertmany('receivers', fields, rows, conflict=conflict,
+                fast=fast)
+        if conflict == 'replace':
+            self._update_offsets('recid', [r[0] for r in rows])
+        return n
+
+    def add_picks(self, data, conflict='error', fast=False):
+        """
+        Adds many picks to the picks table.
+
+        Parameters
+        ----------
+        data: {:class:`pandas.DataFrame`, dict, numpy.ndarray, list}
+            Pick data with the fields ``event, srcid, recid, time, error``.
+            Arrays and lists must have one row per pick with values in this
+            order. The ``error`` field is optional and defaults to 0.0.
+            Events, sources, and receivers must already exist. Offsets are
+            computed from the source and receiver coordinates.
+        conflict: str, optional
+            What to do with picks that have the same event, srcid, and
+            recid as an existing pick. See :meth:`add_sources`.
+        fast: bool, optional
+            See :meth:`add_sources`.
+
+        Returns
+        -------
+        nrows: int
+            Number of picks added or replaced.
+        """
+        rows = list(iter_rows(data, PICK_FIELDS, defaults={'error': 0.0}))
+        if len(rows) > 0:
+            _, srcids, recids, _, _ = zip(*rows)
+            offsets = self._get_offsets(srcids, recids)
+            rows = [r + (o,) for r, o in zip(rows, offsets)]
+        return self._insertmany('picks', PICK_FIELDS + ['offset'], rows,
+                conflict=conflict, fast=fast)
+
+    def _points_in_box(self, table, xmin, xmax, ymin, ymax):
+        """
+        Returns SQL selecting IDs of points in a bounding box.
+
+        Parameters
+        ----------
+        table: str
+            ``'sources'`` or ``'receivers'``.
+        xmin, xmax, ymin, ymax: float
+            Bounds of the box.
+
+        Returns
+        -------
+        sql: str
+            SELECT statement for point IDs.
+        params: list
+            Parameters for the statement.
+        """
+        if not self.SPATIAL:
+            msg = 'Spatial queries require a database opened with'
+            msg += ' `spatial=True`.'
+            raise ValueError(msg)
+        table, field = POINT_TABLES[table]
+        bounds = [xmin, xmax, ymin, ymax]
+        sql = "SELECT {0}id FROM {1} WHERE {0}x BETWEEN ? AND ?"\
+                .format(field, table)
+        sql += " AND {:}y BETWEEN ? AND ?".format(field)
+        params = [float(v) for v in bounds]
+        if self.RTREE:
+            # the R*-tree stores bounds rounded outward to 32-bit floats, so
+            # search for overlapping entries and check the exact coordinates
+            sql += " AND {:}id IN (SELECT id FROM {:}_rtree".format(field,
+                                                                    table)
+            sql += " WHERE maxx>=? AND minx<=? AND maxy>=? AND miny<=?)"
+            params += [float(v) for v in bounds]
+        return sql, params
+
+    def _points_in_radius(self, table, x, y, radius):
+        """
+        Returns SQL selecting IDs of points within a distance of a point.
+
+        See :meth:`_points_in_box`.
+        """
+        sql, params = self._points_in_box(table, x - radius, x + radius,
+                                          y - radius, y + radius)
+        field = POINT_TABLES[table][1]
+        sql += " AND offset(?, ?, {0}x, {0}y)<=?".format(field)
+        return sql, params + [float(x), float(y), float(radius)]
+
+    def _select_points(self, table, sql, params):
+        """
+        Returns rows of a point table with IDs selected by a query.
+        """
+        table, field = POINT_TABLES[table]
+        _sql = "SELECT * FROM {:} WHERE {:}id IN ({:}) ORDER BY {:}id"\
+                .format(table, field, sql, field)
+        return self.read_sql(_sql, params=params)
+
+    def _select_picks(self, queries, which):
+        """
+        Returns rows of master_picks with sources and receivers selected
+        by queries.
+        """
+        if which not in ['both', 'either', 'sources', 'receivers']:
+            msg = "which must be one of: 'both', 'either', 'sources',"
+            msg += " 'receivers'"
+            raise ValueError(msg)
+        terms = []
+        params = []
+        for table in ['sources', 'receivers']:
+            if which in [table, 'both', 'either']:
+                sql, _params = queries[table]
+                terms.append('({:}id IN ({:}))'.format(
+                    POINT_TABLES[table][1], sql))
+                params += _params
+        op = ' OR ' if which == 'either' else ' AND '
+        sql = 'SELECT * FROM master_picks WHERE ' + op.join(terms)
+        return self.read_sql(sql, params=params)
+
+    def sources_in_box(self, xmin, xmax, ymin, ymax):
+        """
+        Selects sources in a bounding box.
+
+        Requires a database opened with ``spatial=True``, which keeps an
+        R*-tree index of source and receiver coordinates (if SQLite supports
+        it).
+
+        Parameters
+        ----------
+        xmin, xmax, ymin, ymax: float
+            Bounds of the box. Sources on the bounds are included.
+
+        Returns
+        -------
+        sources: :class:`pandas.DataFrame`
+            Rows from the sources table, sorted by srcid.
+        """
+        sql, params = self._points_in_box('sources', xmin, xmax, ymin, ymax)
+        return self._select_points('sources', sql, params)
+
+    def receivers_in_box(self, xmin, xmax, ymin, ymax):
+        """
+        Selects receivers in a bounding box.
+
+        See :meth:`sources_in_box`.
+        """
+        sql, params = self._points_in_box('receivers', xmin, xmax, ymin,
+                                          ymax)
+        return self._select_points('receivers', sql, params)
+
+    def sources_in_radius(self, x, y, radius):
+        """
+        Selects sources within a horizontal distance of a point.
+
+        Parameters
+        ----------
+        x, y: float
+            Coordinates of the point.
+        radius: float
+            Largest distance from the point.
+
+        Returns
+        -------
+        sources: :class:`pandas.DataFrame`
+            Rows from the sources table, sorted by srcid.
+        """
+        sql, params = self._points_in_radius('sources', x, y, radius)
+        return self._select_points('sources', sql, params)
+
+    def receivers_in_radius(self, x, y, radius):
+        """
+        Selects receivers within a horizontal distance of a point.
+
+        See :meth:`sources_in_radius`.
+        """
+        sql, params = self._points_in_radius('receivers', x, y, radius)
+        return self._select_points('receivers', sql, params)
+
+    def picks_in_box(self, xmin, xmax, ymin, ymax, which='both'):
+        """
+        Selects picks with sources and/or receivers in a bounding box.
+
+        Parameters
+        ----------
+        xmin, xmax, ymin, ymax: float
+            Bounds of the box.
+        which: str, optional
+            Which points must be in the box: ``'both'`` (default), the
+            source or the receiver (``'either'``), only the source
+            (``'sources'``), or only the receiver (``'receivers'``).
+
+        Returns
+        -------
+        picks: :class:`pandas.DataFrame`
+            Rows from the master_picks view.
+        """
+        queries = dict([(table, self._points_in_box(table, xmin, xmax, ymin,
+                                                    ymax))
+                        for table in POINT_TABLES])
+        return self._select_picks(queries, which)
+
+    def picks_in_radius(self, x, y, radius, which='both'):
+        """
+        Selects picks with sources and/or receivers near a point.
+
+        Parameters
+        ----------
+        x, y: float
+            Coordinates of the point.
+        radius: float
+            Largest horizontal distance from the point.
+        which: str, optional
+            See :meth:`picks_in_box`.
+
+        Returns
+        -------
+        picks: :class:`pandas.DataFrame`
+            Rows from the master_picks view.
+        """
+        queries = dict([(table, self._points_in_radius(table, x, y, radius))
+                        for table in POINT_TABLES])
+        return self._select_picks(queries, which)
 
     def to_vmtomo(self, sources_file=None, receivers_file=None,
-            picks_file=None, header=False, sep='\t', **kwargs):
+            picks_file=None, header=False, sep='\t', offset_min=None,
+            offset_max=None, chunksize=10000, since_version=None,
+            **kwargs):
         """
         Formats pick data for input to the underlying tomography code.
 
@@ -229,61 +1034,503 @@ class PickDatabase(Connection):
         ----------
         sources_file: str or buffer
             Filename or buffer to write the sources data to. If `None`
-            (default), no source data is written.
+            (default), the source data is returned as a string.
         receivers_file: str or buffer
             Filename or buffer to write the receivers data to. If `None`
-            (default), no receiver data is written.
+            (default), the receiver data is returned as a string.
         picks_file: str or buffer
             Filename or buffer to write the pick data to. If `None`
-            (default), no pick data is written.
+            (default), the pick data is returned as a string.
         header: bool, optional
             Determines whether or not to write header rows. A header row
             cannot be present in files read by the underlying tomography
             code. Default is to not write a header.
         sep: str
             Field delimiter for the output file.
+        offset_min, offset_max: float, optional
+            Only include picks with source-receiver offsets in this range.
+            Default is to include picks with any offset.
+        chunksize: int, optional
+            Number of rows to read from the database and write at a time.
+            Memory use does not depend on the number of picks.
+        since_version: int, optional
+            Only include picks that were added or changed after this
+            version of the data (see :attr:`version`), including picks of
+            events, sources, and receivers that were changed. Removed
+            picks are listed by :meth:`changes_since`. Requires a database
+            opened with ``track_changes=True``. Default is to include picks
+            from any version.
         kwargs, optional
-            Keyword arguments for selecting picks from the database. Default
-            is to include all picks.
+            Keyword arguments for selecting picks from the database (e.g.,
+            ``event='Pn'`` or ``recid=[101, 102]``). See
+            :func:`pyvm.db.backends.sqlite3.utils.build_where`. Default is
+            to include all picks.
 
         Returns
         -------
         sources, receviers, picks: str
-            Strings of formatted source, recevier, and pick data.
+            Strings of formatted source, recevier, and pick data, or `None`
+            for data written to a file or buffer. All three are read from
+            the same snapshot of the database. Sources and receivers are
+            sorted by ID, and picks by receiver, source, branch, subbranch,
+            and event.
         """
-        if len(kwargs) > 0:
-            search = ' ' + format_search(kwargs)
-        else:
-            search = ''
+        if offset_min is not None:
+            kwargs['offset__gte'] = offset_min
+        if offset_max is not None:
+            kwargs['offset__lte'] = offset_max
+        search, params = build_where(kwargs)
+        if since_version is not None:
+            if not self.TRACK_CHANGES:
+                msg = 'Changes are only logged for databases opened with'
+                msg += ' `track_changes=True`.'
+                raise ValueError(msg)
+            changed = "(EXISTS (SELECT 1 FROM changes AS c"
+            changed += " WHERE c.tablename='picks'"
+            changed += " AND c.event=master_picks.event"
+            changed += " AND c.srcid=master_picks.srcid"
+            changed += " AND c.recid=master_picks.recid AND c.version>?)"
+            for table, field in [('events', 'event'), ('sources', 'srcid'),
+                                 ('receivers', 'recid')]:
+                changed += " OR {:} IN (SELECT {:} FROM changes".format(
+                        field, field)
+                changed += " WHERE tablename='{:}' AND version>?)"\
+                        .format(table)
+            changed += ")"
+            if search != '':
+                search = changed + ' AND ' + search
+            else:
+                search = changed
+            params = [int(since_version)] * 4 + params
 
+        queries = []
         # sources
-        sql = "SELECT DISTINCT srcid, srcx, srcy, srcz"
-        if search == '':
-            sql += " FROM sources"
-        else:
-            sql += " FROM master_picks"
-            sql += " WHERE " + search
+        sql = "SELECT srcid, srcx, srcy, srcz FROM sources"
+        if search != '':
+            sql += " WHERE srcid IN (SELECT srcid FROM master_picks"
+            sql += " WHERE " + search + ")"
         sql += " ORDER BY srcid"
-        sources = self.read_sql(sql).to_csv(path_or_buf=sources_file,
-                sep=str(sep), index=False, header=header)
+        queries.append((sql, params, sources_file))
 
         # receivers
-        sql = "SELECT DISTINCT recid, recx, recy, recz"
-        if search == '':
-            sql += " FROM receivers"
-        else:
-            sql += " FROM master_picks"
-            sql += " WHERE " + search
+        sql = "SELECT recid, recx, recy, recz FROM receivers"
+        if search != '':
+            sql += " WHERE recid IN (SELECT recid FROM master_picks"
+            sql += " WHERE " + search + ")"
         sql += " ORDER BY recid"
-        receivers = self.read_sql(sql).to_csv(path_or_buf=receivers_file,
-                sep=str(sep), index=False, header=header)
+        queries.append((sql, params, receivers_file))
 
         # picks
         sql = "SELECT recid, srcid, branchid, subid, offset, time, error"
         sql += " FROM master_picks"
         if search != '':
             sql += " WHERE " + search
-        picks = self.read_sql(sql).to_csv(path_or_buf=picks_file,
-                sep=str(sep), index=False, header=header)
+        sql += " ORDER BY " + ', '.join(VMTOMO_PICK_ORDER)
+        queries.append((sql, params, picks_file))
+
+        output = []
+        with self.snapshot():
+            for sql, params, filename in queries:
+                if filename is None:
+                    buf = io.StringIO()
+                elif hasattr(filename, 'write'):
+                    buf = filename
+                else:
+                    buf = io.open(filename, 'w')
+                try:
+                    write_cursor(self.execute(sql, params), buf, sep=sep,
+                                 header=header, chunksize=chunksize)
+                    if filename is None:
+                        output.append(buf.getvalue())
+                    else:
+                        output.append(None)
+                finally:
+                    if buf is not filename:
+                        buf.close()
+
+        return tuple(output)
+
+    def from_vmtomo(self, sources_file=None, receivers_file=None,
+            picks_file=None, header=False, chunksize=100000,
+            conflict='error', fast=False):
+        """
+        Reads pick data from files formatted for the underlying tomography
+        code.
+
+        Files are read and added to the database in chunks of `chunksize`
+        rows, so that files much larger than the available memory can be
+        read. Events are added for each new combination of branch and
+        subbranch IDs in the picks file, using the name
+        ``'branchid.subid'``, unless an event with the same IDs already
+        exists.
+
+        Parameters
+        ----------
+        sources_file: str or buffer
+            Filename or buffer to read source data from. If `None`
+            (default), no source data is read.
+        receivers_file: str or buffer
+            Filename or buffer to read receiver data from. If `None`
+            (default), no receiver data is read.
+        picks_file: str or buffer
+            Filename or buffer to read pick data from. If `None` (default),
+            no pick data is read. Sources and receivers must already exist
+            or be read from `sources_file` and `receivers_file`.
+        header: bool, optional
+            Determines whether or not to skip a header row at the top of
+            each file. Default is to not skip a row.
+        chunksize: int, optional
+            Number of rows to read and add at a time.
+        conflict: str, optional
+            What to do with rows that already exist. See
+            :meth:`add_sources`.
+        fast: bool, optional
+            See :meth:`add_sources`.
+
+        Returns
+        -------
+        nsources, nreceivers, npicks: int
+            Number of sources, receivers, and picks added or replaced.
+        """
+        nsources = nreceivers = npicks = 0
+        for filename, add in [(sources_file, self.add_sources),
+                              (receivers_file, self.add_receivers)]:
+            if filename is None:
+                continue
+            n = 0
+            for rows in _read_chunks(filename, chunksize, header=header):
+                n += add([(int(r[0]), float(r[1]), float(r[2]),
+                           float(r[3])) for r in rows], conflict=conflict,
+                         fast=fast)
+            if add == self.add_sources:
+                nsources = n
+            else:
+                nreceivers = n
+
+        if picks_file is not None:
+            events = {}
+            sql = 'SELECT event, branchid, subid FROM events ORDER BY event'
+            for row in self.execute(sql):
+                events.setdefault((row[1], row[2]), row[0])
+            for rows in _read_chunks(picks_file, chunksize, header=header):
+                picks = []
+                for r in rows:
+                    branch = (int(r[2]), int(r[3]))
+                    if branch not in events:
+                        events[branch] = '{:}.{:}'.format(*branch)
+                        self.add_event(events[branch], branchid=branch[0],
+                                subid=branch[1])
+                    picks.append((events[branch], int(r[1]), int(r[0]),
+                                  float(r[5]), float(r[6])))
+                npicks += self.add_picks(picks, conflict=conflict,
+                                         fast=fast)
+
+        return nsources, nreceivers, npicks
+
+    def merge(self, other, conflict='replace'):
+        """
+        Adds all data from another pick database file.
+
+        The other database is attached to this one, and each table is
+        copied with a single ``INSERT ... SELECT`` statement, all in one
+        transaction. Rows that are identical in both databases are
+        skipped. Offsets of copied picks are computed from the sources and
+        receivers in this database after merging.
+
+        Parameters
+        ----------
+        other: str
+            Filename of the pick database to merge into this one.
+        conflict: str, optional
+            What to do with events, sources, receivers, and picks that
+            exist in both databases with different values: ``'replace'``
+            (default) keeps the values from `other`, ``'ignore'`` keeps
+            the values in this database, and ``'error'`` raises a
+            :class:`pyvm.db.backends.sqlite3.connection.DatabaseIntegrityError`
+            and merges nothing.
+
+        Returns
+        -------
+        merged: dict
+            Number of rows added or replaced in each table.
+        conflicts: dict
+            Number of rows in each table of `other` that conflict with rows
+            in this database.
+        """
+        if conflict not in CONFLICT_MODES:
+            msg = "conflict must be one of: {:}"\
+                    .format(', '.join(sorted(CONFLICT_MODES)))
+            raise ValueError(msg)
+        if not os.path.isfile(other):
+            raise IOError("No such pick database: '{:}'".format(other))
+        merged = {}
+        conflicts = {}
+        self._touch()
+        with self._attached(other, 'merge_source') as cursor:
+            fields = self._attached_fields(cursor, 'merge_source')
+            with self.transaction():
+                for table in MERGE_TABLES:
+                    if table not in fields:
+                        continue
+                    keys, _fields = fields[table]
+                    merged[table], conflicts[table] = \
+                            self._merge_table(cursor, table, keys,
+                                [f for f in _fields if f != 'offset'],
+                                conflict)
+        return merged, conflicts
+
+    @contextmanager
+    def _attached(self, path, name):
+        """
+        Context manager that attaches another database file.
+
+        Yields a cursor on the writer connection, which holds the write
+        lock until the database is detached.
+        """
+        with self._write_lock:
+            cursor = self.cursor()
+            self.commit()
+            cursor.execute('ATTACH DATABASE ? AS {:}'.format(name), (path,))
+            try:
+                yield cursor
+            finally:
+                self.commit()
+                cursor.execute('DETACH DATABASE {:}'.format(name))
+
+    def _attached_fields(self, cursor, name):
+        """
+        Returns the primary keys and the fields of pick tables in an
+        attached database that are also in this database, by table name.
+
+        Table info is read before copying, as PRAGMA statements can end
+        transactions.
+        """
+        tables = [r[0] for r in cursor.execute(
+            "SELECT name FROM {:}.sqlite_master WHERE type='table'"
+            .format(name))]
+        fields = {}
+        for table in MERGE_TABLES + ['changes']:
+            if table not in tables:
+                continue
+            other_fields = [r[1] for r in cursor.execute(
+                "PRAGMA {:}.table_info('{:}')".format(name, table))]
+            fields[table] = (self._get_primary_fields(table),
+                             [f for f in self._get_fields(table)
+                              if f in other_fields])
+        return fields
+
+    def _merge_table(self, cursor, table, keys, fields, conflict):
+        """
+        Copies fields of a table from the attached ``merge_source``
+        database.
+
+        Returns the numbers of rows copied and of conflicting rows.
+        """
+        values = [f for f in fields if f not in keys]
+        same_key = ' AND '.join(['m.{:}=o.{:}'.format(f, f) for f in keys])
+        same_values = ' AND '.join(['m.{:} IS o.{:}'.format(f, f)
+                                    for f in values]) or '1'
+        where = "EXISTS (SELECT 1 FROM main.'{:}' AS m WHERE {:}"\
+                " AND NOT ({:}))".format(table, same_key, same_values)
+
+        sql = "SELECT {:} FROM merge_source.'{:}' AS o WHERE {:}"\
+                .format(', '.join(['o.' + f for f in keys]), table, where)
+        changed = cursor.execute(sql).fetchall()
+        if len(changed) > 0 and conflict == 'error':
+            msg = "{:} rows in table '{:}' conflict with existing rows."\
+                    .format(len(changed), table)
+            raise DatabaseIntegrityError(msg)
+
+        # skip rows that are already in this database
+        sql = "INSERT{:} INTO main.'{:}' ({:})".format(
+                ' OR REPLACE' if conflict == 'replace' else ' OR IGNORE',
+                table, ', '.join(fields + (['offset'] if table == 'picks'
+                                           else [])))
+        sql += " SELECT {:}".format(', '.join(['o.' + f for f in fields]))
+        if table == 'picks':
+            sql += ", (SELECT offset(srcx, srcy, recx, recy)"
+            sql += " FROM main.sources, main.receivers"
+            sql += " WHERE sources.srcid=o.srcid"
+            sql += " AND receivers.recid=o.recid)"
+        sql += " FROM merge_source.'{:}' AS o".format(table)
+        sql += " WHERE NOT EXISTS (SELECT 1 FROM main.'{:}' AS m"\
+                " WHERE {:} AND {:})".format(table, same_key, same_values)
+        n = max(cursor.execute(sql).rowcount, 0)
+
+        if table in POINT_TABLES and conflict == 'replace' \
+                and len(changed) > 0:
+            # moved sources or receivers
+            cursor.executemany(UPDATE_OFFSETS.format(
+                '{:}=?'.format(keys[0])), [tuple(r) for r in changed])
+        return n, len(changed)
+
+
+    def save(self, path, progress=None, pages=-1):
+        """
+        Saves a copy of the database to a file.
+
+        The copy is written to a temporary file that then replaces `path`,
+        so that `path` always holds a complete database. Uses the SQLite
+        online backup API if it is available, and ``VACUUM INTO``
+        otherwise (e.g., in Python 2). Useful for saving databases built
+        in memory.
+
+        Parameters
+        ----------
+        path: str
+            Filename to save the database to. An existing file is
+            replaced.
+        progress: function, optional
+            Called as ``progress(status, remaining, total)`` after each
+            step of the copy, with the numbers of pages left to copy and
+            of pages in the database. Without the backup API, it is called
+            once when the copy is done.
+        pages: int, optional
+            Number of pages to copy in each step. Default (-1) is to copy
+            all pages in one step.
+        """
+        path = os.path.abspath(path)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                prefix='.' + os.path.basename(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            with self._write_lock:
+                self.commit()
+                if hasattr(dbapi2.Connection, 'backup'):
+                    target = dbapi2.connect(tmp)
+                    try:
+                        self.backup(target, pages=pages, progress=progress)
+                    finally:
+                        target.close()
+                else:
+                    os.remove(tmp)
+                    self.cursor().execute('VACUUM INTO ?', (tmp,))
+                    if progress is not None:
+                        npages = self.execute('PRAGMA page_count')\
+                                .fetchone()[0]
+                        progress(0, 0, npages)
+            getattr(os, 'replace', os.rename)(tmp, path)
+        finally:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+
+    @classmethod
+    def load(cls, path, into_memory=True, progress=None, pages=-1,
+            **kwargs):
+        """
+        Opens a pick database file, optionally copying it into memory.
+
+        Parameters
+        ----------
+        path: str
+            Filename of the pick database.
+        into_memory: bool, optional
+            If `True` (default), copy the database into a new in-memory
+            database, which is fastest for read-heavy work. Changes are
+            not written to `path`, unless saved with :meth:`save`. If
+            `False`, open the file directly.
+        progress, pages: optional
+            See :meth:`save`.
+        **kwargs
+            Keyword arguments for :class:`PickDatabase`.
+
+        Returns
+        -------
+        db: :class:`PickDatabase`
+            Pick database with the data from `path`.
+        """
+        if not os.path.isfile(path):
+            raise IOError("No such pick database: '{:}'".format(path))
+        if not into_memory:
+            return cls(path, **kwargs)
+        db = cls(':memory:', **kwargs)
+        if hasattr(dbapi2.Connection, 'backup'):
+            source = dbapi2.connect(path)
+            try:
+                db.commit()
+                source.backup(db, pages=pages, progress=progress)
+            finally:
+                source.close()
+            # upgrade databases from older versions
+            db._init_schema(spatial=db.SPATIAL)
+        else:
+            db._copy_from(path)
+            if progress is not None:
+                progress(0, 0, db.execute('PRAGMA page_count').fetchone()[0])
+        db._touch()
+        return db
+
+    def _copy_from(self, path):
+        """
+        Copies all data and the log of changes from a pick database file
+        into this empty database.
+        """
+        self._touch()
+        with self._attached(path, 'copy_source') as cursor:
+            fields = self._attached_fields(cursor, 'copy_source')
+            with self.transaction():
+                for table in MERGE_TABLES:
+                    if table not in fields:
+                        continue
+                    _fields = ', '.join(fields[table][1])
+                    cursor.execute("INSERT INTO main.'{:}' ({:}) SELECT {:}"
+                                   " FROM copy_source.'{:}'".format(table,
+                                       _fields, _fields, table))
+                # databases from older versions do not have offsets
+                cursor.execute(UPDATE_OFFSETS.format('offset IS NULL'))
+
+                # keep the log and version of the copied database
+                version = 0
+                cursor.execute('DELETE FROM main.changes')
+                if 'changes' in fields:
+                    _fields = ', '.join(fields['changes'][1])
+                    cursor.execute("INSERT INTO main.changes ({:}) SELECT"
+                                   " {:} FROM copy_source.changes"
+                                   .format(_fields, _fields))
+                    row = cursor.execute("SELECT seq FROM"
+                            " copy_source.sqlite_sequence"
+                            " WHERE name='changes'").fetchone()
+                    if row is not None:
+                        version = row[0]
+                cursor.execute("DELETE FROM main.sqlite_sequence"
+                               " WHERE name='changes'")
+                cursor.execute("INSERT INTO main.sqlite_sequence (name, seq)"
+                               " VALUES ('changes', ?)", (version,))
+
+
+def _read_chunks(filename, chunksize, header=False):
+    """
+    Reads a whitespace-delimited file in chunks of split rows.
+
+    Parameters
+    ----------
+    filename: str or buffer
+        Filename or buffer to read from.
+    chunksize: int
+        Maximum number of rows in each chunk.
+    header: bool, optional
+        Determines whether or not to skip the first row.
 
-        return sources, receivers, picks
+    Returns
+    -------
+    chunks: generator
+        Lists of rows, with each row a list of strings. Blank rows are
+        skipped.
+    """
+    if hasattr(filename, 'read'):
+        f = filename
+    else:
+        f = open(filename, 'r')
+    try:
+        if header:
+            f.readline()
+        rows = (row.split() for row in f)
+        rows = (row for row in rows if len(row) > 0)
+        while True:
+            chunk = list(islice(rows, chunksize))
+            if len(chunk) == 0:
+                break
+            yield chunk
+    finally:
+        if f is not filename:
+            f.close()
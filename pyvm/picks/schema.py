@@ -9,12 +9,18 @@ TABLES['events'] = """CREATE TABLE 'events' (event TEXT NOT NULL,
 
 TABLES['picks'] = """CREATE TABLE 'picks' (event TEXT,
     srcid INTEGER,
-    recid INTEGER, time REAL, error REAL DEFAULT 0.0,
+    recid INTEGER, time REAL, error REAL DEFAULT 0.0, offset REAL,
     PRIMARY KEY (event, srcid, recid),
     FOREIGN KEY(event) REFERENCES events(event),
     FOREIGN KEY(srcid) REFERENCES sources(srcid),
     FOREIGN KEY(recid) REFERENCES receivers(recid))"""
 
+# Log of rows added, changed, or removed, by increasing version. Rows are
+# added by triggers on the tables in CHANGE_KEYS.
+TABLES['changes'] = """CREATE TABLE 'changes' (
+    version INTEGER PRIMARY KEY AUTOINCREMENT, tablename TEXT NOT NULL,
+    action TEXT NOT NULL, event TEXT, srcid INTEGER, recid INTEGER)"""
+
 # Basic (non-Spatialite) pick database tables and views
 BASIC_TABLES = {}
 BASIC_TABLES['sources'] = """CREATE TABLE 'sources' (srcid INTEGER,
@@ -28,12 +34,33 @@ BASIC_VIEWS['master_picks'] = """CREATE VIEW 'master_picks'
     AS SELECT events.event AS event, branchid, subid,
     sources.srcid AS srcid, srcx, srcy, srcz,
     receivers.recid AS recid, recx, recy, recz,
-    0.0 AS offset, time, error FROM
+    picks.offset AS offset, time, error FROM
     'picks' INNER JOIN 'events' ON picks.event=events.event
     INNER JOIN 'sources' ON picks.srcid=sources.srcid
     INNER JOIN 'receivers' ON picks.recid=receivers.recid"""
 
 
+# Secondary indexes for joining and filtering picks
+INDEXES = {}
+INDEXES['picks_srcid'] = """CREATE INDEX 'picks_srcid'
+    ON 'picks' (srcid)"""
+
+INDEXES['picks_recid'] = """CREATE INDEX 'picks_recid'
+    ON 'picks' (recid)"""
+
+INDEXES['picks_offset'] = """CREATE INDEX 'picks_offset'
+    ON 'picks' (offset)"""
+
+# covers filtering picks by branch and joining to picks on event
+INDEXES['events_branch'] = """CREATE INDEX 'events_branch'
+    ON 'events' (branchid, subid, event)"""
+
+
+# finds changes to a row since a version
+INDEXES['changes_key'] = """CREATE INDEX 'changes_key'
+    ON 'changes' (tablename, event, srcid, recid)"""
+
+
 # Views for building VM Tomography input files
 VMTOMO_VIEWS = {}
 
@@ -46,3 +73,74 @@ VMTOMO_VIEWS['vmtomo_sources'] = """CREATE VIEW 'vmtomo_sources'
 VMTOMO_VIEWS['vmtomo_picks'] = """CREATE VIEW 'vmtomo_picks'
     AS SELECT recid, srcid, branchid, subid, offset, time, error FROM
     'master_picks'"""
+
+
+# R*-tree indexes of source and receiver coordinates. Rows are kept in sync
+# with the point tables by triggers.
+RTREE_TABLES = {}
+RTREE_TABLES['sources_rtree'] = """CREATE VIRTUAL TABLE 'sources_rtree'
+    USING rtree(id, minx, maxx, miny, maxy)"""
+
+RTREE_TABLES['receivers_rtree'] = """CREATE VIRTUAL TABLE 'receivers_rtree'
+    USING rtree(id, minx, maxx, miny, maxy)"""
+
+RTREE_TRIGGERS = {}
+RTREE_TRIGGERS['sources_rtree_insert'] = """CREATE TRIGGER
+    'sources_rtree_insert' AFTER INSERT ON 'sources' BEGIN
+    INSERT OR REPLACE INTO 'sources_rtree'
+    VALUES (NEW.srcid, NEW.srcx, NEW.srcx, NEW.srcy, NEW.srcy); END"""
+
+RTREE_TRIGGERS['sources_rtree_update'] = """CREATE TRIGGER
+    'sources_rtree_update' AFTER UPDATE ON 'sources' BEGIN
+    DELETE FROM 'sources_rtree' WHERE id=OLD.srcid;
+    INSERT OR REPLACE INTO 'sources_rtree'
+    VALUES (NEW.srcid, NEW.srcx, NEW.srcx, NEW.srcy, NEW.srcy); END"""
+
+RTREE_TRIGGERS['sources_rtree_delete'] = """CREATE TRIGGER
+    'sources_rtree_delete' AFTER DELETE ON 'sources' BEGIN
+    DELETE FROM 'sources_rtree' WHERE id=OLD.srcid; END"""
+
+RTREE_TRIGGERS['receivers_rtree_insert'] = """CREATE TRIGGER
+    'receivers_rtree_insert' AFTER INSERT ON 'receivers' BEGIN
+    INSERT OR REPLACE INTO 'receivers_rtree'
+    VALUES (NEW.recid, NEW.recx, NEW.recx, NEW.recy, NEW.recy); END"""
+
+RTREE_TRIGGERS['receivers_rtree_update'] = """CREATE TRIGGER
+    'receivers_rtree_update' AFTER UPDATE ON 'receivers' BEGIN
+    DELETE FROM 'receivers_rtree' WHERE id=OLD.recid;
+    INSERT OR REPLACE INTO 'receivers_rtree'
+    VALUES (NEW.recid, NEW.recx, NEW.recx, NEW.recy, NEW.recy); END"""
+
+RTREE_TRIGGERS['receivers_rtree_delete'] = """CREATE TRIGGER
+    'receivers_rtree_delete' AFTER DELETE ON 'receivers' BEGIN
+    DELETE FROM 'receivers_rtree' WHERE id=OLD.recid; END"""
+
+
+# Triggers that log changes to rows, by the fields that identify each row
+CHANGE_KEYS = {'events': ['event'], 'sources': ['srcid'],
+               'receivers': ['recid'], 'picks': ['event', 'srcid', 'recid']}
+
+CHANGE_TRIGGERS = {}
+for _table, _keys in CHANGE_KEYS.items():
+    _fields = ', '.join(_keys)
+    _old = ', '.join(['OLD.' + k for k in _keys])
+    _new = ', '.join(['NEW.' + k for k in _keys])
+    _log = "INSERT INTO 'changes' (tablename, action, {:})".format(_fields)
+
+    CHANGE_TRIGGERS[_table + '_log_insert'] = """CREATE TRIGGER
+    '{0}_log_insert' AFTER INSERT ON '{0}' BEGIN
+    {1} VALUES ('{0}', 'insert', {2}); END""".format(_table, _log, _new)
+
+    # changing the key of a row removes the row with the old key
+    CHANGE_TRIGGERS[_table + '_log_update'] = """CREATE TRIGGER
+    '{0}_log_update' AFTER UPDATE ON '{0}' BEGIN
+    {1} SELECT '{0}', 'delete', {2} WHERE {3};
+    {1} VALUES ('{0}', 'update', {4}); END""".format(_table, _log, _old,
+            ' OR '.join(['OLD.{0} IS NOT NEW.{0}'.format(k) for k in _keys]),
+            _new)
+
+    CHANGE_TRIGGERS[_table + '_log_delete'] = """CREATE TRIGGER
+    '{0}_log_delete' AFTER DELETE ON '{0}' BEGIN
+    {1} VALUES ('{0}', 'delete', {2}); END""".format(_table, _log, _old)
+
+del _table, _keys, _fields, _old, _new, _log
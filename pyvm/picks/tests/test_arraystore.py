@@ -0,0 +1,135 @@
+"""
+Test suite for the arraystore module
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+import unittest
+import numpy as np
+from pyvm.picks import arraystore
+from pyvm.picks.pickdb import PickDatabase
+from pyvm.db.backends.sqlite3.connection import DatabaseIntegrityError
+
+
+def _build(db):
+    db.add_event('Pg', branchid=2)
+    db.add_event('Pn', branchid=3, subid=1, description='Moho refraction')
+    db.add_sources([(15000 + i, 0.5 * i, 1.0, 0.006) for i in range(10)])
+    db.add_receivers([(101, 0.0, 1.0, 2.0), (102, 5.0, 1.0, 2.1)])
+    db.add_picks([('Pg', 15000 + i, 101, 1. + 0.1 * i, 0.01)
+                  for i in range(10)])
+    db.add_picks({'event': np.array(['Pn'] * 5),
+                  'srcid': 15000 + np.arange(5), 'recid': np.array([102] * 5),
+                  'time': 3. + 0.1 * np.arange(5)})
+    return db
+
+
+class ArrayPickDatabaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pickdb = _build(PickDatabase())
+        self.db = _build(arraystore.ArrayPickDatabase())
+
+    def test_add(self):
+        """
+        Should add rows and enforce unique keys and references
+        """
+        for table, n in [('events', 2), ('sources', 10), ('receivers', 2),
+                         ('picks', 15), ('master_picks', 15)]:
+            self.assertEqual(self.db.count(table), n)
+        self.assertEqual(list(self.db.events['description']),
+                         ['', 'Moho refraction'])
+
+        self.assertRaises(DatabaseIntegrityError, self.db.add_source,
+                          15000, 0., 0., 0.)
+        self.assertRaises(DatabaseIntegrityError, self.db.add_pick,
+                          'Pg', 15000, 101, 1.)
+        self.assertRaises(DatabaseIntegrityError, self.db.add_pick,
+                          'Sg', 15000, 101, 1.)
+        # should add nothing if any row conflicts
+        self.assertRaises(DatabaseIntegrityError, self.db.add_receivers,
+                          [(103, 0., 0., 0.), (101, 0., 0., 0.)])
+        self.assertEqual(self.db.count('receivers'), 2)
+        self.db.add_receiver(103, 0., 0., 0.)
+
+        # should keep or replace existing rows
+        self.assertEqual(self.db.add_picks([('Pg', 15000, 101, 9.),
+                                            ('Pg', 15000, 103, 9.)],
+                                           conflict='ignore'), 1)
+        self.db.add_pick('Pg', 15001, 101, 8., replace=True)
+        self.assertEqual(self.db.count('picks', time__gt=5), 2)
+        self.assertEqual(self.db.count('picks'), 16)
+
+        # should update offsets of moved sources
+        self.db.add_source(15001, 3., 5., 0., replace=True)
+        picks = self.db.select('picks', srcid=15001, order_by='recid')
+        np.testing.assert_almost_equal(picks['offset'], [5., 4.47213595])
+
+    def test_select(self):
+        """
+        Should select the same picks as SQLite databases
+        """
+        queries = [{}, {'event': 'Pn'}, {'srcid': [15001, 15003]},
+                   {'srcid__ne': [15001, 15003], 'branchid': 2},
+                   {'offset__between': (1., 3.)}, {'srcx__lt': 2.},
+                   {'time__gte': 1.5, 'recid': 101}]
+        sql = 'SELECT * FROM master_picks'
+        for query in queries:
+            self.assertEqual(self.db.count('master_picks', **query),
+                             self.pickdb.count('master_picks', **query))
+            expected = self.pickdb.select('master_picks',
+                                          order_by=['srcid', 'recid'],
+                                          **query).fetchall()
+            data = self.db.select('master_picks',
+                                  order_by=['srcid', 'recid'], **query)
+            self.assertEqual(data.dtype.names,
+                             tuple(arraystore.MASTER_PICKS_FIELDS))
+            self.assertEqual([tuple(r) for r in data.tolist()],
+                             [tuple(r) for r in expected])
+        self.assertEqual(len(self.db.select('sources', limit=3)), 3)
+        self.assertEqual(self.db.count('sources', srcx__gt=2.), 5)
+        self.assertRaises(ValueError, self.db.count, 'picks', srcx=1.)
+        self.assertRaises(ValueError, self.db.count, 'picks', time__xx=1.)
+
+    def test_to_vmtomo(self):
+        """
+        Should format the same VM Tomography data as SQLite databases
+        """
+        # add picks out of order
+        for db in [self.db, self.pickdb]:
+            db.add_picks([('Pn', 15007, 101, 2.5, 0.01),
+                          ('Pn', 15009, 102, 3.9, 0.01),
+                          ('Pg', 15003, 102, 2.2, 0.01)])
+        for query in [{}, {'event': 'Pn'}, {'offset_max': 2.},
+                      {'recid': 101, 'header': True, 'sep': ' '},
+                      {'srcid__ne': [15001, 15003], 'time__gte': 1.5},
+                      {'branchid': 3, 'offset_min': 1.}]:
+            output = self.db.to_vmtomo(chunksize=4, **query)
+            expected = self.pickdb.to_vmtomo(**query)
+            self.assertEqual(output, expected)
+
+    def test_convert(self):
+        """
+        Should copy data to and from SQLite databases
+        """
+        db = arraystore.ArrayPickDatabase.from_pickdb(self.pickdb)
+        self.assertEqual(db.to_vmtomo(), self.db.to_vmtomo())
+        db.add_pick('Pn', 15009, 102, 4.)
+        self.assertEqual(db.count('picks', event='Pn'), 6)
+
+        pickdb = db.to_pickdb()
+        for table in ['events', 'sources', 'receivers', 'picks']:
+            self.assertEqual(pickdb.count(table), db.count(table))
+        sql = 'SELECT * FROM master_picks ORDER BY srcid, recid'
+        self.assertEqual([tuple(r) for r in pickdb.execute(sql)],
+                         [tuple(r) for r in db.select(
+                             'master_picks', order_by=['srcid', 'recid'])
+                          .tolist()])
+
+
+def suite():
+    testSuite = unittest.makeSuite(ArrayPickDatabaseTestCase, 'test')
+
+    return testSuite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,102 @@
+"""
+Test suite for the asyncdb module
+"""
+from __future__ import (absolute_import, division, print_function,
+        unicode_literals)
+
+import os
+import shutil
+import tempfile
+import unittest
+from pyvm.db.backends.sqlite3.connection import DatabaseError
+from pyvm.picks import asyncdb
+
+
+@unittest.skipIf(asyncdb.asyncio is None, 'requires asyncio')
+class AsyncPickDatabaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.loop = asyncdb.asyncio.new_event_loop()
+        self.db = asyncdb.AsyncPickDatabase(os.path.join(self.tmpdir,
+                                                         'picks.sqlite'),
+                                            max_workers=3, loop=self.loop,
+                                            spatial=True)
+
+    def tearDown(self):
+        self.db.close()
+        self.loop.close()
+        shutil.rmtree(self.tmpdir)
+
+    def run_loop(self, future):
+        return self.loop.run_until_complete(future)
+
+    def test_queries(self):
+        """
+        Should run inserts and concurrent queries off the event loop
+        """
+        self.run_loop(self.db.add_event('Pg'))
+        self.run_loop(self.db.add_sources([(15000 + i, 1. * i, 0., 0.)
+                                           for i in range(10)]))
+        self.run_loop(self.db.add_receivers([(100 + i, 0., 0., 0.)
+                                             for i in range(5)]))
+        self.run_loop(self.db.add_picks([('Pg', 15000 + i, 100 + j, 1.)
+                                         for i in range(10)
+                                         for j in range(5)]))
+
+        counts = self.run_loop(asyncdb.asyncio.gather(
+            *[self.db.count('picks', recid=100 + j) for j in range(5)]))
+        self.assertEqual(counts, [10] * 5)
+
+        outputs = self.run_loop(asyncdb.asyncio.gather(
+            self.db.to_vmtomo(recid=101), self.db.read_table('sources'),
+            self.db.read_sql('SELECT * FROM picks'),
+            self.db.picks_in_box(-1, 2.5, -1, 1)))
+        self.assertEqual(len(outputs[0][2].split('\n')[0:-1]), 10)
+        self.assertEqual(len(outputs[1]), 10)
+        self.assertEqual(len(outputs[2]), 50)
+        self.assertEqual(len(outputs[3]), 15)
+
+    def test_iterate(self):
+        """
+        Should iterate over chunks of rows
+        """
+        self.run_loop(self.db.add_sources([(15000 + i, 1. * i, 0., 0.)
+                                           for i in range(25)]))
+        chunks = self.db.iterate('SELECT srcid FROM sources WHERE srcid>?',
+                                 (15001,), chunksize=10)
+        self.assertTrue(chunks.__aiter__() is chunks)
+        sizes = []
+        while True:
+            try:
+                sizes.append(len(self.run_loop(chunks.__anext__())))
+            except StopAsyncIteration:
+                break
+        self.assertEqual(sizes, [10, 10, 3])
+        self.assertTrue(chunks._connection is None)
+        self.assertRaises(StopAsyncIteration, self.run_loop,
+                          chunks.__anext__())
+
+        # should pass on errors from the query and close the connection
+        chunks = self.db.iterate('SELECT * FROM missing')
+        self.assertRaises(DatabaseError, self.run_loop, chunks.__anext__())
+        self.assertTrue(chunks._connection is None)
+
+        # should close connections of unfinished iterators with the database
+        chunks = self.db.iterate('SELECT srcid FROM sources', chunksize=10)
+        self.run_loop(chunks.__anext__())
+        connection = chunks._connection
+        self.assertEqual(self.db._iterators, set([chunks]))
+        self.db.close()
+        self.assertTrue(chunks._connection is None)
+        self.assertEqual(len(self.db._iterators), 0)
+        self.assertRaises(DatabaseError, connection.execute, 'SELECT 1')
+
+
+def suite():
+    testSuite = unittest.makeSuite(AsyncPickDatabaseTestCase, 'test')
+
+    return testSuite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
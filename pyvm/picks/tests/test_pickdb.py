@@ -4,10 +4,16 @@ Test suite for the pickdb module
 from __future__ import (absolute_import, division, print_function,
         unicode_literals)
 
+import io
 import os
+import shutil
 import doctest
+import sqlite3
+import tempfile
 import unittest
+from multiprocessing.pool import ThreadPool
 import numpy as np
+import pandas as pd
 from pyvm.picks import pickdb
 
 class PickDatabaseTestCase(unittest.TestCase):
@@ -30,6 +36,33 @@ class PickDatabaseTestCase(unittest.TestCase):
         self.assertTrue('vmtomo_sources' in db.views)
         self.assertTrue('vmtomo_picks' in db.views)
 
+    def test_indexes(self):
+        """
+        Should create indexes for filtering picks
+        """
+        db = pickdb.PickDatabase()
+        self.assertEqual(sorted(db.indexes),
+                         ['changes_key', 'events_branch', 'picks_offset',
+                          'picks_recid', 'picks_srcid'])
+
+        # should use the indexes to filter master_picks
+        for field, index in [('srcid', 'picks_srcid'),
+                             ('recid', 'picks_recid'),
+                             ('branchid', 'events_branch')]:
+            sql = 'SELECT * FROM master_picks WHERE {:}=?'.format(field)
+            plan = db.explain(sql, (1,))
+            self.assertTrue(plan['detail'].str.contains(index).any())
+
+        # should drop and create indexes
+        db.drop_index('picks_srcid')
+        self.assertFalse('picks_srcid' in db.indexes)
+        db.create_index('picks_srcid', 'picks', ['srcid'])
+        self.assertTrue('picks_srcid' in db.indexes)
+
+        # should gather statistics
+        db.analyze()
+        self.assertTrue('sqlite_stat1' in db.tables)
+
     def test_add_event(self):
         """
         Should add a new event to the database
@@ -95,6 +128,382 @@ class PickDatabaseTestCase(unittest.TestCase):
         self.assertRaises(Exception, db.add_pick, 'Pn', 9999, 101, 5.34, 0.05)
         self.assertRaises(Exception, db.add_pick, 'Pn', 15001, 9999, 5.34, 0.05)
 
+    def test_add_many(self):
+        """
+        Should add many sources, receivers, and picks at once
+        """
+        db = pickdb.PickDatabase()
+        db.add_event('Pn')
+
+        # should accept arrays
+        nsrc = db.add_sources(np.column_stack((np.arange(15000, 15010),
+                                               np.zeros((10, 3)))))
+        self.assertEqual(nsrc, 10)
+        self.assertEqual(list(db.sources['srcid']), list(range(15000, 15010)))
+
+        # should accept data frames with fields in any order
+        receivers = pd.DataFrame({'recz': [2., 2.], 'recid': [101, 102],
+                                  'recx': [0., 1.], 'recy': [0., 0.]})
+        self.assertEqual(db.add_receivers(receivers), 2)
+        self.assertEqual(list(db.receivers['recx']), [0., 1.])
+
+        # should accept lists and default the pick error
+        picks = [('Pn', 15000 + i, 101, 5. + i) for i in range(10)]
+        self.assertEqual(db.add_picks(picks, fast=True), 10)
+        self.assertEqual(list(db.picks['error']), [0.] * 10)
+
+        # should add none of the picks if one conflicts
+        picks = [('Pn', 15000, 102, 1.), ('Pn', 15000, 101, 9.)]
+        self.assertRaises(Exception, db.add_picks, picks)
+        self.assertEqual(len(db.picks), 10)
+
+        # should add none of the picks if one is missing a source
+        picks = [('Pn', 15000, 102, 1.), ('Pn', 99999, 102, 1.)]
+        self.assertRaises(Exception, db.add_picks, picks)
+        self.assertEqual(len(db.picks), 10)
+
+        # should keep or replace conflicting picks
+        picks = [('Pn', 15000, 102, 1.), ('Pn', 15000, 101, 9.)]
+        self.assertEqual(db.add_picks(picks, conflict='ignore'), 1)
+        self.assertEqual(db.count('picks', recid=101, srcid=15000), 1)
+        self.assertEqual(db.execute('SELECT time FROM picks'
+            ' WHERE srcid=15000 AND recid=101').fetchone()[0], 5.)
+        self.assertEqual(db.add_picks(picks, conflict='replace'), 2)
+        self.assertEqual(db.execute('SELECT time FROM picks'
+            ' WHERE srcid=15000 AND recid=101').fetchone()[0], 9.)
+        self.assertRaises(ValueError, db.add_picks, picks, conflict='xxx')
+
+    def test_offsets(self):
+        """
+        Should store source-receiver offsets with picks
+        """
+        db = pickdb.PickDatabase()
+        db.add_event('Pg')
+        db.add_sources([(15000 + i, 3. * i, 4. * i, 0.) for i in range(5)])
+        db.add_receiver(101, 0., 0., 2.)
+        db.add_pick('Pg', 15001, 101, 1.)
+        db.add_picks([('Pg', 15000 + i, 101, 1.) for i in [0, 2, 3, 4]])
+
+        sql = 'SELECT offset FROM master_picks ORDER BY srcid'
+        self.assertEqual([r[0] for r in db.execute(sql)],
+                         [0., 5., 10., 15., 20.])
+
+        # should provide an offset function for queries
+        self.assertEqual(db.execute('SELECT offset(0, 0, 6, 8)').fetchone()[0],
+                         10.)
+
+        # should update offsets for replaced sources and receivers
+        db.add_source(15001, 0., 1., 0., replace=True)
+        db.add_receivers([(101, 0., 0., 0.)], conflict='replace')
+        self.assertEqual([r[0] for r in db.execute(sql)],
+                         [0., 1., 10., 15., 20.])
+        db.add_receiver(101, 0., -2., 0., replace=True)
+        db.add_sources([(15004, 0., 2., 0.)], conflict='replace')
+        np.testing.assert_allclose([r[0] for r in db.execute(sql)],
+                [2., 3., np.hypot(6., 10.), np.hypot(9., 14.), 4.])
+
+        # should select picks by offset with the offset index
+        _, _, picks = db.to_vmtomo(offset_min=3, offset_max=12)
+        self.assertEqual(len(picks.split('\n')[0:-1]), 3)
+        _, _, picks = db.to_vmtomo(offset_max=10, srcid=15001)
+        self.assertEqual(len(picks.split('\n')[0:-1]), 1)
+        plan = db.explain('SELECT * FROM master_picks WHERE offset>=?', (3,))
+        self.assertTrue(plan['detail'].str.contains('picks_offset').any())
+
+    def test_migrate_offsets(self):
+        """
+        Should add offsets to databases without an offset column
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'old.sqlite')
+            db = sqlite3.connect(filename)
+            db.execute("""CREATE TABLE 'picks' (event TEXT, srcid INTEGER,
+                recid INTEGER, time REAL, error REAL DEFAULT 0.0,
+                PRIMARY KEY (event, srcid, recid))""")
+            db.execute("""CREATE VIEW 'master_picks' AS SELECT picks.event,
+                0.0 AS offset FROM picks""")
+            db.execute("CREATE TABLE 'sources' (srcid INTEGER, srcx FLOAT,"
+                       " srcy FLOAT, srcz FLOAT, PRIMARY KEY (srcid))")
+            db.execute("CREATE TABLE 'receivers' (recid INTEGER, recx FLOAT,"
+                       " recy FLOAT, recz FLOAT, PRIMARY KEY (recid))")
+            db.execute("CREATE TABLE 'events' (event TEXT NOT NULL,"
+                       " branchid INTEGER DEFAULT 0, subid INTEGER DEFAULT 0,"
+                       " description TEXT, PRIMARY KEY (event))")
+            db.execute("INSERT INTO events VALUES ('Pg', 0, 0, '')")
+            db.execute("INSERT INTO sources VALUES (15000, 3., 4., 0.)")
+            db.execute("INSERT INTO receivers VALUES (101, 0., 0., 0.)")
+            db.execute("INSERT INTO picks VALUES ('Pg', 15000, 101, 1., 0.)")
+            db.commit()
+            db.close()
+
+            db = pickdb.PickDatabase(filename)
+            self.assertEqual(tuple(db.execute('SELECT srcid, recid, offset'
+                                   ' FROM master_picks').fetchone()),
+                             (15000, 101, 5.))
+            self.assertTrue('picks_offset' in db.indexes)
+            db.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_select(self):
+        """
+        Should count and select rows with parameterized searches
+        """
+        db = pickdb.PickDatabase()
+        db.add_event('Pg')
+        db.add_event("P'n")
+        db.add_sources([(15000 + i, 1. * i, 0., 0.) for i in range(10)])
+        db.add_receiver(101, 0., 0., 0.)
+        db.add_picks([('Pg', 15000 + i, 101, 1. + i) for i in range(10)])
+        db.add_pick("P'n", 15000, 101, 2.)
+
+        self.assertEqual(db.count('picks'), 11)
+        self.assertEqual(db.count('picks', event="P'n"), 1)
+        self.assertEqual(db.count('picks', srcid=[15001, 15002]), 2)
+        self.assertEqual(db.count('picks', time__gt=5.), 5)
+        self.assertEqual(db.count('master_picks', offset__between=(2, 4)), 3)
+        self.assertRaises(ValueError, db.count, 'picks; DROP TABLE picks')
+
+        rows = db.select('picks', fields=['srcid', 'time'], order_by='time',
+                         limit=3, event='Pg').fetchall()
+        self.assertEqual([tuple(r) for r in rows],
+                         [(15000, 1.), (15001, 2.), (15002, 3.)])
+        rows = db.select('picks', fields=['event'], distinct=True,
+                         order_by=['event']).fetchall()
+        self.assertEqual([r[0] for r in rows], ["P'n", 'Pg'])
+
+        _, _, picks = db.to_vmtomo(event=["P'n"], srcid__lt=15003)
+        self.assertEqual(len(picks.split('\n')[0:-1]), 1)
+
+    def test_read_arrays(self):
+        """
+        Should read query results into typed numpy arrays
+        """
+        db = pickdb.PickDatabase()
+        db.add_event('Pg', branchid=2)
+        db.add_sources([(15000 + i, 1. * i, 0., 0.) for i in range(25)])
+        db.add_receiver(101, 0., 0., 0.)
+        db.add_picks([('Pg', 15000 + i, 101, 1. + i, 0.1) for i in range(25)])
+
+        sql = 'SELECT event, srcid, branchid, offset, time FROM master_picks'
+        sql += ' WHERE srcid>=? ORDER BY srcid'
+        data = db.read_arrays(sql, (15005,), chunksize=7)
+        self.assertEqual(data.dtype.names,
+                         ('event', 'srcid', 'branchid', 'offset', 'time'))
+        self.assertEqual(data['srcid'].dtype, np.int64)
+        self.assertEqual(data['time'].dtype, np.float64)
+        self.assertEqual(data['event'].dtype, np.object_)
+        np.testing.assert_equal(data['srcid'], np.arange(15005, 15025))
+        np.testing.assert_equal(data['time'] - data['offset'], 1.)
+
+        # should convert integer fields with NULL values to floats
+        sql = 'SELECT srcid, CASE WHEN srcid>15010 THEN NULL ELSE srcid END'
+        sql += ' AS x FROM sources ORDER BY srcid'
+        data = db.read_arrays(sql, chunksize=10)
+        self.assertEqual(data['x'].dtype, np.float64)
+        self.assertEqual(np.isnan(data['x']).sum(), 14)
+
+        # should convert fields to objects for text after NULL values
+        sql = 'SELECT srcid, CASE WHEN srcid>15010 THEN \'a\' END AS x'
+        sql += ' FROM sources ORDER BY srcid'
+        data = db.read_arrays(sql, chunksize=10)
+        self.assertEqual(len(data), 25)
+        self.assertEqual(data['x'].dtype, np.object_)
+        self.assertEqual(list(data['x'][[5, 10, 11, 24]]),
+                         [None, None, 'a', 'a'])
+        np.testing.assert_equal(data['srcid'], np.arange(15000, 15025))
+
+        # should use given types and return empty arrays
+        data = db.read_arrays('SELECT srcid, srcx FROM sources WHERE srcid<0',
+                              dtypes={'srcid': np.int32})
+        self.assertEqual(len(data), 0)
+        self.assertEqual(data['srcid'].dtype, np.int32)
+
+        # should read tables without row objects
+        self.assertEqual(list(db.events.columns),
+                         ['event', 'branchid', 'subid', 'description'])
+        self.assertEqual(len(db.picks), 25)
+        self.assertEqual(len(pickdb.PickDatabase().picks), 0)
+
+    def test_cache(self):
+        """
+        Should cache reads until data changes
+        """
+        db = pickdb.PickDatabase()
+        db.add_event('Pg')
+        db.add_sources([(15000 + i, 1. * i, 0., 0.) for i in range(10)])
+        db.add_receiver(101, 0., 0., 0.)
+
+        sources = db.sources
+        self.assertEqual(db.cache.misses, 1)
+        # should share read-only data with cached results
+        with self.assertRaises(ValueError):
+            sources['srcx'].values[0] = -1
+        sources['srcx'] = -1
+        sources['offset'] = -1
+        self.assertFalse('offset' in db.sources)
+        self.assertEqual(list(db.sources['srcx']), [1. * i for i in range(10)])
+        self.assertEqual(db.cache.hits, 2)
+        writeable = db.sources.copy()
+        writeable['srcx'] = -1
+        self.assertEqual(list(db.sources['srcx']), [1. * i for i in range(10)])
+        self.assertEqual(db.cache.hits, 4)
+
+        sql = 'SELECT srcid FROM sources WHERE srcid>?'
+        self.assertEqual(len(db.read_arrays(sql, (15004,))), 5)
+        self.assertEqual(len(db.read_arrays(sql, (15004,))), 5)
+        self.assertEqual(len(db.read_arrays(sql, (15007,))), 2)
+        self.assertFalse(db.read_arrays(sql, (15007,)).flags.writeable)
+        self.assertEqual(db.cache.hits, 6)
+
+        # should read changed data after every kind of write
+        for write in [lambda: db.add_source(15010, 0., 0., 0.),
+                      lambda: db.add_sources([(15011, 0., 0., 0.)]),
+                      lambda: db.add_source(15011, 1., 0., 0., replace=True),
+                      lambda: db.execute('DELETE FROM sources'
+                                         ' WHERE srcid=15011')]:
+            nsources = len(db.sources)
+            write()
+            self.assertNotEqual(len(db.sources) + db.sources['srcx'].sum(),
+                                nsources + sources['srcx'].sum())
+            sources = db.sources
+        self.assertEqual(len(db.read_arrays(sql, (15004,))), 6)
+
+        # should stay within the memory budget
+        db.cache.max_bytes = db.cache.nbytes
+        db.picks
+        self.assertTrue(db.cache.nbytes <= db.cache.max_bytes)
+        db.clear_cache()
+        self.assertEqual(len(db.cache), 0)
+
+        # should not cache with no memory budget
+        db = pickdb.PickDatabase(cache_size=0)
+        db.events
+        self.assertEqual(len(db.cache), 0)
+
+    def test_spatial_queries(self):
+        """
+        Should select points and picks by location
+        """
+        # should only index points in spatial databases
+        db = pickdb.PickDatabase()
+        self.assertFalse(db.RTREE)
+        self.assertFalse('sources_rtree' in db.tables)
+        self.assertRaises(ValueError, db.sources_in_box, 0., 1., 0., 1.)
+
+        db = pickdb.PickDatabase(spatial=True)
+        self.assertTrue(db.RTREE)
+        db.add_event('Pg')
+        db.add_sources([(15000 + i, 1. * i, 0.1 * i, 0.) for i in range(50)])
+        db.add_receivers([(100 + i, 10. * i, 0., 0.) for i in range(5)])
+        db.add_picks([('Pg', 15000 + i, 100 + j, 1.)
+                      for i in range(50) for j in range(5)])
+
+        sources = db.sources_in_box(10., 12.5, 0., 10.)
+        self.assertEqual(list(sources['srcid']), [15010, 15011, 15012])
+        receivers = db.receivers_in_box(-1., 20., -1., 1.)
+        self.assertEqual(list(receivers['recid']), [100, 101, 102])
+        sources = db.sources_in_radius(20., 2., 1.5)
+        self.assertEqual(list(sources['srcid']), [15019, 15020, 15021])
+        receivers = db.receivers_in_radius(25., 0., 5.)
+        self.assertEqual(list(receivers['recid']), [102, 103])
+
+        # should select picks by source and/or receiver location
+        picks = db.picks_in_box(10., 12.5, 0., 10.)
+        self.assertEqual(sorted(set(zip(picks['srcid'], picks['recid']))),
+                         [(15010, 101), (15011, 101), (15012, 101)])
+        self.assertEqual(len(db.picks_in_box(10., 12.5, 0., 10.,
+                                             which='sources')), 15)
+        self.assertEqual(len(db.picks_in_box(10., 12.5, 0., 10.,
+                                             which='receivers')), 50)
+        self.assertEqual(len(db.picks_in_box(10., 12.5, 0., 10.,
+                                             which='either')), 62)
+        self.assertEqual(len(db.picks_in_radius(0., 0., 1.)), 1)
+        self.assertRaises(ValueError, db.picks_in_box, 0, 1, 0, 1,
+                          which='xxx')
+
+        # should keep the index in sync with updated points
+        db.add_source(15010, -100., -100., 0., replace=True)
+        db.execute('UPDATE sources SET srcx=11.9 WHERE srcid=15040')
+        db.execute('DELETE FROM picks WHERE srcid=15012')
+        db.execute('DELETE FROM sources WHERE srcid=15012')
+        sources = db.sources_in_box(10., 12.5, 0., 10.)
+        self.assertEqual(list(sources['srcid']), [15011, 15040])
+        self.assertEqual(len(db.sources_in_radius(-100., -100., 0.)), 1)
+        self.assertEqual(db.count('sources_rtree'), 49)
+
+        # should use the index
+        sql, params = db._points_in_box('sources', 10., 12.5, 0., 10.)
+        plan = db.explain(sql, params)
+        self.assertTrue(plan['detail'].str.contains('sources_rtree').any())
+
+    def test_pooled(self):
+        """
+        Should read from several threads with pooled connections
+        """
+        self.assertRaises(ValueError, pickdb.PickDatabase, pooled=True)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            db = pickdb.PickDatabase(os.path.join(tmpdir, 'picks.sqlite'),
+                                     pooled=True, spatial=True)
+            self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0],
+                             'wal')
+            db.add_event('Pg')
+            db.add_sources([(15000 + i, 1. * i, 0., 0.) for i in range(20)])
+            db.add_receivers([(100 + i, 0., 0., 0.) for i in range(6)])
+
+            def _write(recid):
+                db.add_picks([('Pg', 15000 + i, recid, 1. + i)
+                              for i in range(20)])
+                return db._reader() is db
+
+            def _read(recid):
+                _, _, picks = db.to_vmtomo(recid=recid)
+                return (db.count('picks', recid=recid),
+                        len(picks.split('\n')[0:-1]),
+                        len(db.read_arrays('SELECT * FROM picks WHERE'
+                                           ' recid=?', (recid,))),
+                        len(db.picks_in_box(-1, 1, -1, 1)),
+                        db._reader() is db)
+
+            pool = ThreadPool(4)
+            try:
+                # should write from any thread
+                self.assertEqual(pool.map(_write, range(100, 104)),
+                                 [False] * 4)
+                self.assertEqual(len(db.picks), 80)
+                # should read on separate connections in each thread
+                self.assertEqual(pool.map(_read, range(100, 104)),
+                                 [(20, 20, 20, 8, False)] * 4)
+            finally:
+                pool.close()
+                pool.join()
+            # should write from other threads while the opening thread
+            # reads from a snapshot
+            with db.snapshot():
+                self.assertTrue(db._reader() is not db)
+                self.assertEqual(db.count('picks'), 80)
+                pool = ThreadPool(2)
+                try:
+                    self.assertEqual(pool.map(_write, range(104, 106)),
+                                     [False] * 2)
+                finally:
+                    pool.close()
+                    pool.join()
+                self.assertEqual(db.count('picks'), 80)
+            self.assertTrue(db._reader() is db)
+            self.assertEqual(db.count('picks'), 120)
+            self.assertTrue(len(db._readers) > 0)
+            # should not write on read-only connections
+            reader = db._readers[0]
+            self.assertRaises(Exception, reader.execute,
+                              "DELETE FROM picks")
+            db.close()
+            self.assertEqual(db._readers, [])
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_to_vmtomo(self):
         """
         Should format data for VM Tomography
@@ -155,7 +564,278 @@ class PickDatabaseTestCase(unittest.TestCase):
         os.remove(picks_file)
 
 
-    
+    def test_to_vmtomo_streaming(self):
+        """
+        Should write the same data in chunks of any size
+        """
+        db = pickdb.PickDatabase()
+        db.add_event('Pg', branchid=2)
+        db.add_sources([(15000 + i, 0.1 * i, 1.0, 0.006) for i in range(25)])
+        db.add_receivers([(101, 0.0, 1.0, 2.0), (102, 5.0, 1.0, 2.1)])
+        db.add_picks([('Pg', 15000 + i, 101 + i % 2, 1. / 3. + i, 0.01)
+                      for i in range(25)])
+
+        output = db.to_vmtomo()
+        for chunksize in [1, 7, 100]:
+            self.assertEqual(db.to_vmtomo(chunksize=chunksize), output)
+
+        # should write floats that read back exactly
+        _, _, picks = db.to_vmtomo(srcid=15001)
+        self.assertEqual(picks, '102\t15001\t2\t0\t{!r}\t{!r}\t0.01\n'\
+                .format(db.execute('SELECT offset FROM picks'
+                                   ' WHERE srcid=15001').fetchone()[0],
+                        1. / 3. + 1))
+
+        # should write to buffers and files with optional headers
+        buf = io.StringIO()
+        self.assertEqual(db.to_vmtomo(sources_file=buf, header=True,
+                                      recid=102, sep=' ')[0], None)
+        lines = buf.getvalue().split('\n')
+        self.assertEqual(lines[0], 'srcid srcx srcy srcz')
+        self.assertEqual(len(lines), 14)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'pick.dat')
+            db.to_vmtomo(picks_file=filename)
+            with open(filename) as f:
+                self.assertEqual(f.read(), output[2])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_from_vmtomo(self):
+        """
+        Should read data formatted for VM Tomography
+        """
+        db = pickdb.PickDatabase()
+        db.add_event('Pg', branchid=2)
+        db.add_event('Pn', branchid=3, subid=1)
+        db.add_sources([(15000 + i, 0.5 * i, 1.0, 0.006) for i in range(10)])
+        db.add_receivers([(101, 0.0, 1.0, 2.0), (102, 5.0, 1.0, 2.1)])
+        db.add_picks([('Pg', 15000 + i, 101, 1. + 0.1 * i, 0.01)
+                      for i in range(10)])
+        db.add_picks([('Pn', 15000 + i, 102, 3. + 0.1 * i, 0.02)
+                      for i in range(5)])
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            files = [os.path.join(tmpdir, f) for f in
+                     ['shot.dat', 'inst.dat', 'pick.dat']]
+            db.to_vmtomo(*files)
+
+            # should read all rows in chunks and name new events
+            db1 = pickdb.PickDatabase()
+            self.assertEqual(db1.from_vmtomo(*files, chunksize=3),
+                             (10, 2, 15))
+            self.assertEqual(sorted(db1.events['event']), ['2.0', '3.1'])
+            for table in ['sources', 'receivers']:
+                np.testing.assert_equal(db1.read_table(table).values,
+                                        db.read_table(table).values)
+            sql = 'SELECT branchid, subid, srcid, recid, time, error'
+            sql += ' FROM master_picks ORDER BY srcid, recid'
+            self.assertEqual([tuple(r) for r in db1.execute(sql)],
+                             [tuple(r) for r in db.execute(sql)])
+
+            # should use existing events with the same branch IDs
+            db2 = pickdb.PickDatabase()
+            db2.add_event('Pg', branchid=2)
+            db2.from_vmtomo(*files)
+            self.assertEqual(sorted(db2.events['event']), ['3.1', 'Pg'])
+            self.assertEqual(db2.count('picks', event='Pg'), 10)
+
+            # should raise an error for existing picks, unless ignored
+            self.assertRaises(Exception, db2.from_vmtomo,
+                              picks_file=files[2])
+            self.assertEqual(db2.from_vmtomo(picks_file=files[2],
+                                             conflict='ignore'), (0, 0, 0))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_merge(self):
+        """
+        Should merge pick database files
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path0 = os.path.join(tmpdir, 'picker0.sqlite')
+            path1 = os.path.join(tmpdir, 'picker1.sqlite')
+            db0 = pickdb.PickDatabase(path0, spatial=True)
+            db1 = pickdb.PickDatabase(path1)
+            for db in [db0, db1]:
+                db.add_event('Pg', branchid=2)
+                db.add_sources([(15000 + i, 1. * i, 0., 0.)
+                                for i in range(5)])
+                db.add_receivers([(101, 0., 0., 0.)])
+            db0.add_picks([('Pg', 15000 + i, 101, 1., 0.1)
+                           for i in range(3)])
+            # second picker has a new event and receiver, a moved
+            # source, and a different time for one pick
+            db1.add_event('Pn', branchid=3)
+            db1.add_receivers([(102, 0., 3., 0.)])
+            db1.add_sources([(15004, 8., 0., 0.)], conflict='replace')
+            db1.add_picks([('Pg', 15002, 101, 1.5, 0.1),
+                           ('Pg', 15004, 101, 1., 0.1),
+                           ('Pn', 15000, 102, 2., 0.1)])
+            db1.commit()
+            db1.close()
+
+            # should merge nothing if there are conflicts
+            self.assertRaises(pickdb.DatabaseIntegrityError, db0.merge,
+                              path1, conflict='error')
+            self.assertEqual(db0.count('picks'), 3)
+            self.assertEqual(db0.count('events'), 1)
+
+            # should keep existing rows
+            db = pickdb.PickDatabase()
+            db.add_event('Pg', branchid=2)
+            db.add_sources([(15004, 0., 0., 0.)])
+            merged, conflicts = db.merge(path1, conflict='ignore')
+            self.assertEqual(conflicts, {'events': 0, 'sources': 1,
+                                         'receivers': 0, 'picks': 0})
+            self.assertEqual(merged, {'events': 1, 'sources': 4,
+                                      'receivers': 2, 'picks': 3})
+            self.assertEqual(db.select('picks', fields=['offset'],
+                                       srcid=15004).fetchone()[0], 0.)
+
+            # should replace conflicting rows and update offsets
+            db0.add_picks([('Pg', 15004, 101, 1., 0.1)])
+            merged, conflicts = db0.merge(path1)
+            self.assertEqual(conflicts, {'events': 0, 'sources': 1,
+                                         'receivers': 0, 'picks': 1})
+            self.assertEqual(merged, {'events': 1, 'sources': 1,
+                                      'receivers': 1, 'picks': 2})
+            self.assertEqual(db0.count('picks'), 5)
+            sql = 'SELECT srcid, recid, time, offset FROM picks'
+            sql += ' ORDER BY srcid, recid'
+            self.assertEqual([tuple(r) for r in db0.execute(sql)],
+                             [(15000, 101, 1., 0.), (15000, 102, 2., 3.),
+                              (15001, 101, 1., 1.), (15002, 101, 1.5, 2.),
+                              (15004, 101, 1., 8.)])
+            self.assertEqual(len(db0.sources_in_box(7, 9, -1, 1)), 1)
+            self.assertEqual(db0.execute('PRAGMA database_list')
+                             .fetchall()[-1][1], 'main')
+
+            # should skip rows that are already merged
+            merged, conflicts = db0.merge(path1, conflict='error')
+            self.assertEqual(sum(merged.values()), 0)
+            db0.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_changes(self):
+        """
+        Should log changes and export picks changed since a version
+        """
+        db = pickdb.PickDatabase(track_changes=True)
+        self.assertEqual(db.version, 0)
+        db.add_event('Pg', branchid=2)
+        db.add_sources([(15000 + i, 1. * i, 0., 0.) for i in range(5)])
+        db.add_receivers([(101, 0., 0., 0.), (102, 0., 1., 0.)])
+        db.add_picks([('Pg', 15000 + i, 101, 1., 0.1) for i in range(5)])
+        self.assertEqual(db.version, 13)
+        self.assertEqual(len(db.changes_since(0, table='picks')), 5)
+        version = db.version
+        self.assertEqual(db.to_vmtomo(since_version=version),
+                         ('', '', ''))
+
+        # should log new, changed, and removed rows
+        db.add_picks([('Pg', 15000, 101, 1.5, 0.1)], conflict='replace')
+        db.add_picks([('Pg', 15000, 102, 2., 0.1)])
+        db.execute('DELETE FROM picks WHERE srcid=15004')
+        db.execute('UPDATE picks SET recid=102 WHERE srcid=15003')
+        changes = db.changes_since(version)
+        self.assertEqual(changes['version'].tolist(),
+                         list(range(version + 1, version + 6)))
+        self.assertEqual(changes['action'].tolist(),
+                         ['insert', 'insert', 'delete', 'delete',
+                          'update'])
+        self.assertEqual(changes[['srcid', 'recid']].values.tolist(),
+                         [[15000, 101], [15000, 102], [15004, 101],
+                          [15003, 101], [15003, 102]])
+
+        # should export changed picks, and their sources and receivers
+        sources, receivers, picks = db.to_vmtomo(since_version=version,
+                                                 sep=' ')
+        self.assertEqual(sorted(np.loadtxt(io.StringIO(picks)).tolist()),
+                         [[101, 15000, 2, 0, 0., 1.5, 0.1],
+                          [102, 15000, 2, 0, 1., 2., 0.1],
+                          [102, 15003, 2, 0, 3., 1., 0.1]])
+        self.assertEqual(len(sources.split('\n')[:-1]), 2)
+        self.assertEqual(len(receivers.split('\n')[:-1]), 2)
+
+        # should export picks of moved sources
+        version = db.version
+        db.add_sources([(15001, 1., 2., 0.)], conflict='replace')
+        _, _, picks = db.to_vmtomo(since_version=version, recid=101,
+                                   sep=' ')
+        np.testing.assert_almost_equal(np.loadtxt(io.StringIO(picks)),
+                                       [101, 15001, 2, 0, 5 ** 0.5, 1., 0.1])
+
+        # versions should keep increasing after pruning the log
+        db.prune_changes()
+        self.assertEqual(len(db.changes_since(0)), 0)
+        db.add_event('Pn', branchid=3)
+        self.assertEqual(db.changes_since(0)['version'].tolist(),
+                         [db.version])
+        self.assertTrue(db.version > version)
+
+        # should not log changes unless tracking is enabled
+        db = pickdb.PickDatabase()
+        db.add_event('Pg', branchid=2)
+        self.assertEqual(db.version, 0)
+        self.assertEqual(len(db.changes_since(0)), 0)
+        self.assertRaises(ValueError, db.to_vmtomo, since_version=0)
+
+    def test_save_load(self):
+        """
+        Should save in-memory databases and load them into memory
+        """
+        db = pickdb.PickDatabase(track_changes=True, spatial=True)
+        db.add_event('Pg', branchid=2)
+        db.add_sources([(15000 + i, 1. * i, 0., 0.) for i in range(50)])
+        db.add_receivers([(101, 0., 0., 0.)])
+        db.add_picks([('Pg', 15000 + i, 101, 1., 0.1) for i in range(50)])
+        db.prune_changes(10)
+        sql = 'SELECT * FROM master_picks ORDER BY srcid'
+        picks = [tuple(r) for r in db.execute(sql)]
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'picks.sqlite')
+            steps = []
+            db.save(path, progress=lambda *args: steps.append(args))
+            self.assertTrue(len(steps) > 0)
+            self.assertEqual(steps[-1][1], 0)
+            # should replace existing files and not leave temporary files
+            db.add_receivers([(102, 1., 0., 0.)])
+            db.save(path)
+            self.assertEqual(os.listdir(tmpdir), ['picks.sqlite'])
+
+            for into_memory in [False, True]:
+                db1 = pickdb.PickDatabase.load(path, into_memory=into_memory,
+                                               track_changes=True,
+                                               spatial=True)
+                self.assertEqual([tuple(r) for r in db1.execute(sql)], picks)
+                self.assertEqual(db1.count('receivers'), 2)
+                self.assertEqual(len(db1.sources_in_box(-1, 4.5, -1, 1)), 5)
+                self.assertEqual(db1.version, db.version)
+                self.assertEqual(len(db1.changes_since(0)), db.version - 10)
+                db1.add_event('Pn', branchid=3)
+                self.assertEqual(db1.version, db.version + 1)
+                db1.close()
+            # changes to loaded databases should not be saved
+            self.assertEqual(pickdb.PickDatabase(path).count('events'), 1)
+
+            # should copy data without the backup API
+            db2 = pickdb.PickDatabase(track_changes=True)
+            db2._copy_from(path)
+            self.assertEqual([tuple(r) for r in db2.execute(sql)], picks)
+            self.assertEqual(db2.version, db.version)
+            self.assertEqual(len(db2.changes_since(0)), db.version - 10)
+            self.assertRaises(IOError, pickdb.PickDatabase.load,
+                              os.path.join(tmpdir, 'missing.sqlite'))
+        finally:
+            shutil.rmtree(tmpdir)
 
 
 def suite():
@@ -2,6 +2,8 @@
 Functions for loading example data
 """
 import os
+import sys
+import stat
 
 
 def get_test_data_dirs():
@@ -89,3 +91,31 @@ def get_resource_file(filename):
     msg = "Could not find file {:} in {:}".format(filename,
                                                   dirs())
     raise IOError(msg)
+
+
+def install_example_program(filename, directory, name=None):
+    """
+    Function to install an example Python script as an executable program.
+
+    Used to stand in for external programs (e.g., the raytracer) in tests.
+    The script is found with :func:`get_example_file` and run with the
+    current Python interpreter.
+
+    :param filename: File name of the example script.
+    :param directory: Directory to install the program to.
+    :param name: Optional. File name of the installed program. Default is
+        to use ``filename``.
+    :returns: Full path to the installed program.
+
+    >>> install_example_program('fake_slim_rays.py', '/tmp',
+    ...                         'slim_rays')  # doctest: +SKIP
+    /tmp/slim_rays
+    """
+    program = os.path.join(directory, name or filename)
+    with open(get_example_file(filename)) as fin:
+        src = fin.read()
+    with open(program, 'w') as fout:
+        fout.write('#!{:}\n'.format(sys.executable))
+        fout.write(src)
+    os.chmod(program, os.stat(program).st_mode | stat.S_IEXEC)
+    return program